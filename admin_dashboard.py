@@ -1,6 +1,5 @@
 import streamlit as st
 import pandas as pd
-import requests
 import json
 import logging
 from datetime import datetime, timedelta
@@ -12,12 +11,22 @@ from config import (
     get_dashboard_url, BOT_MESSAGES
 )
 from google_services import get_google_services
+from expense_aggregates import empty_summary
+from request_scheduler import request_priority, PRIORITY_LOW
 from auth_system import get_auth_manager
+from green_api_client import get_green_api_client
+from outbound_messages import get_outbound_scheduler
 
 logger = logging.getLogger(__name__)
 
 def main():
     """דשבורד אדמין ראשי"""
+    # הדשבורד רץ בעדיפות נמוכה כדי שה-webhook יקבל קדימות במכסות של גוגל
+    with request_priority(PRIORITY_LOW):
+        _render_dashboard()
+
+def _render_dashboard():
+    """תוכן הדשבורד"""
     
     # בדיקת אימות אדמין
     if not check_admin_auth():
@@ -212,6 +221,9 @@ def show_couples_management():
         st.info("📝 עדיין לא נוספו זוגות למערכת")
         return
     
+    # סיכומי ההוצאות של כל הזוגות בקריאה אחת
+    summaries = gs.get_expense_summaries([couple['group_id'] for couple in couples])
+    
     # הכנת DataFrame לתצוגה
     display_data = []
     for couple in couples:
@@ -219,9 +231,7 @@ def show_couples_management():
         phone2 = format_phone_display(couple.get('phone2', ''))
         
         # חישוב סטטיסטיקות
-        expenses = gs.get_expenses_by_group(couple['group_id'])
-        active_expenses = [exp for exp in expenses if exp.get('status') == 'active']
-        total_amount = sum(float(exp.get('amount', 0)) for exp in active_expenses)
+        summary = summaries.get(couple['group_id']) or empty_summary(couple['group_id'])
         
         display_data.append({
             'שם הזוג': couple.get('couple_name', ''),
@@ -229,8 +239,8 @@ def show_couples_management():
             'טלפון 2': phone2,
             'תאריך חתונה': couple.get('wedding_date', ''),
             'תקציב': f"{float(couple.get('budget', 0)):,.0f} ₪" if couple.get('budget') and couple.get('budget') != 'אין עדיין' else 'לא הוגדר',
-            'הוצאות': f"{total_amount:,.0f} ₪",
-            'קבלות': len(active_expenses),
+            'הוצאות': f"{summary['total_amount']:,.0f} ₪",
+            'קבלות': summary['count'],
             'סטטוס': '🟢 פעיל' if couple.get('status') == 'active' else '🔴 לא פעיל',
             'group_id': couple['group_id']
         })
@@ -423,14 +433,12 @@ def create_whatsapp_group(phone_numbers: List[str], group_name: str = None) -> D
             participants.append(whatsapp_id)
         
         # יצירת הקבוצה
-        url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/createGroup/{GREENAPI_TOKEN}"
-        
         payload = {
             "groupName": group_name,
             "chatIds": participants
         }
         
-        response = requests.post(url, json=payload, timeout=30)
+        response = get_green_api_client().post("createGroup", payload, timeout=30)
         
         if response.status_code == 200:
             data = response.json()
@@ -463,19 +471,10 @@ def send_welcome_message(group_id: str):
     """שליחת הודעת ברכה לקבוצה החדשה"""
     
     try:
-        url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/sendMessage/{GREENAPI_TOKEN}"
-        
-        payload = {
-            "chatId": group_id,
-            "message": BOT_MESSAGES["welcome"]
-        }
-        
-        response = requests.post(url, json=payload, timeout=10)
-        
-        if response.status_code == 200:
+        if get_outbound_scheduler().send_and_wait(group_id, BOT_MESSAGES["welcome"]):
             logger.info(f"Welcome message sent to group: {group_id}")
         else:
-            logger.warning(f"Failed to send welcome message: {response.status_code}")
+            logger.warning(f"Failed to send welcome message to group: {group_id}")
             
     except Exception as e:
         logger.error(f"Error sending welcome message: {e}")
@@ -505,19 +504,10 @@ def send_dashboard_link_to_couple(group_id: str):
         # שליחת הודעה
         message = BOT_MESSAGES["dashboard_link"].format(link=dashboard_url)
         
-        url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/sendMessage/{GREENAPI_TOKEN}"
-        
-        payload = {
-            "chatId": group_id,
-            "message": message
-        }
-        
-        response = requests.post(url, json=payload, timeout=10)
-        
-        if response.status_code == 200:
+        if get_outbound_scheduler().send_and_wait(group_id, message):
             st.success("✅ קישור דשבורד נשלח לזוג בWhatsApp")
         else:
-            st.error(f"❌ שגיאה בשליחת הודעה: {response.status_code}")
+            st.error("❌ שגיאה בשליחת הודעה")
             
     except Exception as e:
         logger.error(f"Error sending dashboard link: {e}")
@@ -527,34 +517,30 @@ def show_couple_expenses(group_id: str):
     """הצגת הוצאות זוג"""
     
     gs = get_google_services()
-    expenses = gs.get_expenses_by_group(group_id)
+    expense_table = gs.get_expense_table([group_id])
     
-    if not expenses:
+    if not len(expense_table):
         st.info("📝 עדיין אין הוצאות לזוג זה")
         return
     
-    active_expenses = [exp for exp in expenses if exp.get('status') == 'active']
+    active_expenses = expense_table.active_only().newest()
     
     st.markdown(f"### 💰 הוצאות זוג ({len(active_expenses)} קבלות)")
     
     # סיכום מהיר
-    total_amount = sum(float(exp.get('amount', 0)) for exp in active_expenses)
-    st.metric("סכום כולל", f"{total_amount:,.0f} ₪")
+    st.metric("סכום כולל", f"{active_expenses.total_amount():,.0f} ₪")
     
     # טבלת הוצאות
-    display_data = []
-    for exp in active_expenses:
-        display_data.append({
-            'תאריך': exp.get('date', ''),
-            'ספק': exp.get('vendor', ''),
-            'קטגוריה': exp.get('category', ''),
-            'סכום': f"{float(exp.get('amount', 0)):,.0f} ₪",
-            'תיאור': exp.get('description', ''),
-            'ביטחון AI': f"{exp.get('confidence', 0)}%"
+    expenses = active_expenses.frame
+    if len(expenses):
+        df = pd.DataFrame({
+            'תאריך': expenses['date'].dt.strftime('%Y-%m-%d').fillna(''),
+            'ספק': expenses['vendor'],
+            'קטגוריה': expenses['category'].astype(str),
+            'סכום': expenses['amount'].map('{:,.0f} ₪'.format),
+            'תיאור': expenses['description'],
+            'ביטחון AI': expenses['confidence'].map('{:.0f}%'.format)
         })
-    
-    if display_data:
-        df = pd.DataFrame(display_data)
         st.dataframe(df, use_container_width=True, hide_index=True)
 
 def deactivate_couple(group_id: str):
@@ -580,12 +566,12 @@ def export_couples_data():
         st.warning("אין נתונים לייצוא")
         return
     
+    summaries = gs.get_expense_summaries([couple['group_id'] for couple in couples])
+    
     # הכנת DataFrame
     export_data = []
     for couple in couples:
-        expenses = gs.get_expenses_by_group(couple['group_id'])
-        active_expenses = [exp for exp in expenses if exp.get('status') == 'active']
-        total_amount = sum(float(exp.get('amount', 0)) for exp in active_expenses)
+        summary = summaries.get(couple['group_id']) or empty_summary(couple['group_id'])
         
         export_data.append({
             'מזהה קבוצה': couple['group_id'],
@@ -594,8 +580,8 @@ def export_couples_data():
             'טלפון 2': couple.get('phone2', ''),
             'תאריך חתונה': couple.get('wedding_date', ''),
             'תקציב': couple.get('budget', ''),
-            'סכום הוצאות': total_amount,
-            'מספר קבלות': len(active_expenses),
+            'סכום הוצאות': summary['total_amount'],
+            'מספר קבלות': summary['count'],
             'תאריך יצירה': couple.get('created_at', ''),
             'פעילות אחרונה': couple.get('last_activity', ''),
             'סטטוס': couple.get('status', '')
@@ -622,17 +608,9 @@ def show_system_statistics():
         st.info("📊 אין עדיין נתונים לסטטיסטיקות")
         return
     
-    # חישוב סטטיסטיקות מתקדמות
-    all_expenses = []
-    couples_with_expenses = 0
-    
-    for couple in couples:
-        expenses = gs.get_expenses_by_group(couple['group_id'])
-        active_expenses = [exp for exp in expenses if exp.get('status') == 'active']
-        
-        if active_expenses:
-            couples_with_expenses += 1
-            all_expenses.extend(active_expenses)
+    # חישוב סטטיסטיקות מתקדמות - טבלה אחת לכל הזוגות
+    all_expenses = gs.get_expense_table([couple['group_id'] for couple in couples]).active_only()
+    couples_with_expenses = len(all_expenses.by_group())
     
     # כרטיסי סטטיסטיקות
     col1, col2, col3, col4 = st.columns(4)
@@ -647,7 +625,7 @@ def show_system_statistics():
         """, unsafe_allow_html=True)
     
     with col2:
-        total_amount = sum(float(exp.get('amount', 0)) for exp in all_expenses)
+        total_amount = all_expenses.total_amount()
         avg_amount = total_amount / len(couples) if couples else 0
         st.markdown(f"""
         <div class="metric-card">
@@ -666,8 +644,7 @@ def show_system_statistics():
         """, unsafe_allow_html=True)
     
     with col4:
-        high_confidence = len([exp for exp in all_expenses if exp.get('confidence', 0) >= 90])
-        confidence_rate = (high_confidence / len(all_expenses) * 100) if all_expenses else 0
+        confidence_rate = all_expenses.confidence_rate(90)
         st.markdown(f"""
         <div class="metric-card">
             <div class="metric-value">{confidence_rate:.1f}%</div>
@@ -676,16 +653,12 @@ def show_system_statistics():
         """, unsafe_allow_html=True)
     
     # גרף קטגוריות
-    if all_expenses:
+    if len(all_expenses):
         st.markdown("### 📊 התפלגות קטגוריות")
         
         import plotly.express as px
         
-        categories_data = {}
-        for exp in all_expenses:
-            category = exp.get('category', 'אחר')
-            amount = float(exp.get('amount', 0))
-            categories_data[category] = categories_data.get(category, 0) + amount
+        categories_data = all_expenses.by_category()
         
         if categories_data:
             fig = px.pie(
@@ -722,6 +695,14 @@ def show_system_settings():
             auth.cleanup_expired()
             st.success("✅ ניקוי הושלם")
         
+        if st.button("🗄️ ארכוב נתונים ישנים"):
+            with st.spinner("מעביר לארכיון..."):
+                result = gs.compact()
+            st.success(
+                f"✅ הועברו לארכיון {result['couples_archived']} זוגות "
+                f"ו-{result['expenses_archived']} הוצאות"
+            )
+        
         if st.button("📊 רענן נתונים"):
             st.rerun()
         
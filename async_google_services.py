@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from config import GOOGLE_ASYNC_WORKERS
+from storage_backend import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+class AsyncGoogleServices:
+    """מעטפת אסינכרונית למנגנון האחסון עבור ה-webhook
+    
+    gspread ו-googleapiclient חוסמים, ולכן כל קריאה רצה ב-thread pool מוגבל
+    ולא על ה-event loop - כך קריאה איטית ל-Sheets של זוג אחד לא עוצרת את
+    ה-webhooks של שאר הזוגות. גודל ה-pool מגביל כמה קריאות רצות במקביל, והמכסות
+    עצמן נאכפות במתזמן המשותף (request_scheduler).
+    """
+    
+    def __init__(self, backend: Optional[StorageBackend] = None, max_workers: int = GOOGLE_ASYNC_WORKERS):
+        self._backend = backend
+        self.max_workers = max(1, max_workers)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="google-io",
+            initializer=self._init_thread
+        )
+    
+    @property
+    def backend(self) -> StorageBackend:
+        """מנגנון האחסון הסינכרוני"""
+        if self._backend is None:
+            from google_services import get_google_services
+            self._backend = get_google_services()
+        return self._backend
+    
+    def _init_thread(self):
+        """חימום הלקוחות של thread חדש ב-pool (לקוח ה-Drive נפרד לכל thread)"""
+        try:
+            self.backend.prewarm_thread()
+        except Exception as e:
+            # חריגה ב-initializer שוברת את כל ה-pool
+            logger.warning(f"Failed to prewarm storage thread: {e}")
+    
+    def prewarm(self):
+        """הפעלת כל ה-threads של ה-pool מראש - כל אחד מחמם את עצמו ב-_init_thread
+        
+        ה-initializer איטי, ולכן אף thread לא פנוי בזמן ההגשות וכל הגשה פותחת thread חדש.
+        """
+        for _ in range(self.max_workers):
+            self.executor.submit(lambda: None)
+    
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """הרצת פונקציה חוסמת ב-thread pool
+        
+        ההקשר (contextvars) מועבר ל-thread, כך שעדיפות שנקבעה עם
+        request_priority נשמרת גם בקריאה לגוגל.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(func, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, context.run, call)
+    
+    async def _call(self, method: str, *args) -> Any:
+        """הרצת מתודה של מנגנון האחסון ב-thread pool - כולל האתחול הראשון שלו"""
+        return await self.run(lambda: getattr(self.backend, method)(*args))
+    
+    # ===== זוגות =====
+    
+    async def get_couple_by_group_id(self, group_id: str) -> Optional[Dict]:
+        """קבלת זוג לפי group_id"""
+        return await self._call('get_couple_by_group_id', group_id)
+    
+    async def update_couple_fields(self, group_id: str, fields: Dict[str, Any]) -> bool:
+        """עדכון כמה שדות של זוג"""
+        return await self._call('update_couple_fields', group_id, fields)
+    
+    # ===== הוצאות =====
+    
+    async def save_expense(self, expense_data: Dict) -> bool:
+        """שמירת הוצאה"""
+        return await self._call('save_expense', expense_data)
+    
+    async def get_expenses_by_group(self, group_id: str) -> List[Dict]:
+        """קבלת כל ההוצאות של זוג"""
+        return await self._call('get_expenses_by_group', group_id)
+    
+    async def get_expenses_grouped(self, group_ids: Optional[List[str]] = None) -> Dict[str, List[Dict]]:
+        """הוצאות של כמה זוגות בקריאה אחת"""
+        return await self._call('get_expenses_grouped', group_ids)
+    
+    async def get_expense_summary(self, group_id: str) -> Dict:
+        """סיכום ההוצאות של זוג"""
+        return await self._call('get_expense_summary', group_id)
+    
+    async def find_expense_by_image(self, group_id: str, image_sha256: str,
+                                    image_phash: str) -> Optional[Dict]:
+        """הוצאה קיימת של הזוג עם אותה תמונת קבלה"""
+        return await self._call('find_expense_by_image', group_id, image_sha256, image_phash)
+    
+    async def update_expense(self, expense_id: str, updates: Dict) -> bool:
+        """עדכון הוצאה"""
+        return await self._call('update_expense', expense_id, updates)
+    
+    async def delete_expense(self, expense_id: str) -> bool:
+        """מחיקת הוצאה"""
+        return await self._call('delete_expense', expense_id)
+    
+    # ===== קבצים =====
+    
+    async def upload_receipt_image(self, group_id: str, image_data: bytes, filename: str,
+                                   mimetype: str = 'image/jpeg') -> Optional[str]:
+        """העלאת תמונת קבלה"""
+        return await self._call('upload_receipt_image', group_id, image_data, filename, mimetype)
+    
+    # ===== מערכת =====
+    
+    async def flush(self) -> int:
+        """כתיבת הוצאות שממתינות בתור"""
+        return await self._call('flush')
+    
+    async def health_check(self) -> Dict[str, bool]:
+        """בדיקת תקינות"""
+        return await self._call('health_check')
+    
+    async def get_statistics(self) -> Dict:
+        """סטטיסטיקות כלליות"""
+        return await self._call('get_statistics')
+    
+    def shutdown(self):
+        """סגירת ה-thread pool"""
+        self.executor.shutdown(wait=True)
+
+
+# ===== מופע גלובלי =====
+_async_google_services = None
+_async_lock = threading.Lock()
+
+def get_async_google_services() -> AsyncGoogleServices:
+    """קבלת מופע יחיד של המעטפת האסינכרונית"""
+    global _async_google_services
+    with _async_lock:
+        if _async_google_services is None:
+            _async_google_services = AsyncGoogleServices()
+    return _async_google_services
\ No newline at end of file
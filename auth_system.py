@@ -4,7 +4,6 @@ import logging
 import hashlib
 from datetime import datetime, timedelta
 from typing import Dict, Optional, Tuple
-import requests
 from config import (
     GREENAPI_INSTANCE_ID, 
     GREENAPI_TOKEN,
@@ -13,6 +12,7 @@ from config import (
     is_phone_allowed,
     COLORS
 )
+from outbound_messages import get_outbound_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -82,20 +82,11 @@ class AuthManager:
             else:
                 whatsapp_id = clean_phone + '@c.us'
             
-            url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/sendMessage/{GREENAPI_TOKEN}"
-            
-            payload = {
-                "chatId": whatsapp_id,
-                "message": message
-            }
-            
-            response = requests.post(url, json=payload, timeout=10)
-            
-            if response.status_code == 200:
+            if get_outbound_scheduler().send_and_wait(whatsapp_id, message):
                 logger.info(f"WhatsApp message sent successfully to {phone}")
                 return True
             else:
-                logger.error(f"Failed to send WhatsApp message: {response.status_code}")
+                logger.error(f"Failed to send WhatsApp message to {phone}")
                 return False
                 
         except Exception as e:
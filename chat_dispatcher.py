@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+import zlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+from config import WEBHOOK_WORKERS
+
+logger = logging.getLogger(__name__)
+
+class ChatDispatcher:
+    """מפזר הודעות לפי צ'אט - סדר נשמר בתוך צ'אט, צ'אטים שונים רצים במקביל
+    
+    לכל chat_id יש נתיב FIFO משלו, והנתיבים מחולקים לפי hash בין N workers.
+    worker לוקח נתיב מוכן, מעבד את ההודעה הראשונה בו, ומחזיר אותו לסוף
+    התור שלו אם נשארו בו הודעות - כך נתיב אחד אף פעם לא מעובד בשני
+    workers בו-זמנית (עדכון כמו "2500 לא 2000" רואה את ההוצאה הקודמת),
+    וזוג עם הרבה הודעות לא תוקע זוגות אחרים באותו worker.
+    נתיב שהתרוקן נמחק מיד.
+    """
+    
+    def __init__(self, handler: Callable[[Dict], Awaitable[Any]], workers: int = WEBHOOK_WORKERS):
+        self.handler = handler
+        self.workers = max(1, workers)
+        
+        self._lanes: Dict[str, Deque[Tuple[Dict, asyncio.Future, float]]] = {}
+        self._ready: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        
+        self._stats = {
+            "submitted": 0,
+            "processed": 0,
+            "errors": 0,
+            "skipped": 0,
+            "lanes_created": 0,
+            "lanes_collected": 0,
+            "max_lane_depth": 0,
+            "lane_wait_seconds_total": 0.0,
+            "lane_wait_seconds_max": 0.0,
+        }
+    
+    def _shard(self, chat_id: str) -> int:
+        """ה-worker של הצ'אט - hash יציב (לא hash() של פייתון שמשתנה בין ריצות)"""
+        return zlib.crc32(chat_id.encode('utf-8')) % self.workers
+    
+    def _ensure_started(self):
+        """הפעלת ה-workers בפעם הראשונה על ה-event loop הנוכחי"""
+        if self._tasks:
+            return
+        
+        self._ready = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(self._ready[index]), name=f"chat-worker-{index}")
+            for index in range(self.workers)
+        ]
+        logger.info(f"✅ Chat dispatcher started with {self.workers} workers")
+    
+    def submit(self, chat_id: str, payload: Dict) -> asyncio.Future:
+        """הוספת הודעה לסוף הנתיב של הצ'אט - מחזיר Future עם תוצאת העיבוד
+        
+        הפונקציה לא אסינכרונית בכוונה: הסדר בנתיב הוא סדר הקריאות.
+        """
+        self._ensure_started()
+        
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(chat_id)
+        
+        if lane is None:
+            lane = self._lanes[chat_id] = deque()
+            self._stats["lanes_created"] += 1
+            self._ready[self._shard(chat_id)].put_nowait(chat_id)
+        
+        lane.append((payload, future, time.time()))
+        self._stats["submitted"] += 1
+        self._stats["max_lane_depth"] = max(self._stats["max_lane_depth"], len(lane))
+        return future
+    
+    async def _worker(self, ready: asyncio.Queue):
+        """לולאת worker: נתיב מוכן -> הודעה אחת -> חזרה לתור או מחיקת הנתיב"""
+        while True:
+            chat_id = await ready.get()
+            lane = self._lanes[chat_id]
+            payload, future, submitted_at = lane.popleft()
+            
+            # מי שחיכה לתוצאה כבר ויתר (כיבוי) - ההודעה נשארת בתור העמיד
+            if future.cancelled():
+                self._stats["skipped"] += 1
+            else:
+                wait = time.time() - submitted_at
+                self._stats["lane_wait_seconds_total"] += wait
+                self._stats["lane_wait_seconds_max"] = max(self._stats["lane_wait_seconds_max"], wait)
+                
+                try:
+                    result = await self.handler(payload)
+                    if not future.done():
+                        future.set_result(result)
+                    self._stats["processed"] += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    if not future.done():
+                        future.set_exception(e)
+            
+            if lane:
+                ready.put_nowait(chat_id)
+            else:
+                del self._lanes[chat_id]
+                self._stats["lanes_collected"] += 1
+    
+    async def stop(self):
+        """עצירת ה-workers - הודעות שלא התחילו נשארות בתור העמיד לריצה הבאה"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        
+        for lane in self._lanes.values():
+            for _, future, _ in lane:
+                future.cancel()
+        
+        self._lanes.clear()
+        self._ready = []
+        self._tasks = []
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """נתיבים פעילים, הודעות שממתינות וזמני המתנה בנתיב"""
+        stats = dict(self._stats)
+        started = stats["processed"] + stats["errors"]
+        
+        stats["lane_wait_seconds_avg"] = round(stats["lane_wait_seconds_total"] / started, 3) if started else 0.0
+        stats["lane_wait_seconds_total"] = round(stats["lane_wait_seconds_total"], 3)
+        stats["lane_wait_seconds_max"] = round(stats["lane_wait_seconds_max"], 3)
+        stats["workers"] = self.workers
+        stats["active_lanes"] = len(self._lanes)
+        stats["queued"] = sum(len(lane) for lane in self._lanes.values())
+        return stats
\ No newline at end of file
@@ -389,10 +389,80 @@ def get_main_css():
 GOOGLE_CREDENTIALS_JSON = os.getenv("GOOGLE_CREDENTIALS_JSON")
 GSHEETS_SPREADSHEET_ID = os.getenv("GSHEETS_SPREADSHEET_ID")
 
+# ===== בחירת מנגנון אחסון =====
+# google - Sheets + Drive, sqlite - מסד נתונים מקומי + תיקיית קבצים
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "google").lower()
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "data/wedding.db")
+LOCAL_FILES_DIR = os.getenv("LOCAL_FILES_DIR", "data/files")
+
+# ===== הגדרות Cache לגיליונות =====
+# כמה שניות תמונת מצב של גיליון נשמרת בזיכרון לפני קריאה מחדש (0 = ללא cache)
+SHEETS_CACHE_TTL_SECONDS = int(os.getenv("SHEETS_CACHE_TTL_SECONDS", "30"))
+# סנכרון הדרגתי של גיליון ההוצאות - ברענון נקראות רק שורות חדשות ושורות שה-updated_at שלהן השתנה
+SHEETS_DELTA_SYNC = os.getenv("SHEETS_DELTA_SYNC", "true").lower() == "true"
+# כל כמה שניות בכל זאת טוענים את כל הגיליון (עריכות ידניות שלא מעדכנות updated_at)
+SHEETS_FULL_SYNC_SECONDS = int(os.getenv("SHEETS_FULL_SYNC_SECONDS", "600"))
+
+# ===== פיצול גיליון ההוצאות =====
+# none - גיליון expenses אחד, couple - גיליון לכל זוג, month - גיליון לכל חודש
+# הניתוב נשמר בעמודת expense_shards בגיליון הזוגות
+EXPENSES_SHARDING = os.getenv("EXPENSES_SHARDING", "none").lower()
+# כמה גיליונות נטענים במקביל בשאילתות על כמה זוגות
+EXPENSES_SHARD_FANOUT = int(os.getenv("EXPENSES_SHARD_FANOUT", "4"))
+
+# ===== Write-behind לשמירת הוצאות =====
+# במצב זה save_expense כותב ליומן מקומי ומחזיר מיד, והשורות נשלחות ל-Sheets ב-batch
+EXPENSES_WRITE_BEHIND = os.getenv("EXPENSES_WRITE_BEHIND", "false").lower() == "true"
+EXPENSES_FLUSH_INTERVAL_SECONDS = float(os.getenv("EXPENSES_FLUSH_INTERVAL_SECONDS", "2"))
+EXPENSES_FLUSH_MAX_BATCH = int(os.getenv("EXPENSES_FLUSH_MAX_BATCH", "50"))
+EXPENSES_QUEUE_PATH = os.getenv("EXPENSES_QUEUE_PATH", "data/expenses_queue.jsonl")
+
+# ===== ארכוב ודחיסה =====
+# הוצאות שנמחקו וזוגות לא פעילים / שהחתונה שלהם עברה מועברים לגיליונות ארכיון
+# כמה ימים אחרי החתונה הזוג עדיין נשאר בגיליונות החמים (הוצאות שמגיעות באיחור)
+COMPACTION_WEDDING_GRACE_DAYS = int(os.getenv("COMPACTION_WEDDING_GRACE_DAYS", "60"))
+# ארכוב מוחק שורות - הוא מסמן שהוא מתחיל וממתין SHEETS_CACHE_TTL_SECONDS + מרווח זה
+# לפני המחיקה, כדי שכל התהליכים יפסיקו לכתוב לפי מספרי שורות ישנים
+COMPACTION_DRAIN_SECONDS = int(os.getenv("COMPACTION_DRAIN_SECONDS", "15"))
+# ארכוב שלא הסתיים אחרי זמן זה (התהליך נפל) כבר לא חוסם כתיבות
+COMPACTION_STALE_SECONDS = int(os.getenv("COMPACTION_STALE_SECONDS", "900"))
+
+# ===== מכסות וניסיונות חוזרים ל-Google APIs =====
+# ברירות המחדל לפי מכסות ברירת המחדל של גוגל (Sheets: 60 קריאות ו-60 כתיבות לדקה למשתמש)
+SHEETS_READ_QUOTA_PER_MINUTE = int(os.getenv("SHEETS_READ_QUOTA_PER_MINUTE", "60"))
+SHEETS_WRITE_QUOTA_PER_MINUTE = int(os.getenv("SHEETS_WRITE_QUOTA_PER_MINUTE", "60"))
+DRIVE_QUOTA_PER_MINUTE = int(os.getenv("DRIVE_QUOTA_PER_MINUTE", "600"))
+GOOGLE_MAX_RETRIES = int(os.getenv("GOOGLE_MAX_RETRIES", "5"))
+GOOGLE_BACKOFF_BASE_SECONDS = float(os.getenv("GOOGLE_BACKOFF_BASE_SECONDS", "1"))
+GOOGLE_BACKOFF_MAX_SECONDS = float(os.getenv("GOOGLE_BACKOFF_MAX_SECONDS", "32"))
+# כמה קריאות חוסמות לגוגל רצות במקביל מתוך ה-webhook האסינכרוני
+GOOGLE_ASYNC_WORKERS = int(os.getenv("GOOGLE_ASYNC_WORKERS", "8"))
+
 # ===== הגדרות WhatsApp (Green API) =====
 GREENAPI_INSTANCE_ID = os.getenv("GREENAPI_INSTANCE_ID")
 GREENAPI_TOKEN = os.getenv("GREENAPI_TOKEN")
 WEBHOOK_SHARED_SECRET = os.getenv("WEBHOOK_SHARED_SECRET")
+# כתובת ה-API (לחשבונות עם שרת ייעודי, למשל https://7103.api.greenapi.com)
+GREENAPI_API_URL = os.getenv("GREENAPI_API_URL", "https://api.green-api.com").rstrip("/")
+# חיבורים קבועים ל-Green API - בלי TCP+TLS חדש לכל הודעה
+GREENAPI_MAX_CONNECTIONS = int(os.getenv("GREENAPI_MAX_CONNECTIONS", "20"))
+GREENAPI_MAX_KEEPALIVE = int(os.getenv("GREENAPI_MAX_KEEPALIVE", "10"))
+GREENAPI_KEEPALIVE_SECONDS = float(os.getenv("GREENAPI_KEEPALIVE_SECONDS", "60"))
+# קצב שליחת הודעות לכל תהליך - הודעות נכנסות לתור ונשלחות לפי הקצב.
+# השרת של ה-webhook והדשבורד שולחים כל אחד בקצב הזה - הקצב מול ה-instance הוא הסכום
+GREENAPI_SEND_RATE_PER_SECOND = float(os.getenv("GREENAPI_SEND_RATE_PER_SECOND", "2"))
+# ניסיונות חוזרים על 429 / שגיאת חיבור לפני ויתור על הודעה
+GREENAPI_SEND_MAX_RETRIES = int(os.getenv("GREENAPI_SEND_MAX_RETRIES", "3"))
+
+# ===== תור עיבוד webhooks =====
+# ה-webhook שומר את ההודעה בתור מקומי ומחזיר 200 מיד, ו-workers ברקע מעבדים אותה
+WEBHOOK_QUEUE_PATH = os.getenv("WEBHOOK_QUEUE_PATH", "data/webhook_queue.db")
+# workers שמעבדים הודעות - כל צ'אט משויך ל-worker אחד לפי hash, כך שהסדר בתוך צ'אט נשמר
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+# כמה הודעות נשלפות מהתור ומחכות לעיבוד בו-זמנית (בכל הנתיבים יחד)
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+# כמה פעמים מנסים הודעה שהעיבוד שלה נכשל בחריגה לפני שהיא מסומנת failed
+WEBHOOK_JOB_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_JOB_MAX_ATTEMPTS", "3"))
 
 # ===== הגדרות OpenAI =====
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -431,6 +501,22 @@ AI_SETTINGS = {
     "temperature": 0.1,
 }
 
+# ===== זיהוי קבלות כפולות =====
+# מרחק Hamming מקסימלי בין dHash של שתי תמונות (מתוך 64 ביט) כדי להיחשב אותה קבלה
+RECEIPT_PHASH_MAX_DISTANCE = int(os.getenv("RECEIPT_PHASH_MAX_DISTANCE", "5"))
+
+# ===== עיבוד תמונות קבלות =====
+# עותק ל-AI: גווני אפור, ניגודיות אוטומטית, מוקטן לרזולוציה שמודל הראייה משתמש בה בפועל
+# (הצלע הקצרה עד 768, הארוכה עד 2048 - כל אריח של 512x512 עולה טוקנים)
+RECEIPT_VISION_SHORT_SIDE = int(os.getenv("RECEIPT_VISION_SHORT_SIDE", "768"))
+RECEIPT_VISION_LONG_SIDE = int(os.getenv("RECEIPT_VISION_LONG_SIDE", "2048"))
+RECEIPT_VISION_QUALITY = int(os.getenv("RECEIPT_VISION_QUALITY", "85"))
+
+# עותק לארכיון בדרייב: צבעוני, מוקטן ודחוס (webp או jpeg)
+RECEIPT_ARCHIVE_MAX_SIDE = int(os.getenv("RECEIPT_ARCHIVE_MAX_SIDE", "1600"))
+RECEIPT_ARCHIVE_FORMAT = os.getenv("RECEIPT_ARCHIVE_FORMAT", "webp").lower()
+RECEIPT_ARCHIVE_QUALITY = int(os.getenv("RECEIPT_ARCHIVE_QUALITY", "80"))
+
 # ===== מבנה Google Sheets =====
 # גיליון זוגות
 COUPLES_HEADERS = [
@@ -443,7 +529,12 @@ COUPLES_HEADERS = [
     "created_at",       # תאריך יצירה
     "status",           # active/inactive
     "contacts_progress", # התקדמות חיבור אנשי קשר
-    "last_activity"     # פעילות אחרונה
+    "last_activity",    # פעילות אחרונה
+    "drive_folder_id",  # תיקיית הזוג בדרייב
+    "receipts_folder_id", # תיקיית קבלות
+    "contacts_folder_id", # תיקיית אנשי קשר
+    "merged_folder_id",  # תיקיית קבצים מחוברים
+    "expense_shards"    # גיליונות ההוצאות של הזוג (פיצול)
 ]
 
 # גיליון הוצאות
@@ -461,7 +552,9 @@ EXPENSES_HEADERS = [
     "updated_at",       # תאריך עדכון אחרון
     "status",           # active/deleted
     "confidence",       # רמת ביטחון של ה-AI
-    "needs_review"      # צריך בדיקה ידנית
+    "needs_review",     # צריך בדיקה ידנית
+    "image_sha256",     # hash של קובץ הקבלה - זיהוי כפילויות
+    "image_phash"       # hash תפיסתי (dHash) - זיהוי העתקים שנדחסו מחדש
 ]
 
 # ===== הודעות בוט =====
@@ -515,6 +608,13 @@ BOT_MESSAGES = {
 
 העלו את קבצי אנשי הקשר והמוזמנים שלכם ואני אעזור לחבר ביניהם!""",
 
+    "duplicate_receipt": """🔁 הקבלה הזו כבר נשמרה!
+
+📋 **{vendor}**
+💰 **{amount:,.0f} ₪**
+
+אם זו הוצאה נוספת ולא אותה קבלה - כתבו "שמור שוב\"""",
+
     "unauthorized": "",  # לא שולח כלום למי שלא מורשה
 
     "error": """😅 משהו השתבש...
@@ -567,7 +667,7 @@ def is_valid_phone(phone: str) -> bool:
 def validate_config() -> Dict[str, bool]:
     """בדיקת תקינות הגדרות"""
     return {
-        "google_sheets": bool(GOOGLE_CREDENTIALS_JSON and GSHEETS_SPREADSHEET_ID),
+        "google_sheets": STORAGE_BACKEND == "sqlite" or bool(GOOGLE_CREDENTIALS_JSON and GSHEETS_SPREADSHEET_ID),
         "whatsapp": bool(GREENAPI_INSTANCE_ID and GREENAPI_TOKEN),
         "openai": bool(OPENAI_API_KEY),
         "webhook_secret": bool(WEBHOOK_SHARED_SECRET),
@@ -0,0 +1,162 @@
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+# סיכום הוצאות של זוג - נשמר ומתעדכן בכל כתיבה במקום סריקה של כל ההוצאות בכל תצוגה.
+# רק הוצאות בסטטוס active נספרות.
+#
+# {
+#     "group_id": str,
+#     "total_amount": float,          סך כל ההוצאות
+#     "count": int,                   מספר קבלות
+#     "by_category": {cat: amount},   סכום לכל קטגוריה
+#     "category_counts": {cat: n},
+#     "by_month": {"YYYY-MM": amount},  סכום לכל חודש (לפי שדה date)
+#     "month_counts": {"YYYY-MM": n},
+#     "max_amount": float,            ההוצאה הגבוהה ביותר
+#     "max_expense_id": str,
+#     "max_vendor": str,
+#     "last_created_at": str         ההוצאה האחרונה שנוספה
+# }
+
+def expense_amount(expense: Dict) -> float:
+    """סכום ההוצאה כמספר (0 לערך ריק או לא תקין)"""
+    try:
+        return float(expense.get('amount') or 0)
+    except (ValueError, TypeError):
+        return 0.0
+
+def expense_month(expense: Dict) -> Optional[str]:
+    """החודש של ההוצאה (YYYY-MM) לפי שדה date"""
+    date_str = str(expense.get('date', '') or '')
+    try:
+        return datetime.strptime(date_str[:10], '%Y-%m-%d').strftime('%Y-%m')
+    except ValueError:
+        return None
+
+def empty_summary(group_id: str) -> Dict:
+    """סיכום ריק לזוג"""
+    return {
+        "group_id": group_id,
+        "total_amount": 0.0,
+        "count": 0,
+        "by_category": {},
+        "category_counts": {},
+        "by_month": {},
+        "month_counts": {},
+        "max_amount": 0.0,
+        "max_expense_id": "",
+        "max_vendor": "",
+        "last_created_at": ""
+    }
+
+def _shift(amounts: Dict[str, float], counts: Dict[str, int], key: str, amount: float, step: int):
+    """הוספה/הפחתה של סכום ומונה למפתח, ומחיקת המפתח כשהמונה מתאפס"""
+    counts[key] = counts.get(key, 0) + step
+    amounts[key] = round(amounts.get(key, 0.0) + step * amount, 2)
+    if counts[key] <= 0:
+        counts.pop(key, None)
+        amounts.pop(key, None)
+
+def add_expense(summary: Dict, expense: Dict):
+    """הוספת הוצאה לסיכום"""
+    if expense.get('status') != 'active':
+        return
+    
+    amount = expense_amount(expense)
+    summary["total_amount"] = round(summary["total_amount"] + amount, 2)
+    summary["count"] += 1
+    
+    _shift(summary["by_category"], summary["category_counts"],
+           expense.get('category') or 'אחר', amount, 1)
+    
+    month = expense_month(expense)
+    if month:
+        _shift(summary["by_month"], summary["month_counts"], month, amount, 1)
+    
+    if not summary["max_expense_id"] or amount > summary["max_amount"]:
+        summary["max_amount"] = amount
+        summary["max_expense_id"] = str(expense.get('expense_id', ''))
+        summary["max_vendor"] = expense.get('vendor', '')
+    
+    created_at = str(expense.get('created_at', '') or '')
+    if created_at > summary["last_created_at"]:
+        summary["last_created_at"] = created_at
+
+def remove_expense(summary: Dict, expense: Dict) -> bool:
+    """הפחתת הוצאה מהסיכום
+    
+    מחזיר False אם ההוצאה הייתה המקסימלית או האחרונה - אז צריך לחשב את הסיכום מחדש.
+    """
+    if expense.get('status') != 'active':
+        return True
+    
+    if str(expense.get('expense_id', '')) == summary["max_expense_id"]:
+        return False
+    if str(expense.get('created_at', '') or '') == summary["last_created_at"]:
+        return False
+    
+    amount = expense_amount(expense)
+    summary["total_amount"] = round(summary["total_amount"] - amount, 2)
+    summary["count"] -= 1
+    
+    _shift(summary["by_category"], summary["category_counts"],
+           expense.get('category') or 'אחר', amount, -1)
+    
+    month = expense_month(expense)
+    if month:
+        _shift(summary["by_month"], summary["month_counts"], month, amount, -1)
+    
+    return True
+
+def build_summary(group_id: str, expenses: Iterable[Dict]) -> Dict:
+    """חישוב סיכום מלא מרשימת הוצאות"""
+    summary = empty_summary(group_id)
+    for expense in expenses:
+        add_expense(summary, expense)
+    return summary
+
+def merge_summaries(group_id: str, summaries: Iterable[Dict]) -> Dict:
+    """איחוד סיכומים של אותו זוג מכמה גיליונות (פיצול לפי חודש) לסיכום חדש"""
+    merged = empty_summary(group_id)
+    for summary in summaries:
+        merged["total_amount"] = round(merged["total_amount"] + summary["total_amount"], 2)
+        merged["count"] += summary["count"]
+        
+        for amounts_key, counts_key in (("by_category", "category_counts"), ("by_month", "month_counts")):
+            for key, amount in summary[amounts_key].items():
+                merged[amounts_key][key] = round(merged[amounts_key].get(key, 0.0) + amount, 2)
+                merged[counts_key][key] = merged[counts_key].get(key, 0) + summary[counts_key].get(key, 0)
+        
+        if summary["max_expense_id"] and (not merged["max_expense_id"]
+                                          or summary["max_amount"] > merged["max_amount"]):
+            merged["max_amount"] = summary["max_amount"]
+            merged["max_expense_id"] = summary["max_expense_id"]
+            merged["max_vendor"] = summary["max_vendor"]
+        
+        if summary["last_created_at"] > merged["last_created_at"]:
+            merged["last_created_at"] = summary["last_created_at"]
+    
+    return merged
+
+def apply_expense_change(summaries: Dict[str, Dict], old: Optional[Dict], new: Optional[Dict],
+                         load_group: Callable[[str], Iterable[Dict]]):
+    """עדכון אינקרמנטלי של סיכומים אחרי שינוי בהוצאה אחת
+    
+    old / new: ההוצאה לפני ואחרי השינוי (None להוספה / מחיקה פיזית).
+    רק זוגות שכבר יש להם סיכום ב-summaries מתעדכנים. load_group מחזיר את
+    ההוצאות העדכניות (אחרי השינוי) של זוג, לחישוב מחדש כשאין ברירה.
+    """
+    rebuilt = set()
+    
+    if old is not None:
+        group_id = str(old.get('group_id', ''))
+        summary = summaries.get(group_id)
+        if summary is not None and not remove_expense(summary, old):
+            summaries[group_id] = build_summary(group_id, load_group(group_id))
+            rebuilt.add(group_id)
+    
+    if new is not None:
+        group_id = str(new.get('group_id', ''))
+        summary = summaries.get(group_id)
+        if summary is not None and group_id not in rebuilt:
+            add_expense(summary, new)
\ No newline at end of file
@@ -0,0 +1,106 @@
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import EXPENSES_HEADERS
+
+# עמודות שמומרות פעם אחת בטעינה
+NUMERIC_FIELDS = ('amount', 'confidence')
+TIMESTAMP_FIELDS = ('created_at', 'updated_at')
+CATEGORICAL_FIELDS = ('group_id', 'category', 'status', 'payment_method')
+
+class ExpenseTable:
+    """טבלת הוצאות עמודתית עם טיפוסים
+    
+    הרשומות מ-Sheets/SQLite הן dict-ים של מחרוזות. כאן הן מומרות פעם אחת:
+    amount / confidence כ-float64, date / created_at כ-datetime64,
+    group_id / category / status כ-category, ומסכת active בוליאנית.
+    הדשבורדים והסטטיסטיקות עובדים על העמודות בפעולות וקטוריות.
+    """
+    
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+    
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> 'ExpenseTable':
+        """בניית טבלה מרשומות (get_all_records / SQLite)"""
+        frame = pd.DataFrame.from_records(list(records), columns=EXPENSES_HEADERS)
+        
+        for field in NUMERIC_FIELDS:
+            frame[field] = pd.to_numeric(frame[field], errors='coerce').fillna(0.0).astype('float64')
+        
+        frame['date'] = pd.to_datetime(frame['date'], format='%Y-%m-%d', errors='coerce')
+        for field in TIMESTAMP_FIELDS:
+            frame[field] = pd.to_datetime(frame[field], format='ISO8601', errors='coerce', utc=True)
+        
+        for field in CATEGORICAL_FIELDS:
+            frame[field] = frame[field].fillna('').astype(str).astype('category')
+        
+        for field in ('expense_id', 'vendor', 'description', 'receipt_image_url'):
+            frame[field] = frame[field].fillna('').astype(str)
+        
+        return cls(frame)
+    
+    @classmethod
+    def concat(cls, tables: List['ExpenseTable']) -> 'ExpenseTable':
+        """איחוד טבלאות של כמה גיליונות (פיצול) - הקטגוריות מאוחדות מחדש"""
+        if not tables:
+            return cls.from_records([])
+        
+        frame = pd.concat([table.frame for table in tables], ignore_index=True)
+        for field in CATEGORICAL_FIELDS:
+            frame[field] = frame[field].astype(str).astype('category')
+        return cls(frame)
+    
+    def __len__(self) -> int:
+        return len(self.frame)
+    
+    @property
+    def active(self) -> np.ndarray:
+        """מסכה בוליאנית של הוצאות פעילות"""
+        return (self.frame['status'] == 'active').to_numpy()
+    
+    @property
+    def amounts(self) -> np.ndarray:
+        """סכומים כ-float64"""
+        return self.frame['amount'].to_numpy()
+    
+    def active_only(self) -> 'ExpenseTable':
+        """רק הוצאות פעילות"""
+        return ExpenseTable(self.frame[self.active])
+    
+    def for_groups(self, group_ids: List[str]) -> 'ExpenseTable':
+        """רק ההוצאות של הזוגות המבוקשים"""
+        return ExpenseTable(self.frame[self.frame['group_id'].isin(group_ids)])
+    
+    def newest(self, limit: Optional[int] = None) -> 'ExpenseTable':
+        """מיון לפי תאריך יצירה (החדש ביותר ראשון)"""
+        frame = self.frame.sort_values('created_at', ascending=False, na_position='last')
+        return ExpenseTable(frame.head(limit) if limit else frame)
+    
+    def total_amount(self) -> float:
+        """סכום כל ההוצאות בטבלה"""
+        return float(self.amounts.sum())
+    
+    def by_category(self) -> Dict[str, float]:
+        """סכום לכל קטגוריה (קטגוריה ריקה = אחר)"""
+        categories = self.frame['category'].astype(str).replace('', 'אחר')
+        return self.frame['amount'].groupby(categories).sum().to_dict()
+    
+    def by_month(self) -> Dict[str, float]:
+        """סכום לכל חודש (YYYY-MM) לפי שדה date"""
+        dated = self.frame[self.frame['date'].notna()]
+        months = dated['date'].dt.strftime('%Y-%m')
+        return dated['amount'].groupby(months).sum().sort_index().to_dict()
+    
+    def by_group(self) -> pd.DataFrame:
+        """מספר הוצאות וסכום לכל זוג - עמודות count, total"""
+        grouped = self.frame.groupby('group_id', observed=True)['amount']
+        return pd.DataFrame({'count': grouped.size(), 'total': grouped.sum()})
+    
+    def confidence_rate(self, threshold: float = 90) -> float:
+        """אחוז ההוצאות עם ביטחון AI של threshold ומעלה"""
+        if not len(self.frame):
+            return 0.0
+        return float((self.frame['confidence'].to_numpy() >= threshold).mean() * 100)
\ No newline at end of file
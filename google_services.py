@@ -1,113 +1,770 @@
+import atexit
+import contextvars
+import copy
 import json
 import logging
 import os
-from datetime import datetime, timezone
-from typing import List, Dict, Optional, Any
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from typing import List, Dict, Optional, Any, Tuple
 from io import BytesIO
-import hashlib
 
 # Google services
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
 import gspread
+from gspread.utils import numericise_all, rowcol_to_a1
 
 from config import (
     GOOGLE_CREDENTIALS_JSON, 
     GSHEETS_SPREADSHEET_ID,
     COUPLES_HEADERS,
     EXPENSES_HEADERS,
+    STORAGE_BACKEND,
+    SHEETS_CACHE_TTL_SECONDS,
+    SHEETS_DELTA_SYNC,
+    SHEETS_FULL_SYNC_SECONDS,
+    EXPENSES_SHARDING,
+    EXPENSES_SHARD_FANOUT,
+    EXPENSES_WRITE_BEHIND,
+    EXPENSES_FLUSH_INTERVAL_SECONDS,
+    EXPENSES_FLUSH_MAX_BATCH,
+    EXPENSES_QUEUE_PATH,
+    COMPACTION_DRAIN_SECONDS,
+    COMPACTION_STALE_SECONDS,
     COLORS
 )
+from storage_backend import StorageBackend, FOLDER_COLUMNS
+from expense_aggregates import build_summary, merge_summaries, apply_expense_change
+from expense_table import ExpenseTable
+from request_scheduler import get_request_scheduler, request_priority, PRIORITY_LOW
 
 logger = logging.getLogger(__name__)
 
-class GoogleServicesManager:
+# עמודת המפתח של כל סוג גיליון - לפיה נבנה האינדקס בזיכרון
+# (גיליונות הוצאות מפוצלים, expenses_<זוג/חודש>, מתנהגים כמו expenses)
+SHEET_KEYS = {
+    'couples': 'group_id',
+    'expenses': 'expense_id'
+}
+
+# אינדקס משני {group_id: [row_numbers]} לגיליונות שמכילים כמה שורות לכל זוג
+SHEET_GROUP_INDEX = {
+    'expenses': 'group_id'
+}
+
+# גיליון הארכיון של כל גיליון חם - לשם מועברות שורות מתות ב-compact
+ARCHIVE_SHEETS = {
+    'couples': 'couples_archive',
+    'expenses': 'expenses_archive'
+}
+
+# מצב הדחיסה המשותף לכל התהליכים: מונה דחיסות שהסתיימו וזמן תחילת דחיסה שרצה
+COMPACTION_STATE_SHEET = 'compaction_state'
+COMPACTION_STATE_HEADERS = ['generation', 'compacting_since']
+
+# מצבי פיצול של ההוצאות - ראו EXPENSES_SHARDING
+SHARDING_MODES = ('none', 'couple', 'month')
+
+# עמודת הגרסה של גיליונות שמסונכרנים הדרגתית - שורה שהערך בה השתנה נקראת מחדש
+SHEET_VERSION_FIELDS = {
+    'expenses': 'updated_at'
+}
+
+class GoogleServicesManager(StorageBackend):
     """מנהל את כל הפעילויות עם Google Sheets ו-Drive"""
     
     def __init__(self):
-        self.credentials = None
-        self.sheets_service = None
-        self.drive_service = None
-        self.gspread_client = None
-        self.spreadsheet = None
+        # הלקוחות נבנים בשימוש הראשון (או ב-prewarm) - יצירת המופע לא פונה לגוגל
+        self._init_lock = threading.RLock()
+        self._credentials = None
+        self._sheets_service = None
+        self._spreadsheet = None
+        self._worksheets: Dict[str, Any] = {}
+        self._drive_local = threading.local()
+        
+        # כל הקריאות לגוגל עוברות דרך מתזמן משותף עם מכסות ועדיפויות
+        self.scheduler = get_request_scheduler()
+        
+        # cache של תמונות מצב לכל גיליון - {sheet_name: {"records": [...], "loaded_at": float}}
+        self.cache_ttl = SHEETS_CACHE_TTL_SECONDS
+        self._cache_lock = threading.RLock()
+        self._sheet_cache: Dict[str, Dict[str, Any]] = {}
+        # נעילה לכל גיליון (טעינה ועדכון של תמונת המצב) - כך כמה גיליונות נטענים במקביל
+        self._sheet_locks: Dict[str, threading.RLock] = {}
+        self._cache_stats = {"hits": 0, "misses": 0, "invalidations": 0,
+                             "delta_syncs": 0, "delta_rows": 0}
+        
+        # מצב הדחיסה כפי שנקרא לאחרונה, וה-generation שתמונות המצב נטענו תחתיו
+        self._compaction_state = {"generation": 0, "compacting_since": 0.0, "read_at": None}
+        self._cache_generation: Optional[int] = None
+        
+        # סנכרון הדרגתי - ברענון נקראות רק שורות חדשות ושורות שהשתנו
+        self.delta_sync = SHEETS_DELTA_SYNC
+        self.full_sync_interval = SHEETS_FULL_SYNC_SECONDS
+        
+        # פיצול ההוצאות לכמה גיליונות - הניתוב בעמודת expense_shards של כל זוג
+        self.sharding = EXPENSES_SHARDING if EXPENSES_SHARDING in SHARDING_MODES else 'none'
+        self._fanout_executor = ThreadPoolExecutor(
+            max_workers=max(1, EXPENSES_SHARD_FANOUT),
+            thread_name_prefix="sheets-fanout"
+        )
+        
+        # מזהי תיקיות בדרייב - {group_id: {"couple": id, "receipts": id, ...}}
+        self._main_folder_id = ""
+        self._folder_ids: Dict[str, Dict[str, str]] = {}
         
-        self._init_services()
+        # תור write-behind להוצאות - נשמר ביומן מקומי עד שנכתב ל-Sheets
+        self.write_behind = EXPENSES_WRITE_BEHIND
+        self.flush_interval = EXPENSES_FLUSH_INTERVAL_SECONDS
+        self.flush_max_batch = max(1, EXPENSES_FLUSH_MAX_BATCH)
+        self.queue_path = EXPENSES_QUEUE_PATH
+        self._pending_expenses: List[Dict[str, Any]] = []
+        self._pending_lock = threading.Lock()
+        # RLock - compact מחזיק אותה לאורך כל הדחיסה וקורא ל-flush מתוכה
+        self._flush_lock = threading.RLock()
+        self._flush_event = threading.Event()
+        self._queue_stats = {"queued": 0, "flushed": 0, "flush_batches": 0, "flush_errors": 0}
+        self._needs_recovery_check = False
+        
+        if self.write_behind:
+            self._recover_expense_queue()
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+            atexit.register(self.flush)
+    
+    @property
+    def credentials(self):
+        """credentials של חשבון השירות"""
+        if self._credentials is None:
+            with self._init_lock:
+                if self._credentials is None:
+                    if not GOOGLE_CREDENTIALS_JSON:
+                        raise ValueError("Google credentials not found")
+                    
+                    # Parse credentials
+                    creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
+                    
+                    SCOPES = [
+                        'https://www.googleapis.com/auth/spreadsheets',
+                        'https://www.googleapis.com/auth/drive'
+                    ]
+                    
+                    self._credentials = service_account.Credentials.from_service_account_info(
+                        creds_dict, scopes=SCOPES
+                    )
+        return self._credentials
+    
+    @property
+    def sheets_service(self):
+        """שירות Sheets API - נבנה בשימוש הראשון"""
+        if self._sheets_service is None:
+            with self._init_lock:
+                if self._sheets_service is None:
+                    self._sheets_service = build('sheets', 'v4', credentials=self.credentials)
+        return self._sheets_service
     
-    def _init_services(self):
-        """אתחול שירותי Google"""
+    @property
+    def spreadsheet(self):
+        """הגיליון הראשי - נפתח בשימוש הראשון, כולל וידוא שקיימים הגיליונות הנחוצים"""
+        if self._spreadsheet is None:
+            with self._init_lock:
+                if self._spreadsheet is None:
+                    self._spreadsheet = self._open_spreadsheet()
+        return self._spreadsheet
+    
+    def _open_spreadsheet(self):
+        """פתיחת הגיליון הראשי"""
         try:
-            if not GOOGLE_CREDENTIALS_JSON:
-                raise ValueError("Google credentials not found")
-            
-            # Parse credentials
-            creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-            
-            # יצירת credentials
-            SCOPES = [
-                'https://www.googleapis.com/auth/spreadsheets',
-                'https://www.googleapis.com/auth/drive'
-            ]
-            
-            self.credentials = service_account.Credentials.from_service_account_info(
-                creds_dict, scopes=SCOPES
-            )
-            
-            # אתחול שירותים
-            self.sheets_service = build('sheets', 'v4', credentials=self.credentials)
-            self.drive_service = build('drive', 'v3', credentials=self.credentials)
-            self.gspread_client = gspread.authorize(self.credentials)
-            
-            # פתיחת הגיליון הראשי
-            self.spreadsheet = self.gspread_client.open_by_key(GSHEETS_SPREADSHEET_ID)
+            gspread_client = gspread.authorize(self.credentials)
+            spreadsheet = self._call(lambda: gspread_client.open_by_key(GSHEETS_SPREADSHEET_ID))
             
             # וידוא שקיימים הגיליונות הנחוצים
-            self._ensure_worksheets_exist()
+            self._ensure_worksheets_exist(spreadsheet)
             
-            logger.info("✅ Google services initialized successfully")
+            logger.info("✅ Google Sheets initialized successfully")
+            return spreadsheet
             
         except Exception as e:
-            logger.error(f"❌ Failed to initialize Google services: {e}")
+            logger.error(f"❌ Failed to initialize Google Sheets: {e}")
             raise
     
-    def _ensure_worksheets_exist(self):
-        """וידוא שקיימים כל הגיליונות הנחוצים"""
+    @property
+    def drive_service(self):
+        """לקוח Drive נפרד לכל thread - httplib2 שעליו בנוי googleapiclient אינו thread-safe"""
+        service = getattr(self._drive_local, 'service', None)
+        if service is None:
+            service = build('drive', 'v3', credentials=self.credentials)
+            self._drive_local.service = service
+        return service
+    
+    @drive_service.setter
+    def drive_service(self, service):
+        self._drive_local.service = service
+    
+    def prewarm(self):
+        """אתחול מוקדם של הלקוחות וטעינת הגיליונות ל-cache
+        
+        מיועד לריצה ברקע בעליית התהליך (ראו prewarm_google_services), כדי שהבקשה
+        הראשונה לא תשלם על האתחול. לקוח ה-Drive נפרד לכל thread ומחומם ב-prewarm_thread.
+        """
+        started = time.time()
+        try:
+            for sheet_name in SHEET_KEYS:
+                self._get_snapshot(sheet_name)
+            logger.info(f"🔥 Google services prewarmed in {time.time() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"❌ Failed to prewarm Google services: {e}")
+    
+    def prewarm_thread(self):
+        """בניית לקוח ה-Drive של ה-thread הנוכחי ופתיחת החיבור שלו
+        
+        חימום ב-thread אחר לא עוזר - ראו drive_service. נקרא מה-initializer של
+        ה-pool של AsyncGoogleServices, על ה-threads שמבצעים את הקריאות עצמן.
+        """
+        started = time.time()
         try:
-            worksheets = {ws.title for ws in self.spreadsheet.worksheets()}
+            with request_priority(PRIORITY_LOW):
+                self._call(self.drive_service.about().get(fields='user').execute, 'drive', idempotent=True)
+            logger.info(f"🔥 Drive client of {threading.current_thread().name} prewarmed in {time.time() - started:.1f}s")
+        except Exception as e:
+            logger.warning(f"Failed to prewarm Drive client: {e}")
+    
+    def _ensure_worksheets_exist(self, spreadsheet):
+        """וידוא שקיימים כל הגיליונות הנחוצים
+        
+        ה-handles שמתקבלים מהרשימה נשמרים, כך שהפעולות הבאות לא צריכות metadata.
+        """
+        try:
+            worksheets = {ws.title: ws for ws in self._call(spreadsheet.worksheets)}
+            handles = dict(worksheets)
             
             # גיליון זוגות
             if 'couples' not in worksheets:
-                couples_sheet = self.spreadsheet.add_worksheet(
+                couples_sheet = self._call(lambda: spreadsheet.add_worksheet(
                     title='couples', 
                     rows=1000, 
                     cols=len(COUPLES_HEADERS)
-                )
-                couples_sheet.append_row(COUPLES_HEADERS)
+                ), 'write')
+                self._call(lambda: couples_sheet.append_row(COUPLES_HEADERS), 'write')
+                handles['couples'] = couples_sheet
                 logger.info("Created 'couples' worksheet")
             
             # גיליון הוצאות
             if 'expenses' not in worksheets:
-                expenses_sheet = self.spreadsheet.add_worksheet(
+                expenses_sheet = self._call(lambda: spreadsheet.add_worksheet(
                     title='expenses', 
                     rows=5000, 
                     cols=len(EXPENSES_HEADERS)
-                )
-                expenses_sheet.append_row(EXPENSES_HEADERS)
+                ), 'write')
+                self._call(lambda: expenses_sheet.append_row(EXPENSES_HEADERS), 'write')
+                handles['expenses'] = expenses_sheet
                 logger.info("Created 'expenses' worksheet")
             
+            # גיליונות קיימים שנוצרו לפני שנוספו עמודות - הוספת הכותרות החסרות
+            if 'couples' in worksheets:
+                self._ensure_headers(worksheets['couples'], COUPLES_HEADERS)
+            if 'expenses' in worksheets:
+                self._ensure_headers(worksheets['expenses'], EXPENSES_HEADERS)
+            
+            self._worksheets.update(handles)
+            
         except Exception as e:
             logger.error(f"Failed to ensure worksheets exist: {e}")
             raise
     
-    def _get_timestamp(self) -> str:
-        """מחזיר timestamp נוכחי"""
-        return datetime.now(timezone.utc).isoformat()
+    def _call(self, func, kind: str = 'read', priority: Optional[int] = None, 
+              idempotent: Optional[bool] = None):
+        """הרצת קריאה לגוגל דרך המתזמן המרכזי (מכסות, עדיפויות וניסיונות חוזרים)
+        
+        כתיבות נשלחות שוב אחרי 5xx רק עם idempotent=True (כתיבת ערכים לתאים קבועים).
+        """
+        return self.scheduler.execute(func, kind, priority, idempotent)
+    
+    def _worksheet(self, sheet_name: str):
+        """קבלת גיליון לפי שם
+        
+        ה-handle נשמר אחרי הפעם הראשונה - spreadsheet.worksheet() מביא את ה-metadata
+        של כל הקובץ בכל קריאה.
+        """
+        worksheet = self._worksheets.get(sheet_name)
+        if worksheet is None:
+            worksheet = self._call(lambda: self.spreadsheet.worksheet(sheet_name))
+            self._worksheets[sheet_name] = worksheet
+        return worksheet
+    
+    def _sheet_call(self, sheet_name: str, operation, kind: str = 'read', 
+                    idempotent: Optional[bool] = None):
+        """הרצת פעולה על גיליון דרך ה-handle השמור
+        
+        אם הגיליון נמחק או נוצר מחדש מאז שה-handle נשמר - פתרון מחדש וניסיון נוסף אחד.
+        """
+        worksheet = self._worksheet(sheet_name)
+        try:
+            return self._call(lambda: operation(worksheet), kind, idempotent=idempotent)
+        except gspread.exceptions.APIError as e:
+            if not self._is_missing_sheet_error(e):
+                raise
+            
+            logger.warning(f"Worksheet '{sheet_name}' handle is stale - resolving it again")
+            self._worksheets.pop(sheet_name, None)
+            worksheet = self._worksheet(sheet_name)
+            return self._call(lambda: operation(worksheet), kind, idempotent=idempotent)
+    
+    def _is_missing_sheet_error(self, error: Exception) -> bool:
+        """האם השגיאה נובעת מגיליון שלא קיים (לפי שם או לפי sheetId)"""
+        message = str(error)
+        return 'Unable to parse range' in message or 'No grid with id' in message
+    
+    def _ensure_headers(self, worksheet, headers: List[str]):
+        """הוספת עמודות חדשות לסוף שורת הכותרות של גיליון קיים"""
+        current = self._call(lambda: worksheet.row_values(1))
+        if len(current) >= len(headers) or current != headers[:len(current)]:
+            return
+        
+        if worksheet.col_count < len(headers):
+            self._call(lambda: worksheet.add_cols(len(headers) - worksheet.col_count), 'write')
+        
+        missing = headers[len(current):]
+        start = rowcol_to_a1(1, len(current) + 1)
+        self._call(lambda: worksheet.update(start, [missing]), 'write', idempotent=True)
+        logger.info(f"Added columns to '{worksheet.title}': {missing}")
+    
+    # ===== Cache של גיליונות =====
+    
+    def _sheet_kind(self, sheet_name: str) -> str:
+        """סוג הגיליון - couples או expenses (כולל גיליונות הוצאות מפוצלים וארכיון)"""
+        return 'couples' if sheet_name.startswith('couples') else 'expenses'
+    
+    def _get_headers(self, sheet_name: str) -> List[str]:
+        """כותרות הגיליון לפי שמו"""
+        return COUPLES_HEADERS if self._sheet_kind(sheet_name) == 'couples' else EXPENSES_HEADERS
+    
+    def _sheet_lock(self, sheet_name: str) -> threading.RLock:
+        """הנעילה של תמונת המצב של גיליון אחד"""
+        with self._cache_lock:
+            return self._sheet_locks.setdefault(sheet_name, threading.RLock())
+    
+    def _fresh_snapshot(self, sheet_name: str) -> Optional[Dict[str, Any]]:
+        """תמונת המצב מה-cache אם עדיין בתוקף"""
+        with self._cache_lock:
+            entry = self._sheet_cache.get(sheet_name)
+            if entry and time.monotonic() - entry["loaded_at"] < self.cache_ttl:
+                self._cache_stats["hits"] += 1
+                return entry
+        return None
+    
+    def _get_snapshot(self, sheet_name: str) -> Dict[str, Any]:
+        """תמונת מצב של גיליון - רשומות + אינדקס לפי מפתח - מה-cache אם עדיין בתוקף
+        
+        התמונה המוחזרת שייכת ל-cache ואין לשנות אותה ישירות.
+        """
+        entry = self._fresh_snapshot(sheet_name)
+        if entry:
+            return entry
+        
+        # הוצאות שממתינות בתור נכתבות לפני קריאה מחדש כדי שלא ייעלמו מהתצוגה
+        if self._sheet_kind(sheet_name) == 'expenses':
+            self.flush()
+        
+        with self._sheet_lock(sheet_name):
+            entry = self._fresh_snapshot(sheet_name)
+            if entry:
+                return entry
+            
+            entry = self._sheet_cache.get(sheet_name)
+            if entry and self._can_delta_sync(sheet_name, entry) and self._delta_sync(sheet_name, entry):
+                entry["loaded_at"] = time.monotonic()
+                with self._cache_lock:
+                    self._cache_stats["delta_syncs"] += 1
+                return entry
+            
+            with self._cache_lock:
+                self._cache_stats["misses"] += 1
+            
+            try:
+                records = self._sheet_call(sheet_name, lambda worksheet: worksheet.get_all_records())
+            except gspread.exceptions.WorksheetNotFound:
+                if sheet_name in SHEET_KEYS:
+                    raise
+                # גיליון הוצאות מפוצל שעוד לא נכתבה אליו הוצאה
+                records = []
+            
+            entry = {
+                "records": records,
+                "loaded_at": time.monotonic(),
+                "full_loaded_at": time.monotonic(),
+                "index": {},
+                "by_group": {},
+                # סיכומי הוצאות לכל זוג - נבנים בבקשה הראשונה ומתעדכנים בכל כתיבה
+                "summaries": {},
+                # ExpenseTable של כל הגיליון - נבנית בבקשה הראשונה ומתאפסת בכל כתיבה
+                "table": None
+            }
+            # שורה 1 היא הכותרות, לכן הרשומה הראשונה נמצאת בשורה 2
+            for position, record in enumerate(records):
+                self._index_record(sheet_name, entry, position + 2, record)
+            
+            if self.cache_ttl > 0:
+                with self._cache_lock:
+                    self._sheet_cache[sheet_name] = entry
+            
+            return entry
+    
+    def _get_snapshots(self, sheet_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """תמונות מצב של כמה גיליונות - גיליונות שלא ב-cache נטענים במקביל
+        
+        כל טעינה רצה עם עותק של ההקשר, כך שהעדיפות (request_priority) נשמרת.
+        """
+        if len(sheet_names) <= 1:
+            return {sheet_name: self._get_snapshot(sheet_name) for sheet_name in sheet_names}
+        
+        contexts = [contextvars.copy_context() for _ in sheet_names]
+        snapshots = self._fanout_executor.map(
+            lambda context, sheet_name: context.run(self._get_snapshot, sheet_name),
+            contexts, sheet_names
+        )
+        return dict(zip(sheet_names, snapshots))
+    
+    def _can_delta_sync(self, sheet_name: str, entry: Dict[str, Any]) -> bool:
+        """האם אפשר לרענן את תמונת המצב הדרגתית במקום לטעון את כל הגיליון
+        
+        מדי full_sync_interval שניות בכל זאת נטען הכל - לעריכות ידניות
+        בגיליון שלא נוגעות ב-updated_at.
+        """
+        return (
+            self.delta_sync
+            and self._sheet_kind(sheet_name) in SHEET_VERSION_FIELDS
+            and time.monotonic() - entry["full_loaded_at"] < self.full_sync_interval
+        )
+    
+    def _column_letter(self, column: int) -> str:
+        """אות העמודה (1 = A)"""
+        return re.sub(r'\d+', '', rowcol_to_a1(1, column))
+    
+    def _delta_sync(self, sheet_name: str, entry: Dict[str, Any]) -> bool:
+        """רענון הדרגתי של תמונת המצב לפי סימן המים של מספר השורות
+        
+        בקריאה אחת (batch_get): עמודת המפתח, עמודת updated_at והשורות שנוספו
+        אחרי השורה האחרונה המוכרת (A{n+1}:N). שורות ישנות שה-updated_at שלהן
+        השתנה נקראות מחדש בקריאה נוספת אחת. העלות תלויה בפעילות החדשה ולא
+        בגודל הגיליון.
+        
+        מחזיר False אם תמונת המצב לא עקבית (שורות נמחקו או זזו) - אז נטען הכל.
+        """
+        kind = self._sheet_kind(sheet_name)
+        headers = self._get_headers(sheet_name)
+        key_column = self._column_letter(headers.index(SHEET_KEYS[kind]) + 1)
+        version_field = SHEET_VERSION_FIELDS[kind]
+        version_column = self._column_letter(headers.index(version_field) + 1)
+        last_column = self._column_letter(len(headers))
+        
+        records = entry["records"]
+        if not records:
+            return False
+        last_row = len(records) + 1
+        
+        try:
+            keys, versions, tail = self._sheet_call(
+                sheet_name,
+                lambda worksheet: worksheet.batch_get([
+                    f"{key_column}2:{key_column}{last_row}",
+                    f"{version_column}2:{version_column}{last_row}",
+                    f"A{last_row + 1}:{last_column}"
+                ])
+            )
+        except Exception as e:
+            logger.warning(f"Delta sync of {sheet_name} failed, reloading: {e}")
+            return False
+        
+        keys = [row[0] if row else '' for row in keys]
+        versions = [row[0] if row else '' for row in versions]
+        keys += [''] * (len(records) - len(keys))
+        versions += [''] * (len(records) - len(versions))
+        
+        key_field = SHEET_KEYS[kind]
+        changed_rows = []
+        for position, record in enumerate(records):
+            if str(keys[position]) != str(record.get(key_field, '')):
+                # שורות נמחקו או הוזזו בגיליון - אי אפשר להשלים הדרגתית
+                return False
+            if str(versions[position]) != str(record.get(version_field, '')):
+                changed_rows.append(position + 2)
+        
+        changed = []
+        if changed_rows:
+            if len(changed_rows) > len(records) // 2:
+                return False
+            try:
+                values = self._sheet_call(
+                    sheet_name,
+                    lambda worksheet: worksheet.batch_get([
+                        f"A{row_number}:{last_column}{row_number}" for row_number in changed_rows
+                    ])
+                )
+            except Exception as e:
+                logger.warning(f"Delta sync of {sheet_name} failed, reloading: {e}")
+                return False
+            changed = [(row_number, rows[0] if rows else [])
+                       for row_number, rows in zip(changed_rows, values)]
+        
+        for row_number, row_data in changed:
+            record = self._row_to_record(sheet_name, self._pad_row(sheet_name, row_data))
+            self._replace_record(sheet_name, entry, row_number, record)
+        
+        for position, row_data in enumerate(tail):
+            record = self._row_to_record(sheet_name, self._pad_row(sheet_name, row_data))
+            records.append(record)
+            self._index_record(sheet_name, entry, last_row + 1 + position, record)
+            if kind == 'expenses':
+                apply_expense_change(
+                    entry["summaries"], None, record,
+                    lambda group_id: self._snapshot_group_records(entry, group_id)
+                )
+        
+        if changed or tail:
+            if kind == 'expenses':
+                entry["table"] = None
+            with self._cache_lock:
+                self._cache_stats["delta_rows"] += len(changed) + len(tail)
+            logger.info(f"🔄 Delta sync {sheet_name}: {len(tail)} new, {len(changed)} changed rows")
+        
+        return True
+    
+    def _pad_row(self, sheet_name: str, row_data: List[str]) -> List[str]:
+        """השלמת תאים ריקים בסוף השורה (ה-API לא מחזיר אותם)"""
+        headers = self._get_headers(sheet_name)
+        return list(row_data[:len(headers)]) + [''] * (len(headers) - len(row_data))
+    
+    def _replace_record(self, sheet_name: str, entry: Dict[str, Any], 
+                        row_number: int, record: Dict):
+        """החלפת רשומה קיימת בתמונת המצב ברשומה שנקראה מחדש מהגיליון"""
+        old_record = entry["records"][row_number - 2]
+        entry["records"][row_number - 2] = record
+        
+        key_field = SHEET_KEYS.get(self._sheet_kind(sheet_name))
+        if key_field and record.get(key_field):
+            entry["index"][str(record[key_field])] = (row_number, record)
+        
+        group_field = SHEET_GROUP_INDEX.get(self._sheet_kind(sheet_name))
+        if group_field and record.get(group_field) != old_record.get(group_field):
+            old_rows = entry["by_group"].get(str(old_record.get(group_field)), [])
+            if row_number in old_rows:
+                old_rows.remove(row_number)
+            if record.get(group_field):
+                entry["by_group"].setdefault(str(record[group_field]), []).append(row_number)
+        
+        if self._sheet_kind(sheet_name) == 'expenses':
+            apply_expense_change(
+                entry["summaries"], old_record, record,
+                lambda group_id: self._snapshot_group_records(entry, group_id)
+            )
     
-    def _generate_id(self, prefix: str = "") -> str:
-        """יצירת ID ייחודי"""
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        random_part = hashlib.md5(os.urandom(16)).hexdigest()[:8]
-        return f"{prefix}{timestamp}_{random_part}"
+    def _get_records(self, sheet_name: str) -> List[Dict]:
+        """קבלת כל הרשומות של גיליון (שייכות ל-cache - אין לשנות)"""
+        return self._get_snapshot(sheet_name)["records"]
+    
+    def _index_record(self, sheet_name: str, entry: Dict[str, Any], 
+                      row_number: int, record: Dict):
+        """הוספת רשומה לאינדקסים של הגיליון
+        
+        index: {key: (row_number, record)}, by_group: {group_id: [row_numbers]}
+        """
+        key_field = SHEET_KEYS.get(self._sheet_kind(sheet_name))
+        if key_field and record.get(key_field):
+            entry["index"][str(record[key_field])] = (row_number, record)
+        
+        group_field = SHEET_GROUP_INDEX.get(self._sheet_kind(sheet_name))
+        if group_field and record.get(group_field):
+            entry["by_group"].setdefault(str(record[group_field]), []).append(row_number)
+    
+    def _snapshot_group_records(self, snapshot: Dict[str, Any], group_id: str) -> List[Dict]:
+        """רשומות של זוג אחד מתוך תמונת מצב נתונה"""
+        records = snapshot["records"]
+        return [records[row_number - 2] for row_number in snapshot["by_group"].get(group_id, [])]
+    
+    def _lookup_row(self, sheet_name: str, key: str) -> Optional[Tuple[int, Dict]]:
+        """מציאת (מספר שורה, רשומה) לפי מפתח - O(1) מתוך האינדקס"""
+        return self._get_snapshot(sheet_name)["index"].get(str(key))
+    
+    def _row_to_record(self, sheet_name: str, row_data: List[str]) -> Dict:
+        """המרת שורה לרשומה באותו פורמט של get_all_records"""
+        return dict(zip(self._get_headers(sheet_name), numericise_all(row_data)))
+    
+    def _appended_row_number(self, response: Dict) -> Optional[int]:
+        """חילוץ מספר השורה שנכתבה מתשובת append_row"""
+        try:
+            updated_range = response.get('updates', {}).get('updatedRange', '')
+            match = re.search(r'![A-Z]+(\d+)', updated_range)
+            return int(match.group(1)) if match else None
+        except (AttributeError, TypeError, ValueError):
+            return None
+    
+    def _cache_append(self, sheet_name: str, row_data: List[str], 
+                      row_number: Optional[int] = None) -> Optional[int]:
+        """הוספת שורה חדשה לתמונת המצב במקום לקרוא את הגיליון מחדש
+        
+        מחזיר את מספר השורה שהרשומה קיבלה בתמונת המצב (None אם אין cache).
+        """
+        with self._sheet_lock(sheet_name):
+            entry = self._sheet_cache.get(sheet_name)
+            if not entry:
+                return None
+            
+            expected_row = len(entry["records"]) + 2
+            if row_number is not None and row_number != expected_row:
+                # מישהו אחר הוסיף שורות לגיליון - תמונת המצב לא עקבית
+                self.invalidate_cache(sheet_name)
+                return None
+            
+            record = self._row_to_record(sheet_name, row_data)
+            entry["records"].append(record)
+            self._index_record(sheet_name, entry, expected_row, record)
+            
+            if self._sheet_kind(sheet_name) == 'expenses':
+                entry["table"] = None
+                apply_expense_change(
+                    entry["summaries"], None, record,
+                    lambda group_id: self._snapshot_group_records(entry, group_id)
+                )
+            return expected_row
+    
+    def _cache_update(self, sheet_name: str, key: str, updates: Dict):
+        """עדכון רשומה קיימת בתמונת המצב"""
+        with self._sheet_lock(sheet_name):
+            entry = self._sheet_cache.get(sheet_name)
+            if not entry:
+                return
+            
+            found = entry["index"].get(str(key))
+            if not found:
+                # הרשומה לא נמצאה - תמונת המצב לא עקבית, נטען מחדש בפעם הבאה
+                self.invalidate_cache(sheet_name)
+                return
+            
+            headers = self._get_headers(sheet_name)
+            row_number, record = found
+            group_field = SHEET_GROUP_INDEX.get(self._sheet_kind(sheet_name))
+            old_group = record.get(group_field) if group_field else None
+            old_record = dict(record)
+            
+            for field, value in updates.items():
+                if field in headers:
+                    record[field] = numericise_all([str(value)])[0]
+            
+            # העברת השורה לקבוצה החדשה באינדקס המשני אם השתנתה
+            if group_field and record.get(group_field) != old_group:
+                old_rows = entry["by_group"].get(str(old_group), [])
+                if row_number in old_rows:
+                    old_rows.remove(row_number)
+                entry["by_group"].setdefault(str(record[group_field]), []).append(row_number)
+            
+            if self._sheet_kind(sheet_name) == 'expenses':
+                entry["table"] = None
+                apply_expense_change(
+                    entry["summaries"], old_record, record,
+                    lambda group_id: self._snapshot_group_records(entry, group_id)
+                )
+    
+    def invalidate_cache(self, sheet_name: Optional[str] = None):
+        """ביטול ה-cache של גיליון מסוים או של כולם"""
+        with self._cache_lock:
+            if sheet_name is None:
+                self._sheet_cache.clear()
+            else:
+                self._sheet_cache.pop(sheet_name, None)
+            self._cache_stats["invalidations"] += 1
+    
+    # ===== תיאום דחיסה בין תהליכים =====
+    
+    def _read_compaction_state(self, force: bool = False) -> Dict[str, Any]:
+        """מצב הדחיסה מהגיליון - נקרא לכל היותר פעם ב-cache_ttl שניות"""
+        with self._cache_lock:
+            state = self._compaction_state
+            if not force and state["read_at"] is not None and time.monotonic() - state["read_at"] < self.cache_ttl:
+                return state
+        
+        # הזמן נלקח לפני הקריאה - הגיל של המצב לא מוערך בחסר
+        read_at = time.monotonic()
+        try:
+            values = self._sheet_call(
+                COMPACTION_STATE_SHEET,
+                lambda worksheet: worksheet.batch_get(['A2:B2'])
+            )[0]
+        except gspread.exceptions.WorksheetNotFound:
+            # עוד לא רצה אף דחיסה
+            values = []
+        
+        row = list(values[0]) if values else []
+        row += [''] * (2 - len(row))
+        state = {
+            "generation": int(float(row[0] or 0)),
+            "compacting_since": float(row[1] or 0),
+            "read_at": read_at
+        }
+        with self._cache_lock:
+            self._compaction_state = state
+        return state
+    
+    def _write_compaction_state(self, generation: int, compacting_since: float):
+        """עדכון מצב הדחיסה בגיליון ובעותק המקומי"""
+        self._get_or_create_worksheet(COMPACTION_STATE_SHEET, COMPACTION_STATE_HEADERS)
+        self._sheet_call(
+            COMPACTION_STATE_SHEET,
+            lambda worksheet: worksheet.update('A2:B2', [[str(generation), str(compacting_since or '')]]),
+            'write',
+            idempotent=True
+        )
+        with self._cache_lock:
+            self._compaction_state = {
+                "generation": generation,
+                "compacting_since": compacting_since,
+                "read_at": time.monotonic()
+            }
+    
+    def _is_compacting(self, state: Dict[str, Any]) -> bool:
+        """דחיסה רצה עכשיו (דחיסה ישנה מ-COMPACTION_STALE_SECONDS נחשבת תקועה)"""
+        since = state["compacting_since"]
+        return bool(since) and time.time() - since < COMPACTION_STALE_SECONDS
+    
+    def _compaction_allows_write(self) -> bool:
+        """האם מותר לכתוב לפי מספר שורה
+        
+        compact() מסמן בגיליון שהוא מתחיל, ומוחק שורות רק אחרי cache_ttl +
+        COMPACTION_DRAIN_SECONDS. כל תהליך קורא את המצב לכל היותר פעם ב-cache_ttl,
+        כך שעד המחיקה כולם כבר ראו את הסימון והפסיקו לכתוב לפי מספר שורה.
+        """
+        return not self._is_compacting(self._read_compaction_state())
+    
+    def _cache_generation_changed(self) -> bool:
+        """אם הסתיימה דחיסה מאז שתמונות המצב נטענו - ביטולן ו-True
+        
+        בפעם הראשונה בתהליך לא ידוע תחת איזה generation נטענו, ולכן גם אז נטען מחדש.
+        """
+        generation = self._read_compaction_state()["generation"]
+        with self._cache_lock:
+            if generation == self._cache_generation:
+                return False
+            self._cache_generation = generation
+        
+        self.invalidate_cache()
+        return True
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """סטטיסטיקות cache - כמה קריאות ל-Sheets נחסכו"""
+        with self._cache_lock:
+            stats = dict(self._cache_stats)
+            total = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / total * 100, 1) if total else 0.0
+            stats["ttl_seconds"] = self.cache_ttl
+            stats["delta_sync"] = self.delta_sync
+            stats["sharding"] = self.sharding
+            stats["cached_sheets"] = sorted(self._sheet_cache.keys())
+            return stats
     
     # ===== ניהול זוגות =====
     
@@ -116,13 +773,14 @@ class GoogleServicesManager:
                      budget: float = 0) -> Dict:
         """יצירת זוג חדש במערכת"""
         try:
-            couples_sheet = self.spreadsheet.worksheet('couples')
-            
             # בדיקה שהקבוצה לא קיימת כבר
             existing = self._find_couple_by_group_id(group_id)
             if existing:
                 return {"success": False, "error": "Group already exists"}
             
+            # יצירת תיקיה ב-Drive - המזהים נשמרים בשורת הזוג
+            folder_ids = self._create_couple_folder(group_id)
+            
             # יצירת רשומה חדשה
             couple_data = [
                 group_id,                    # group_id
@@ -135,12 +793,13 @@ class GoogleServicesManager:
                 "active",                    # status
                 "",                          # contacts_progress
                 self._get_timestamp()        # last_activity
+            ] + [folder_ids.get(folder, "") for folder in FOLDER_COLUMNS] + [
+                # expense_shards - זוג חדש מתחיל ישר בגיליון המפוצל שלו
+                "" if self.sharding == 'none' else self._expense_shard_for(group_id, self._get_timestamp())
             ]
             
-            couples_sheet.append_row(couple_data)
-            
-            # יצירת תיקיה ב-Drive
-            self._create_couple_folder(group_id)
+            response = self._sheet_call('couples', lambda worksheet: worksheet.append_row(couple_data), 'write')
+            self._cache_append('couples', couple_data, self._appended_row_number(response))
             
             logger.info(f"Created couple: {group_id}")
             
@@ -161,14 +820,8 @@ class GoogleServicesManager:
     def _find_couple_by_group_id(self, group_id: str) -> Optional[Dict]:
         """חיפוש זוג לפי group_id"""
         try:
-            couples_sheet = self.spreadsheet.worksheet('couples')
-            records = couples_sheet.get_all_records()
-            
-            for record in records:
-                if record.get('group_id') == group_id:
-                    return record
-            
-            return None
+            found = self._lookup_row('couples', group_id)
+            return dict(found[1]) if found else None
             
         except Exception as e:
             logger.error(f"Failed to find couple: {e}")
@@ -177,11 +830,10 @@ class GoogleServicesManager:
     def get_all_active_couples(self) -> List[Dict]:
         """קבלת כל הזוגות הפעילים"""
         try:
-            couples_sheet = self.spreadsheet.worksheet('couples')
-            records = couples_sheet.get_all_records()
+            records = self._get_records('couples')
             
             active_couples = [
-                record for record in records 
+                dict(record) for record in records 
                 if record.get('status') == 'active'
             ]
             
@@ -191,45 +843,166 @@ class GoogleServicesManager:
             logger.error(f"Failed to get active couples: {e}")
             return []
     
-    def update_couple_field(self, group_id: str, field: str, value: Any) -> bool:
-        """עדכון שדה בודד של זוג"""
+    def update_couple_fields(self, group_id: str, fields: Dict[str, Any]) -> bool:
+        """עדכון כמה שדות של זוג בבקשה אחת (כולל last_activity)"""
         try:
-            couples_sheet = self.spreadsheet.worksheet('couples')
-            
-            # מציאת השורה
-            cell = couples_sheet.find(group_id)
-            if not cell:
+            # מציאת העמודות
+            if not fields or any(field not in COUPLES_HEADERS for field in fields):
                 return False
             
-            row_num = cell.row
-            
-            # מציאת העמודה
-            if field not in COUPLES_HEADERS:
+            # מציאת השורה מהאינדקס - בלי find על כל הגיליון
+            found = self._lookup_row('couples', group_id)
+            if not found:
                 return False
             
-            col_num = COUPLES_HEADERS.index(field) + 1
+            updates = dict(fields)
+            updates['last_activity'] = self._get_timestamp()
             
-            # עדכון הערך
-            couples_sheet.update_cell(row_num, col_num, str(value))
-            
-            # עדכון last_activity
-            last_activity_col = COUPLES_HEADERS.index('last_activity') + 1
-            couples_sheet.update_cell(row_num, last_activity_col, self._get_timestamp())
+            if not self._write_row_fields('couples', found[0], group_id, updates):
+                return False
+            self._cache_update('couples', group_id, updates)
             
-            logger.info(f"Updated couple {group_id}: {field} = {value}")
+            logger.info(f"Updated couple {group_id}: {fields}")
             return True
             
         except Exception as e:
             logger.error(f"Failed to update couple field: {e}")
             return False
     
+    def _write_row_fields(self, sheet_name: str, row_num: int, key: str, 
+                          fields: Dict[str, Any]) -> bool:
+        """כתיבת כמה תאים באותה שורה ב-batch_update יחיד (בקשת HTTP אחת)
+        
+        מספר השורה מגיע מהאינדקס, ו-compact() בתהליך אחר עלול להזיז שורות - ראו
+        _compaction_allows_write. מחזיר False בזמן דחיסה או אם הרשומה כבר לא בגיליון.
+        """
+        if not self._compaction_allows_write():
+            logger.warning(f"Compaction in progress - not writing {key} to {sheet_name}")
+            return False
+        
+        # הייתה דחיסה מאז שתמונת המצב נטענה - מספר השורה נמצא מחדש
+        if self._cache_generation_changed():
+            found = self._lookup_row(sheet_name, key)
+            if not found:
+                return False
+            row_num = found[0]
+        
+        headers = self._get_headers(sheet_name)
+        data = [
+            {
+                'range': rowcol_to_a1(row_num, headers.index(field) + 1),
+                'values': [[str(value)]]
+            }
+            for field, value in fields.items()
+            if field in headers
+        ]
+        
+        if data:
+            self._sheet_call(
+                sheet_name,
+                lambda worksheet: worksheet.batch_update(data, value_input_option='USER_ENTERED'),
+                'write',
+                idempotent=True
+            )
+        return True
+    
+    # ===== פיצול הוצאות לגיליונות =====
+    
+    def _expense_shard_for(self, group_id: str, timestamp: str) -> str:
+        """הגיליון שאליו נכתבת הוצאה חדשה לפי מצב הפיצול"""
+        if self.sharding == 'couple' and group_id:
+            return 'expenses_' + re.sub(r'[^0-9A-Za-z]+', '_', group_id.split('@')[0])
+        if self.sharding == 'month':
+            return 'expenses_' + timestamp[:7]
+        return 'expenses'
+    
+    def _couple_shards(self, couple: Optional[Dict]) -> List[str]:
+        """הגיליונות מטבלת הניתוב של זוג
+        
+        זוג בלי ניתוב נוצר לפני שהפיצול הופעל - ההוצאות שלו בגיליון expenses.
+        """
+        routing = str(couple.get('expense_shards', '') or '') if couple else ''
+        return [shard for shard in routing.split(',') if shard] or ['expenses']
+    
+    def _expense_shards(self, group_ids: List[str]) -> List[str]:
+        """הגיליונות שמכילים הוצאות של הזוגות המבוקשים"""
+        couples = self._get_snapshot('couples')["index"]
+        shards = set()
+        for group_id in group_ids:
+            found = couples.get(str(group_id))
+            shards.update(self._couple_shards(found[1] if found else None))
+        return sorted(shards)
+    
+    def _all_expense_shards(self) -> List[str]:
+        """כל גיליונות ההוצאות - expenses ועוד כל גיליון שמופיע בטבלת הניתוב"""
+        shards = {'expenses'}
+        for couple in self._get_records('couples'):
+            shards.update(self._couple_shards(couple))
+        return sorted(shards)
+    
+    def _route_expense(self, group_id: Optional[str], shard: str) -> bool:
+        """הוספת הגיליון לטבלת הניתוב של הזוג - כתיבה רק בפעם הראשונה לכל גיליון
+        
+        מחזיר False אם הניתוב לא נכתב (למשל בזמן דחיסה) - הוצאה בגיליון שלא
+        בטבלת הניתוב לא הייתה נמצאת.
+        """
+        if not group_id:
+            return True
+        
+        found = self._lookup_row('couples', group_id)
+        if not found:
+            return True
+        
+        shards = self._couple_shards(found[1])
+        if shard not in shards:
+            return self.update_couple_fields(group_id, {'expense_shards': ','.join(shards + [shard])})
+        return True
+    
+    def _get_or_create_worksheet(self, title: str, headers: List[str]):
+        """גיליון לפי שם - נוצר עם שורת כותרות בפעם הראשונה שצריך אותו"""
+        try:
+            return self._worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            worksheet = self._call(lambda: self.spreadsheet.add_worksheet(
+                title=title,
+                rows=1000,
+                cols=len(headers)
+            ), 'write')
+            self._call(lambda: worksheet.append_row(headers), 'write')
+            self._worksheets[title] = worksheet
+            logger.info(f"Created '{title}' worksheet")
+            return worksheet
+    
+    def _find_expense_row(self, expense_id: str) -> Optional[Tuple[str, int]]:
+        """מציאת (גיליון, מספר שורה) של הוצאה
+        
+        קודם בגיליונות שכבר ב-cache (בדרך כלל ההוצאה נקראה זה עתה), ורק אם לא
+        נמצאה שם - בכל הגיליונות שבטבלת הניתוב, במקביל.
+        """
+        with self._cache_lock:
+            cached = [
+                sheet_name for sheet_name, entry in self._sheet_cache.items()
+                if self._sheet_kind(sheet_name) == 'expenses' and str(expense_id) in entry["index"]
+            ]
+        
+        for sheet_name in cached:
+            found = self._lookup_row(sheet_name, expense_id)
+            if found:
+                return sheet_name, found[0]
+        
+        remaining = [shard for shard in self._all_expense_shards() if shard not in cached]
+        for sheet_name, snapshot in self._get_snapshots(remaining).items():
+            found = snapshot["index"].get(str(expense_id))
+            if found:
+                return sheet_name, found[0]
+        
+        return None
+    
     # ===== ניהול הוצאות =====
     
     def save_expense(self, expense_data: Dict) -> bool:
         """שמירת הוצאה חדשה"""
         try:
-            expenses_sheet = self.spreadsheet.worksheet('expenses')
-            
             # יצירת ID ייחודי אם לא קיים
             if not expense_data.get('expense_id'):
                 expense_data['expense_id'] = self._generate_id('EXP_')
@@ -248,10 +1021,24 @@ class GoogleServicesManager:
                 value = expense_data.get(header, '')
                 row_data.append(str(value) if value is not None else '')
             
-            expenses_sheet.append_row(row_data)
+            group_id = expense_data.get('group_id')
+            
+            shard = self._expense_shard_for(group_id, str(expense_data['created_at']))
+            if not self._route_expense(group_id, shard):
+                logger.error(f"Failed to route expense to {shard}")
+                return False
+            
+            if self.write_behind:
+                # שמירה ביומן המקומי - הכתיבה ל-Sheets תתבצע ב-flush הבא
+                self._enqueue_expense(row_data, expense_data['expense_id'], group_id, current_time, shard)
+                logger.info(f"Queued expense: {expense_data.get('expense_id')}")
+                return True
+            
+            self._get_or_create_worksheet(shard, EXPENSES_HEADERS)
+            response = self._sheet_call(shard, lambda worksheet: worksheet.append_row(row_data), 'write')
+            self._cache_append(shard, row_data, self._appended_row_number(response))
             
             # עדכון last_activity של הזוג
-            group_id = expense_data.get('group_id')
             if group_id:
                 self.update_couple_field(group_id, 'last_activity', current_time)
             
@@ -266,52 +1053,142 @@ class GoogleServicesManager:
                              include_deleted: bool = False) -> List[Dict]:
         """קבלת כל ההוצאות של קבוצה"""
         try:
-            expenses_sheet = self.spreadsheet.worksheet('expenses')
-            records = expenses_sheet.get_all_records()
+            # רק הגיליונות של הזוג (בפיצול לפי זוג - גיליון אחד)
+            snapshots = self._get_snapshots(self._expense_shards([group_id]))
+            records = []
+            for snapshot in snapshots.values():
+                records.extend(self._snapshot_group_records(snapshot, group_id))
+            return self._filter_expenses(records, include_deleted)
             
-            group_expenses = []
-            for record in records:
-                if record.get('group_id') != group_id:
-                    continue
-                
-                # סינון מחוקים אם נדרש
-                if not include_deleted and record.get('status') == 'deleted':
-                    continue
-                
-                group_expenses.append(record)
+        except Exception as e:
+            logger.error(f"Failed to get expenses for group {group_id}: {e}")
+            return []
+    
+    def get_expenses_grouped(self, group_ids: Optional[List[str]] = None,
+                             include_deleted: bool = False) -> Dict[str, List[Dict]]:
+        """הוצאות של כמה קבוצות מתמונות המצב של הגיליונות שלהן - {group_id: [expenses]}
+        
+        group_ids=None מחזיר את כל הקבוצות שיש להן הוצאות.
+        """
+        try:
+            snapshots = self._get_snapshots(self._shards_for(group_ids))
             
-            # מיון לפי תאריך יצירה (החדש ביותר ראשון)
-            group_expenses.sort(
-                key=lambda x: x.get('created_at', ''), 
-                reverse=True
-            )
+            if group_ids is None:
+                group_ids = self._snapshot_group_ids(snapshots)
             
-            return group_expenses
+            grouped = {}
+            for group_id in group_ids:
+                group_records = []
+                for snapshot in snapshots.values():
+                    group_records.extend(self._snapshot_group_records(snapshot, group_id))
+                grouped[group_id] = self._filter_expenses(group_records, include_deleted)
+            
+            return grouped
             
         except Exception as e:
-            logger.error(f"Failed to get expenses for group {group_id}: {e}")
-            return []
+            logger.error(f"Failed to get grouped expenses: {e}")
+            return {}
     
-    def update_expense(self, expense_id: str, updates: Dict) -> bool:
-        """עדכון הוצאה קיימת"""
+    def get_expense_table(self, group_ids: Optional[List[str]] = None) -> ExpenseTable:
+        """ההוצאות כטבלה עמודתית - ההמרה נעשית פעם אחת לכל תמונת מצב של הגיליון
+        
+        הטבלה שייכת ל-cache ואין לשנות אותה ישירות.
+        """
         try:
-            expenses_sheet = self.spreadsheet.worksheet('expenses')
+            snapshots = self._get_snapshots(self._shards_for(group_ids))
             
-            # מציאת השורה
-            cell = expenses_sheet.find(expense_id)
-            if not cell:
-                return False
+            tables = []
+            for sheet_name, snapshot in snapshots.items():
+                with self._sheet_lock(sheet_name):
+                    if snapshot.get("table") is None:
+                        snapshot["table"] = ExpenseTable.from_records(snapshot["records"])
+                    tables.append(snapshot["table"])
+            
+            table = tables[0] if len(tables) == 1 else ExpenseTable.concat(tables)
+            return table if group_ids is None else table.for_groups(group_ids)
+            
+        except Exception as e:
+            logger.error(f"Failed to build expense table: {e}")
+            return ExpenseTable.from_records([])
+    
+    def get_expense_summaries(self, group_ids: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """סיכומי הוצאות לכל זוג - {group_id: summary}
+        
+        הסיכום של זוג נבנה פעם אחת מתמונת המצב ומתעדכן בכל שמירה/עדכון/מחיקה,
+        כך שתצוגות סיכום לא סורקות את ההוצאות. group_ids=None - כל הזוגות עם הוצאות.
+        בפיצול לפי חודש הסיכומים של כל גיליון מאוחדים.
+        """
+        try:
+            snapshots = self._get_snapshots(self._shards_for(group_ids))
+            
+            if group_ids is None:
+                group_ids = self._snapshot_group_ids(snapshots)
+            
+            parts: Dict[str, List[Dict]] = {group_id: [] for group_id in group_ids}
+            for sheet_name, snapshot in snapshots.items():
+                with self._sheet_lock(sheet_name):
+                    for group_id in group_ids:
+                        if group_id not in snapshot["by_group"]:
+                            continue
+                        summary = snapshot["summaries"].get(group_id)
+                        if summary is None:
+                            summary = build_summary(group_id, self._snapshot_group_records(snapshot, group_id))
+                            snapshot["summaries"][group_id] = summary
+                        parts[group_id].append(copy.deepcopy(summary))
             
-            row_num = cell.row
+            return {group_id: merge_summaries(group_id, parts[group_id]) for group_id in group_ids}
+            
+        except Exception as e:
+            logger.error(f"Failed to get expense summaries: {e}")
+            return {}
+    
+    def _shards_for(self, group_ids: Optional[List[str]]) -> List[str]:
+        """גיליונות ההוצאות לשאילתה - של הזוגות המבוקשים, או כולם (None)"""
+        return self._all_expense_shards() if group_ids is None else self._expense_shards(group_ids)
+    
+    def _snapshot_group_ids(self, snapshots: Dict[str, Dict[str, Any]]) -> List[str]:
+        """כל הזוגות שיש להם שורות בתמונות המצב"""
+        return list(dict.fromkeys(
+            group_id for snapshot in snapshots.values() for group_id in snapshot["by_group"]
+        ))
+    
+    def _filter_expenses(self, records: List[Dict], include_deleted: bool) -> List[Dict]:
+        """סינון מחוקים ומיון לפי תאריך יצירה (החדש ביותר ראשון)"""
+        group_expenses = []
+        for record in records:
+            # סינון מחוקים אם נדרש
+            if not include_deleted and record.get('status') == 'deleted':
+                continue
+            
+            group_expenses.append(dict(record))
+        
+        group_expenses.sort(
+            key=lambda x: x.get('created_at', ''), 
+            reverse=True
+        )
+        
+        return group_expenses
+    
+    def update_expense_fields(self, expense_id: str, fields: Dict[str, Any]) -> bool:
+        """עדכון כמה שדות של הוצאה בבקשה אחת (כולל updated_at)"""
+        try:
+            # הוצאה שעדיין בתור - קודם נכתוב אותה כדי שתהיה לה שורה בגיליון
+            if self._is_expense_pending(expense_id):
+                self.flush()
+            
+            # מציאת הגיליון והשורה מהאינדקס - בלי find על כל הגיליון
+            found = self._find_expense_row(expense_id)
+            if not found:
+                return False
+            sheet_name, row_number = found
             
             # עדכון updated_at
+            updates = dict(fields)
             updates['updated_at'] = self._get_timestamp()
             
-            # עדכון כל השדות
-            for field, value in updates.items():
-                if field in EXPENSES_HEADERS:
-                    col_num = EXPENSES_HEADERS.index(field) + 1
-                    expenses_sheet.update_cell(row_num, col_num, str(value))
+            if not self._write_row_fields(sheet_name, row_number, expense_id, updates):
+                return False
+            self._cache_update(sheet_name, expense_id, updates)
             
             logger.info(f"Updated expense: {expense_id}")
             return True
@@ -320,70 +1197,438 @@ class GoogleServicesManager:
             logger.error(f"Failed to update expense: {e}")
             return False
     
-    def delete_expense(self, expense_id: str) -> bool:
-        """מחיקה רכה של הוצאה"""
-        return self.update_expense(expense_id, {
-            'status': 'deleted',
-            'updated_at': self._get_timestamp()
-        })
+    # ===== תור write-behind להוצאות =====
+    
+    def _enqueue_expense(self, row_data: List[str], expense_id: str, 
+                         group_id: Optional[str], created_at: str, sheet_name: str = 'expenses'):
+        """הוספת הוצאה ליומן המקומי ולתמונת המצב"""
+        item = {
+            "row": row_data,
+            "expense_id": expense_id,
+            "group_id": group_id or "",
+            "created_at": created_at,
+            "sheet": sheet_name
+        }
+        
+        with self._sheet_lock(sheet_name):
+            with self._pending_lock:
+                self._append_to_journal([item])
+                # השורה הצפויה בגיליון - לבדיקת עקביות תמונת המצב אחרי ה-flush
+                item["predicted_row"] = self._cache_append(sheet_name, row_data)
+                self._pending_expenses.append(item)
+                self._queue_stats["queued"] += 1
+                pending_count = len(self._pending_expenses)
+        
+        if pending_count >= self.flush_max_batch:
+            self._flush_event.set()
+    
+    def _is_expense_pending(self, expense_id: str) -> bool:
+        """האם ההוצאה עדיין ממתינה בתור"""
+        with self._pending_lock:
+            return any(item["expense_id"] == expense_id for item in self._pending_expenses)
+    
+    def _append_to_journal(self, items: List[Dict[str, Any]]):
+        """כתיבה מתמידה של פריטים ליומן (fsync לפני שחוזרים ללקוח)"""
+        directory = os.path.dirname(self.queue_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        with open(self.queue_path, 'a', encoding='utf-8') as journal:
+            for item in items:
+                journal.write(json.dumps({
+                    key: item[key] for key in ("row", "expense_id", "group_id", "created_at", "sheet")
+                }, ensure_ascii=False) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+    
+    def _rewrite_journal(self):
+        """כתיבת היומן מחדש עם הפריטים שעדיין ממתינים (החלפה אטומית)"""
+        temp_path = f"{self.queue_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as journal:
+            for item in self._pending_expenses:
+                journal.write(json.dumps({
+                    key: item[key] for key in ("row", "expense_id", "group_id", "created_at", "sheet")
+                }, ensure_ascii=False) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temp_path, self.queue_path)
+    
+    def _recover_expense_queue(self):
+        """טעינת הוצאות שנשארו ביומן מריצה קודמת"""
+        try:
+            if not os.path.exists(self.queue_path):
+                return
+            
+            items = []
+            with open(self.queue_path, 'r', encoding='utf-8') as journal:
+                for line in journal:
+                    line = line.strip()
+                    if line:
+                        items.append(json.loads(line))
+            
+            if not items:
+                return
+            
+            # הבדיקה מול הגיליון נדחית ל-flush הראשון, כדי שיצירת המופע לא תפנה לגוגל
+            with self._pending_lock:
+                for item in items:
+                    item.setdefault("sheet", "expenses")
+                    item["predicted_row"] = None
+                    item["recovered"] = True
+                self._pending_expenses = items + self._pending_expenses
+                self._needs_recovery_check = True
+            
+            logger.info(f"Recovered {len(items)} queued expenses from {self.queue_path}")
+            
+        except Exception as e:
+            logger.error(f"Failed to recover expenses queue: {e}")
+    
+    def _drop_written_recovered(self) -> bool:
+        """הסרת הוצאות מהיומן שכבר נכתבו לגיליון (קריסה בין append_rows לניקוי היומן)"""
+        try:
+            id_column = EXPENSES_HEADERS.index('expense_id') + 1
+            with self._pending_lock:
+                sheet_names = {item["sheet"] for item in self._pending_expenses if item.get("recovered")}
+            
+            existing_ids = set()
+            for sheet_name in sheet_names:
+                try:
+                    existing_ids.update(self._sheet_call(
+                        sheet_name, lambda worksheet: worksheet.col_values(id_column)
+                    ))
+                except gspread.exceptions.WorksheetNotFound:
+                    # הגיליון עוד לא נוצר - אף הוצאה לא נכתבה אליו
+                    continue
+        except Exception as e:
+            self._queue_stats["flush_errors"] += 1
+            logger.error(f"Failed to check recovered expenses: {e}")
+            return False
+        
+        with self._pending_lock:
+            self._pending_expenses = [
+                item for item in self._pending_expenses
+                if not (item.get("recovered") and item["expense_id"] in existing_ids)
+            ]
+            self._rewrite_journal()
+            self._needs_recovery_check = False
+        
+        return True
+    
+    def _flush_loop(self):
+        """לולאת רקע - flush כל flush_interval שניות או כשהתור מתמלא"""
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+    
+    def flush(self) -> int:
+        """כתיבת כל ההוצאות שבתור ל-Sheets ב-append_rows
+        
+        last_activity של כל זוג מתעדכן פעם אחת בלבד לכל flush.
+        מחזיר את מספר השורות שנכתבו. יש לקרוא לפני כיבוי התהליך.
+        """
+        flushed = 0
+        
+        with self._flush_lock:
+            last_activity: Dict[str, str] = {}
+            
+            if self._needs_recovery_check and not self._drop_written_recovered():
+                return 0
+            
+            while True:
+                with self._pending_lock:
+                    batch = self._pending_expenses[:self.flush_max_batch]
+                
+                if not batch:
+                    break
+                
+                # append_rows כותב לגיליון אחד - האצווה נעצרת במעבר לגיליון אחר
+                sheet_name = batch[0]["sheet"]
+                for position, item in enumerate(batch):
+                    if item["sheet"] != sheet_name:
+                        batch = batch[:position]
+                        break
+                
+                try:
+                    self._get_or_create_worksheet(sheet_name, EXPENSES_HEADERS)
+                    response = self._sheet_call(
+                        sheet_name,
+                        lambda worksheet: worksheet.append_rows([item["row"] for item in batch]),
+                        'write'
+                    )
+                except Exception as e:
+                    self._queue_stats["flush_errors"] += 1
+                    logger.error(f"Failed to flush expenses queue: {e}")
+                    break
+                
+                with self._pending_lock:
+                    del self._pending_expenses[:len(batch)]
+                    self._rewrite_journal()
+                
+                # השורות נכתבו במקום אחר ממה שתמונת המצב חזתה - טעינה מחדש
+                first_row = self._appended_row_number(response)
+                predicted_row = batch[0].get("predicted_row")
+                if predicted_row is None or first_row != predicted_row:
+                    self.invalidate_cache(sheet_name)
+                
+                for item in batch:
+                    if item["group_id"]:
+                        last_activity[item["group_id"]] = item["created_at"]
+                
+                flushed += len(batch)
+                self._queue_stats["flushed"] += len(batch)
+                self._queue_stats["flush_batches"] += 1
+            
+            for group_id, timestamp in last_activity.items():
+                self.update_couple_fields(group_id, {'last_activity': timestamp})
+        
+        if flushed:
+            logger.info(f"Flushed {flushed} queued expenses")
+        
+        return flushed
+    
+    # ===== ארכוב =====
+    
+    def compact(self) -> Dict[str, int]:
+        """העברת נתונים מתים מהגיליונות החמים לגיליונות הארכיון
+        
+        הוצאות שנמחקו, זוגות שהושבתו או שהחתונה שלהם עברה, וכל ההוצאות של
+        הזוגות האלה. השורות נכתבות קודם לארכיון ורק אחר כך נמחקות מהגיליון
+        החם (בבקשה אחת), ואז תמונות המצב והאינדקסים נבנים מחדש.
+        
+        שורות זזות בגיליון, ולכן הדחיסה בלעדית: היא מסמנת בגיליון
+        compaction_state שהיא מתחילה, ממתינה שכל התהליכים יראו את הסימון
+        (בינתיים הם לא כותבים לפי מספר שורה), ובסוף מקדמת את ה-generation -
+        וכל תהליך טוען מחדש את תמונות המצב לפני הכתיבה הבאה.
+        """
+        result = {"couples_archived": 0, "expenses_archived": 0}
+        
+        try:
+            state = self._read_compaction_state(force=True)
+        except Exception as e:
+            logger.error(f"Failed to read compaction state: {e}")
+            return result
+        
+        if self._is_compacting(state):
+            logger.warning("Another compaction is already running - skipping")
+            return result
+        
+        generation = state["generation"]
+        try:
+            self._write_compaction_state(generation, time.time())
+        except Exception as e:
+            logger.error(f"Failed to mark compaction start: {e}")
+            return result
+        
+        try:
+            # תמונות מצב שנטענו לפני הסימון פגות, וכל תהליך קורא את המצב מחדש
+            time.sleep(self.cache_ttl + COMPACTION_DRAIN_SECONDS)
+            
+            # בזמן הדחיסה אין flush - תור ה-write-behind ממתין עד שהשורות יסיימו לזוז
+            with self._flush_lock, ExitStack() as locks:
+                self.flush()
+                
+                expense_sheets = self._all_expense_shards()
+                for sheet_name in sorted(['couples'] + expense_sheets):
+                    locks.enter_context(self._sheet_lock(sheet_name))
+                
+                # טעינה טרייה של כל הגיליונות - ברצף, ה-threads של הטעינה המקבילית לא יכולים
+                # לקבל את הנעילות שמוחזקות כאן
+                self.invalidate_cache()
+                couples = self._get_snapshot('couples')["records"]
+                
+                archived_groups = {
+                    str(couple.get('group_id', '')) for couple in couples
+                    if self._is_archivable_couple(couple)
+                }
+                archived_groups.discard('')
+                
+                # הוצאות לפני זוגות - כדי שזוג לא ייעלם לפני ההוצאות שלו
+                for sheet_name in expense_sheets + ['couples']:
+                    records = self._get_snapshot(sheet_name)["records"]
+                    row_numbers = [
+                        position + 2 for position, record in enumerate(records)
+                        if str(record.get('group_id', '')) in archived_groups
+                        or (sheet_name != 'couples' and record.get('status') == 'deleted')
+                    ]
+                    if not row_numbers:
+                        continue
+                    
+                    self._archive_rows(sheet_name, [records[row - 2] for row in row_numbers])
+                    self._delete_rows(sheet_name, row_numbers)
+                    result[f"{self._sheet_kind(sheet_name)}_archived"] += len(row_numbers)
+                
+                # בנייה מחדש של תמונות המצב והאינדקסים מהגיליונות הדחוסים
+                self.invalidate_cache()
+                for sheet_name in ['couples'] + expense_sheets:
+                    self._get_snapshot(sheet_name)
+            
+            for group_id in archived_groups:
+                self._folder_ids.pop(group_id, None)
+            
+            logger.info(f"🗄️ Compaction done: {result}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Failed to compact worksheets: {e}")
+            self.invalidate_cache()
+            return result
+        
+        finally:
+            # גם אחרי כישלון - ייתכן שחלק מהשורות כבר נמחקו
+            try:
+                self._write_compaction_state(generation + 1, 0.0)
+                # תמונות המצב של התהליך הזה כבר נבנו מחדש אחרי המחיקה
+                with self._cache_lock:
+                    self._cache_generation = generation + 1
+            except Exception as e:
+                logger.error(f"Failed to mark compaction end: {e}")
+    
+    def _archive_rows(self, sheet_name: str, records: List[Dict]):
+        """הוספת רשומות לגיליון הארכיון - בלי רשומות שכבר הועברו בהרצה קודמת שנקטעה"""
+        kind = self._sheet_kind(sheet_name)
+        archive_name = ARCHIVE_SHEETS[kind]
+        headers = self._get_headers(sheet_name)
+        self._get_or_create_worksheet(archive_name, headers)
+        
+        key_column = headers.index(SHEET_KEYS[kind]) + 1
+        archived_keys = set(self._sheet_call(archive_name, lambda worksheet: worksheet.col_values(key_column))[1:])
+        
+        rows = [
+            [str(record.get(header, '')) for header in headers]
+            for record in records
+            if str(record.get(SHEET_KEYS[kind], '')) not in archived_keys
+        ]
+        if rows:
+            self._sheet_call(archive_name, lambda worksheet: worksheet.append_rows(rows), 'write')
+    
+    def _delete_rows(self, sheet_name: str, row_numbers: List[int]):
+        """מחיקת שורות מגיליון בבקשת batchUpdate אחת
+        
+        רצפים של שורות נמחקים כטווח אחד, מהסוף להתחלה כדי שהמספור לא יזוז.
+        """
+        ranges = []
+        for row_number in sorted(row_numbers):
+            if ranges and ranges[-1][1] == row_number - 1:
+                ranges[-1][1] = row_number
+            else:
+                ranges.append([row_number, row_number])
+        
+        worksheet = self._worksheet(sheet_name)
+        requests = [
+            {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": worksheet.id,
+                        "dimension": "ROWS",
+                        "startIndex": start - 1,
+                        "endIndex": end
+                    }
+                }
+            }
+            for start, end in reversed(ranges)
+        ]
+        self._call(lambda: self.spreadsheet.batch_update({"requests": requests}), 'write')
+    
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        """סטטיסטיקות המתזמן - עומק תורים, האטות וניסיונות חוזרים"""
+        return self.scheduler.get_stats()
+    
+    def get_write_queue_stats(self) -> Dict[str, Any]:
+        """סטטיסטיקות תור ה-write-behind"""
+        with self._pending_lock:
+            stats = dict(self._queue_stats)
+            stats["pending"] = len(self._pending_expenses)
+        stats["enabled"] = self.write_behind
+        stats["flush_interval_seconds"] = self.flush_interval
+        stats["max_batch"] = self.flush_max_batch
+        return stats
     
     # ===== ניהול קבצים ב-Drive =====
     
-    def _create_couple_folder(self, group_id: str) -> str:
-        """יצירת תיקיית זוג ב-Drive"""
+    def _create_couple_folder(self, group_id: str) -> Dict[str, str]:
+        """יצירת תיקיית זוג ב-Drive
+        
+        מחזיר {"couple": id, "receipts": id, "contacts": id, "merged_files": id}
+        """
         try:
             # יצירת תיקיה ראשית אם לא קיימת
             main_folder_id = self._get_or_create_main_folder()
             
             # יצירת תיקיית הזוג
-            couple_folder_metadata = {
-                'name': f'couple_{group_id}',
-                'parents': [main_folder_id],
-                'mimeType': 'application/vnd.google-apps.folder'
-            }
-            
-            couple_folder = self.drive_service.files().create(
-                body=couple_folder_metadata,
+            couple_folder = self._call(self.drive_service.files().create(
+                body=self._folder_metadata(f'couple_{group_id}', main_folder_id),
                 fields='id'
-            ).execute()
+            ).execute, 'drive')
             
             couple_folder_id = couple_folder.get('id')
+            folder_ids = {'couple': couple_folder_id}
             
-            # יצירת תת-תיקיות
+            # יצירת תת-תיקיות - כל השלוש בבקשת batch אחת לדרייב
             subfolders = ['receipts', 'contacts', 'merged_files']
+            
+            def on_created(request_id, response, exception):
+                if exception:
+                    logger.warning(f"Batch create of '{request_id}' failed: {exception}")
+                else:
+                    folder_ids[request_id] = response.get('id')
+            
+            batch = self.drive_service.new_batch_http_request(callback=on_created)
             for subfolder in subfolders:
-                subfolder_metadata = {
-                    'name': subfolder,
-                    'parents': [couple_folder_id],
-                    'mimeType': 'application/vnd.google-apps.folder'
-                }
-                self.drive_service.files().create(
-                    body=subfolder_metadata,
-                    fields='id'
-                ).execute()
+                batch.add(
+                    self.drive_service.files().create(
+                        body=self._folder_metadata(subfolder, couple_folder_id),
+                        fields='id'
+                    ),
+                    request_id=subfolder
+                )
+            self._call(batch.execute, 'drive')
+            
+            # תת-תיקיות שנכשלו ב-batch נוצרות בנפרד
+            for subfolder in subfolders:
+                if not folder_ids.get(subfolder):
+                    created = self._call(self.drive_service.files().create(
+                        body=self._folder_metadata(subfolder, couple_folder_id),
+                        fields='id'
+                    ).execute, 'drive')
+                    folder_ids[subfolder] = created.get('id')
+            
+            self._folder_ids[group_id] = folder_ids
             
             logger.info(f"Created folder structure for couple: {group_id}")
-            return couple_folder_id
+            return folder_ids
             
         except Exception as e:
             logger.error(f"Failed to create couple folder: {e}")
-            return ""
+            return {}
+    
+    def _folder_metadata(self, name: str, parent_id: str) -> Dict:
+        """מטא-דאטה ליצירת תיקייה בדרייב"""
+        return {
+            'name': name,
+            'parents': [parent_id],
+            'mimeType': 'application/vnd.google-apps.folder'
+        }
     
     def _get_or_create_main_folder(self) -> str:
         """קבלת או יצירת התיקיה הראשית"""
+        if self._main_folder_id:
+            return self._main_folder_id
+        
         try:
             # חיפוש התיקיה הראשית
             query = "name='Wedding_System' and mimeType='application/vnd.google-apps.folder'"
-            results = self.drive_service.files().list(
+            results = self._call(self.drive_service.files().list(
                 q=query,
                 spaces='drive',
                 fields='files(id, name)'
-            ).execute()
+            ).execute, 'drive', idempotent=True)
             
             files = results.get('files', [])
             
             if files:
-                return files[0]['id']
+                self._main_folder_id = files[0]['id']
+                return self._main_folder_id
             
             # יצירת התיקיה הראשית
             folder_metadata = {
@@ -391,19 +1636,87 @@ class GoogleServicesManager:
                 'mimeType': 'application/vnd.google-apps.folder'
             }
             
-            folder = self.drive_service.files().create(
+            folder = self._call(self.drive_service.files().create(
                 body=folder_metadata,
                 fields='id'
-            ).execute()
+            ).execute, 'drive')
             
-            return folder.get('id')
+            self._main_folder_id = folder.get('id')
+            return self._main_folder_id
             
         except Exception as e:
             logger.error(f"Failed to get/create main folder: {e}")
             return ""
     
+    def _get_subfolder_id(self, group_id: str, subfolder: str) -> str:
+        """מציאת תת-תיקייה של זוג (receipts / contacts / merged_files)
+        
+        סדר החיפוש: מפה בזיכרון, עמודות בגיליון הזוגות, ורק לזוגות ישנים
+        חיפוש בדרייב - שתוצאתו נשמרת בגיליון כדי שלא יחזור על עצמו.
+        """
+        cached = self._folder_ids.get(group_id, {})
+        if cached.get(subfolder):
+            return cached[subfolder]
+        
+        try:
+            found = self._lookup_row('couples', group_id)
+            if found:
+                _, record = found
+                stored = {
+                    folder: str(record.get(column) or '')
+                    for folder, column in FOLDER_COLUMNS.items()
+                }
+                if stored.get(subfolder):
+                    self._folder_ids[group_id] = stored
+                    return stored[subfolder]
+            
+            # זוג שנוצר לפני שמזהי התיקיות נשמרו בגיליון - חיפוש בדרייב
+            folder_ids = self._find_couple_folders(group_id)
+            if not folder_ids.get(subfolder):
+                return ""
+            
+            self._folder_ids[group_id] = folder_ids
+            if found:
+                columns = {FOLDER_COLUMNS[folder]: folder_id for folder, folder_id in folder_ids.items()}
+                if self._write_row_fields('couples', found[0], group_id, columns):
+                    self._cache_update('couples', group_id, columns)
+            
+            return folder_ids[subfolder]
+            
+        except Exception as e:
+            logger.error(f"Failed to get {subfolder} folder: {e}")
+            return ""
+    
+    def _find_couple_folders(self, group_id: str) -> Dict[str, str]:
+        """חיפוש תיקיית הזוג ותתי-התיקיות שלה בדרייב"""
+        couple_query = f"name='couple_{group_id}' and mimeType='application/vnd.google-apps.folder'"
+        couple_results = self._call(self.drive_service.files().list(
+            q=couple_query,
+            fields='files(id)'
+        ).execute, 'drive', idempotent=True)
+        
+        couple_files = couple_results.get('files', [])
+        if not couple_files:
+            return {}
+        
+        couple_folder_id = couple_files[0]['id']
+        
+        # כל תתי-התיקיות בשאילתה אחת
+        subfolders_query = f"mimeType='application/vnd.google-apps.folder' and '{couple_folder_id}' in parents"
+        subfolders_results = self._call(self.drive_service.files().list(
+            q=subfolders_query,
+            fields='files(id, name)'
+        ).execute, 'drive', idempotent=True)
+        
+        folder_ids = {'couple': couple_folder_id}
+        for folder in subfolders_results.get('files', []):
+            if folder.get('name') in FOLDER_COLUMNS and folder['name'] not in folder_ids:
+                folder_ids[folder['name']] = folder['id']
+        
+        return folder_ids
+    
     def upload_receipt_image(self, group_id: str, image_data: bytes, 
-                           filename: str = None) -> str:
+                           filename: str = None, mimetype: str = 'image/jpeg') -> str:
         """העלאת תמונת קבלה ל-Drive"""
         try:
             if not filename:
@@ -417,7 +1730,7 @@ class GoogleServicesManager:
             # העלאת הקובץ
             media = MediaIoBaseUpload(
                 BytesIO(image_data),
-                mimetype='image/jpeg'
+                mimetype=mimetype
             )
             
             file_metadata = {
@@ -425,11 +1738,11 @@ class GoogleServicesManager:
                 'parents': [receipts_folder_id]
             }
             
-            file = self.drive_service.files().create(
+            file = self._call(self.drive_service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
+            ).execute, 'drive')
             
             file_id = file.get('id')
             
@@ -445,36 +1758,7 @@ class GoogleServicesManager:
     
     def _get_receipts_folder_id(self, group_id: str) -> str:
         """מציאת תיקיית הקבלות של זוג"""
-        try:
-            # חיפוש תיקיית הזוג
-            couple_query = f"name='couple_{group_id}' and mimeType='application/vnd.google-apps.folder'"
-            couple_results = self.drive_service.files().list(
-                q=couple_query,
-                fields='files(id)'
-            ).execute()
-            
-            couple_files = couple_results.get('files', [])
-            if not couple_files:
-                return ""
-            
-            couple_folder_id = couple_files[0]['id']
-            
-            # חיפוש תיקיית הקבלות
-            receipts_query = f"name='receipts' and parents in '{couple_folder_id}'"
-            receipts_results = self.drive_service.files().list(
-                q=receipts_query,
-                fields='files(id)'
-            ).execute()
-            
-            receipts_files = receipts_results.get('files', [])
-            if receipts_files:
-                return receipts_files[0]['id']
-            
-            return ""
-            
-        except Exception as e:
-            logger.error(f"Failed to get receipts folder: {e}")
-            return ""
+        return self._get_subfolder_id(group_id, 'receipts')
     
     # ===== ניהול קבצי חיבור אנשי קשר =====
     
@@ -499,11 +1783,11 @@ class GoogleServicesManager:
                 'parents': [contacts_folder_id]
             }
             
-            self.drive_service.files().create(
+            self._call(self.drive_service.files().create(
                 body=contacts_metadata,
                 media_body=contacts_media,
                 fields='id'
-            ).execute()
+            ).execute, 'drive')
             
             # שמירת קובץ מוזמנים
             guests_media = MediaIoBaseUpload(
@@ -516,11 +1800,11 @@ class GoogleServicesManager:
                 'parents': [contacts_folder_id]
             }
             
-            self.drive_service.files().create(
+            self._call(self.drive_service.files().create(
                 body=guests_metadata,
                 media_body=guests_media,
                 fields='id'
-            ).execute()
+            ).execute, 'drive')
             
             # שמירת התקדמות בגיליון
             progress_json = json.dumps(progress)
@@ -533,55 +1817,9 @@ class GoogleServicesManager:
             logger.error(f"Failed to save contacts files: {e}")
             return False
     
-    def get_contacts_progress(self, group_id: str) -> Dict:
-        """קבלת התקדמות חיבור אנשי קשר"""
-        try:
-            couple = self.get_couple_by_group_id(group_id)
-            if not couple:
-                return {}
-            
-            progress_json = couple.get('contacts_progress', '')
-            if not progress_json:
-                return {}
-            
-            return json.loads(progress_json)
-            
-        except Exception as e:
-            logger.error(f"Failed to get contacts progress: {e}")
-            return {}
-    
     def _get_contacts_folder_id(self, group_id: str) -> str:
         """מציאת תיקיית אנשי הקשר של זוג"""
-        try:
-            # חיפוש תיקיית הזוג
-            couple_query = f"name='couple_{group_id}' and mimeType='application/vnd.google-apps.folder'"
-            couple_results = self.drive_service.files().list(
-                q=couple_query,
-                fields='files(id)'
-            ).execute()
-            
-            couple_files = couple_results.get('files', [])
-            if not couple_files:
-                return ""
-            
-            couple_folder_id = couple_files[0]['id']
-            
-            # חיפוש תיקיית אנשי הקשר
-            contacts_query = f"name='contacts' and parents in '{couple_folder_id}'"
-            contacts_results = self.drive_service.files().list(
-                q=contacts_query,
-                fields='files(id)'
-            ).execute()
-            
-            contacts_files = contacts_results.get('files', [])
-            if contacts_files:
-                return contacts_files[0]['id']
-            
-            return ""
-            
-        except Exception as e:
-            logger.error(f"Failed to get contacts folder: {e}")
-            return ""
+        return self._get_subfolder_id(group_id, 'contacts')
     
     def save_merged_file(self, group_id: str, merged_data: bytes, 
                         filename: str = None) -> str:
@@ -606,11 +1844,11 @@ class GoogleServicesManager:
                 'parents': [merged_folder_id]
             }
             
-            file = self.drive_service.files().create(
+            file = self._call(self.drive_service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
+            ).execute, 'drive')
             
             file_id = file.get('id')
             file_url = f"https://drive.google.com/file/d/{file_id}/view"
@@ -624,34 +1862,7 @@ class GoogleServicesManager:
     
     def _get_merged_folder_id(self, group_id: str) -> str:
         """מציאת תיקיית הקבצים המחוברים"""
-        try:
-            couple_query = f"name='couple_{group_id}' and mimeType='application/vnd.google-apps.folder'"
-            couple_results = self.drive_service.files().list(
-                q=couple_query,
-                fields='files(id)'
-            ).execute()
-            
-            couple_files = couple_results.get('files', [])
-            if not couple_files:
-                return ""
-            
-            couple_folder_id = couple_files[0]['id']
-            
-            merged_query = f"name='merged_files' and parents in '{couple_folder_id}'"
-            merged_results = self.drive_service.files().list(
-                q=merged_query,
-                fields='files(id)'
-            ).execute()
-            
-            merged_files = merged_results.get('files', [])
-            if merged_files:
-                return merged_files[0]['id']
-            
-            return ""
-            
-        except Exception as e:
-            logger.error(f"Failed to get merged folder: {e}")
-            return ""
+        return self._get_subfolder_id(group_id, 'merged_files')
     
     # ===== פונקציות עזר ובדיקות =====
     
@@ -679,7 +1890,7 @@ class GoogleServicesManager:
                 checks["spreadsheet_access"] = True
                 
                 # בדיקת קיום גיליונות
-                worksheets = {ws.title for ws in self.spreadsheet.worksheets()}
+                worksheets = {ws.title for ws in self._call(self.spreadsheet.worksheets)}
                 checks["couples_sheet_exists"] = 'couples' in worksheets
                 checks["expenses_sheet_exists"] = 'expenses' in worksheets
             
@@ -690,6 +1901,11 @@ class GoogleServicesManager:
     
     def get_statistics(self) -> Dict:
         """קבלת סטטיסטיקות כלליות של המערכת"""
+        with request_priority(PRIORITY_LOW):
+            return self._get_statistics()
+    
+    def _get_statistics(self) -> Dict:
+        """חישוב הסטטיסטיקות"""
         try:
             stats = {
                 "total_couples": 0,
@@ -703,41 +1919,19 @@ class GoogleServicesManager:
             couples = self.get_all_active_couples()
             stats["active_couples"] = len(couples)
             
-            couples_sheet = self.spreadsheet.worksheet('couples')
-            all_couples = couples_sheet.get_all_records()
+            all_couples = self._get_records('couples')
             stats["total_couples"] = len(all_couples)
             
-            # סטטיסטיקות הוצאות
-            expenses_sheet = self.spreadsheet.worksheet('expenses')
-            all_expenses = expenses_sheet.get_all_records()
-            
-            active_expenses = [
-                exp for exp in all_expenses 
-                if exp.get('status') == 'active'
-            ]
-            
-            stats["total_expenses"] = len(active_expenses)
+            # סטטיסטיקות הוצאות - מתוך הסיכומים של כל זוג
+            summaries = self.get_expense_summaries().values()
             
-            # חישוב סכום כולל
-            total_amount = 0
-            for expense in active_expenses:
-                try:
-                    amount = float(expense.get('amount', 0))
-                    total_amount += amount
-                except (ValueError, TypeError):
-                    continue
-            
-            stats["total_amount"] = total_amount
+            stats["total_expenses"] = sum(summary["count"] for summary in summaries)
+            stats["total_amount"] = round(sum(summary["total_amount"] for summary in summaries), 2)
             
             # פעילות אחרונה
-            if active_expenses:
-                latest_expense = max(
-                    active_expenses,
-                    key=lambda x: x.get('created_at', ''),
-                    default=None
-                )
-                if latest_expense:
-                    stats["last_activity"] = latest_expense.get('created_at')
+            latest = max((summary["last_created_at"] for summary in summaries), default="")
+            if latest:
+                stats["last_activity"] = latest
             
             return stats
             
@@ -748,14 +1942,39 @@ class GoogleServicesManager:
 
 # ===== מופע גלובלי =====
 _google_services = None
+_google_services_lock = threading.Lock()
+_prewarm_started = False
 
-def get_google_services() -> GoogleServicesManager:
-    """קבלת מופע יחיד של GoogleServicesManager"""
+def get_google_services() -> StorageBackend:
+    """קבלת מופע יחיד של מנגנון האחסון לפי STORAGE_BACKEND"""
     global _google_services
-    if _google_services is None:
-        _google_services = GoogleServicesManager()
+    # נקרא גם מה-thread pool של ה-webhook - נעילה כדי שלא ייווצרו שני מופעים
+    with _google_services_lock:
+        if _google_services is None:
+            if STORAGE_BACKEND == 'sqlite':
+                from sqlite_storage import SQLiteStorageManager
+                _google_services = SQLiteStorageManager()
+            else:
+                _google_services = GoogleServicesManager()
     return _google_services
 
+def prewarm_google_services():
+    """אתחול מנגנון האחסון ב-thread רקע - פעם אחת לתהליך
+    
+    נקרא מאירוע ה-startup של ה-webhook ומנקודת הכניסה של Streamlit.
+    """
+    global _prewarm_started
+    with _google_services_lock:
+        if _prewarm_started:
+            return
+        _prewarm_started = True
+    
+    threading.Thread(
+        target=lambda: get_google_services().prewarm(),
+        name="google-prewarm",
+        daemon=True
+    ).start()
+
 
 # ===== בדיקה =====
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+import asyncio
+import importlib.util
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+
+from config import (
+    GREENAPI_INSTANCE_ID,
+    GREENAPI_TOKEN,
+    GREENAPI_API_URL,
+    GREENAPI_MAX_CONNECTIONS,
+    GREENAPI_MAX_KEEPALIVE,
+    GREENAPI_KEEPALIVE_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 רק אם חבילת h2 מותקנת (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+class GreenAPIClient:
+    """לקוח משותף ל-Green API עם חיבורים קבועים
+    
+    כל ההודעות היוצאות נשלחות בכוונה מה-thread של OutboundScheduler דרך הלקוח
+    הסינכרוני (אחד לכל התהליך, גם עבור ה-OTP והדשבורד), והורדת מדיה בבוט עוברת
+    דרך pool אסינכרוני. שני ה-pools נוצרים בשימוש הראשון ונשארים פתוחים - כך
+    בקשה לא משלמת על לחיצת יד TCP+TLS חדשה.
+    """
+    
+    def __init__(self, instance_id: Optional[str] = GREENAPI_INSTANCE_ID,
+                 token: Optional[str] = GREENAPI_TOKEN, api_url: str = GREENAPI_API_URL):
+        self.instance_id = instance_id
+        self.token = token
+        self.api_url = api_url
+        
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        
+        self._stats = {"requests": 0, "errors": 0, "downloads": 0}
+    
+    def url(self, method: str) -> str:
+        """כתובת מתודה של Green API"""
+        return f"{self.api_url}/waInstance{self.instance_id}/{method}/{self.token}"
+    
+    def _client_options(self) -> Dict[str, Any]:
+        """הגדרות pool משותפות ללקוח הסינכרוני ולאסינכרוני"""
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "limits": httpx.Limits(
+                max_connections=GREENAPI_MAX_CONNECTIONS,
+                max_keepalive_connections=GREENAPI_MAX_KEEPALIVE,
+                keepalive_expiry=GREENAPI_KEEPALIVE_SECONDS
+            ),
+            "timeout": httpx.Timeout(10.0, connect=5.0),
+        }
+    
+    @property
+    def client(self) -> httpx.Client:
+        """לקוח סינכרוני (תור ההודעות היוצאות)"""
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self._client_options())
+            return self._client
+    
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """לקוח אסינכרוני של ה-event loop הנוכחי (הבוט)
+        
+        לקוח אסינכרוני קשור ל-loop שבו נוצר, ולכן נוצר מחדש אם ה-loop התחלף.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = httpx.AsyncClient(**self._client_options())
+            self._async_loop = loop
+        return self._async_client
+    
+    def _count(self, response: Optional[httpx.Response]):
+        """מונה בקשות ושגיאות"""
+        self._stats["requests"] += 1
+        if response is None or response.status_code != 200:
+            self._stats["errors"] += 1
+    
+    # ===== סינכרוני =====
+    
+    def post(self, method: str, payload: Dict, timeout: float = 10) -> httpx.Response:
+        """קריאה ל-Green API"""
+        response = None
+        try:
+            response = self.client.post(self.url(method), json=payload, timeout=timeout)
+            return response
+        finally:
+            self._count(response)
+    
+    # ===== אסינכרוני =====
+    
+    async def download(self, download_url: str, timeout: float = 30) -> httpx.Response:
+        """הורדת קובץ מדיה מהודעה"""
+        self._stats["downloads"] += 1
+        return await self.async_client.get(download_url, timeout=timeout)
+    
+    # ===== סגירה =====
+    
+    async def aclose(self):
+        """סגירת החיבורים (כיבוי השרת)"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_loop = None
+        self.close()
+    
+    def close(self):
+        """סגירת הלקוח הסינכרוני"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """מוני בקשות ומצב ה-pool"""
+        stats = dict(self._stats)
+        stats["http2"] = HTTP2_AVAILABLE
+        stats["max_connections"] = GREENAPI_MAX_CONNECTIONS
+        stats["max_keepalive"] = GREENAPI_MAX_KEEPALIVE
+        return stats
+
+
+# ===== מופע גלובלי =====
+_green_api_client = None
+_client_lock = threading.Lock()
+
+def get_green_api_client() -> GreenAPIClient:
+    """קבלת מופע יחיד של לקוח Green API"""
+    global _green_api_client
+    with _client_lock:
+        if _green_api_client is None:
+            _green_api_client = GreenAPIClient()
+    return _green_api_client
\ No newline at end of file
@@ -10,7 +10,7 @@ logging.basicConfig(
 
 from config import get_main_css, COLORS, APP_NAME, VERSION
 from auth_system import get_auth_manager
-from google_services import get_google_services
+from google_services import get_google_services, prewarm_google_services
 
 def main():
     """נקודת הכניסה הראשית של המערכת"""
@@ -23,6 +23,9 @@ def main():
         initial_sidebar_state="collapsed"
     )
     
+    # חיבור לגוגל ברקע (פעם אחת לתהליך) - הדף הראשון לא מחכה לאתחול
+    prewarm_google_services()
+    
     # טעינת CSS מאוחד
     st.markdown(get_main_css(), unsafe_allow_html=True)
     
@@ -1,4 +1,5 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
@@ -9,6 +10,7 @@ import json
 from config import COLORS, WEDDING_CATEGORIES, BOT_MESSAGES, get_contacts_merge_url
 from auth_system import get_auth_manager
 from google_services import get_google_services
+from expense_table import ExpenseTable
 
 def main():
     """הדשבורד הראשי של הזוג"""
@@ -27,14 +29,15 @@ def main():
     # טעינת נתונים
     gs = get_google_services()
     couple_data = gs.get_couple_by_group_id(group_id)
-    expenses_data = gs.get_expenses_by_group(group_id)
+    expense_table = gs.get_expense_table([group_id])
+    summary = gs.get_expense_summary(group_id)
     
     if not couple_data:
         st.error("❌ לא נמצאו נתוני הזוג. אנא פנה לתמיכה.")
         return
     
     # בניית הדשבורד
-    render_dashboard(couple_data, expenses_data, group_id)
+    render_dashboard(couple_data, expense_table, summary, group_id)
 
 def check_authentication() -> bool:
     """בדיקת אימות מתקדמת"""
@@ -171,18 +174,18 @@ def show_auth_form():
                     st.session_state.auth_step = 'phone'
                     st.rerun()
 
-def render_dashboard(couple_data: Dict, expenses_data: List[Dict], group_id: str):
+def render_dashboard(couple_data: Dict, expense_table: ExpenseTable, summary: Dict, group_id: str):
     """רינדור הדשבורד הראשי"""
     
     # כותרת עליונה
     render_header(couple_data)
     
     # סטטיסטיקות עליונות
-    render_statistics_cards(expenses_data, couple_data)
+    render_statistics_cards(summary, couple_data)
     
     # גרפים
-    if expenses_data:
-        render_charts(expenses_data)
+    if summary["count"]:
+        render_charts(summary)
     else:
         st.markdown("""
         <div class="alert alert-info">
@@ -192,13 +195,13 @@ def render_dashboard(couple_data: Dict, expenses_data: List[Dict], group_id: str
         """, unsafe_allow_html=True)
     
     # טבלת הוצאות אחרונות
-    render_recent_expenses(expenses_data)
+    render_recent_expenses(expense_table)
     
     # כפתורי פעולה
     render_action_buttons(group_id)
     
     # סייד בר עם פילטרים
-    render_sidebar(expenses_data, couple_data, group_id)
+    render_sidebar(summary, couple_data, group_id)
 
 def render_header(couple_data: Dict):
     """כותרת הדשבורד"""
@@ -230,13 +233,12 @@ def render_header(couple_data: Dict):
     </div>
     """, unsafe_allow_html=True)
 
-def render_statistics_cards(expenses_data: List[Dict], couple_data: Dict):
+def render_statistics_cards(summary: Dict, couple_data: Dict):
     """כרטיסי סטטיסטיקות"""
     
-    # חישוב סטטיסטיקות
-    active_expenses = [exp for exp in expenses_data if exp.get('status') == 'active']
-    total_amount = sum(float(exp.get('amount', 0)) for exp in active_expenses)
-    total_count = len(active_expenses)
+    # סטטיסטיקות מתוך סיכום ההוצאות השמור
+    total_amount = summary["total_amount"]
+    total_count = summary["count"]
     avg_amount = total_amount / total_count if total_count > 0 else 0
     
     # תקציב
@@ -301,14 +303,12 @@ def render_statistics_cards(expenses_data: List[Dict], couple_data: Dict):
             </div>
             """, unsafe_allow_html=True)
 
-def render_charts(expenses_data: List[Dict]):
+def render_charts(summary: Dict):
     """גרפים של ההוצאות"""
     
     st.markdown("## 📊 ניתוח הוצאות")
     
-    active_expenses = [exp for exp in expenses_data if exp.get('status') == 'active']
-    
-    if not active_expenses:
+    if not summary["count"]:
         return
     
     col1, col2 = st.columns(2)
@@ -317,11 +317,7 @@ def render_charts(expenses_data: List[Dict]):
         # גרף קטגוריות
         st.markdown("### 🏷️ הוצאות לפי קטגוריה")
         
-        categories_data = {}
-        for exp in active_expenses:
-            category = exp.get('category', 'אחר')
-            amount = float(exp.get('amount', 0))
-            categories_data[category] = categories_data.get(category, 0) + amount
+        categories_data = summary["by_category"]
         
         if categories_data:
             # הכנת DataFrame
@@ -351,17 +347,7 @@ def render_charts(expenses_data: List[Dict]):
         st.markdown("### 📅 הוצאות לאורך זמן")
         
         # הכנת נתונים לפי תאריך
-        monthly_data = {}
-        for exp in active_expenses:
-            date_str = exp.get('date', '')
-            if date_str:
-                try:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                    month_key = date_obj.strftime('%Y-%m')
-                    amount = float(exp.get('amount', 0))
-                    monthly_data[month_key] = monthly_data.get(month_key, 0) + amount
-                except:
-                    continue
+        monthly_data = summary["by_month"]
         
         if monthly_data:
             # מיון לפי תאריך
@@ -389,14 +375,14 @@ def render_charts(expenses_data: List[Dict]):
             
             st.plotly_chart(fig_line, use_container_width=True)
 
-def render_recent_expenses(expenses_data: List[Dict]):
+def render_recent_expenses(expense_table: ExpenseTable):
     """טבלת הוצאות אחרונות"""
     
     st.markdown("## 📋 הוצאות אחרונות")
     
-    active_expenses = [exp for exp in expenses_data if exp.get('status') == 'active']
+    active_expenses = expense_table.active_only()
     
-    if not active_expenses:
+    if not len(active_expenses):
         st.markdown("""
         <div class="alert alert-info">
             <h4>📝 עדיין אין הוצאות</h4>
@@ -411,52 +397,26 @@ def render_recent_expenses(expenses_data: List[Dict]):
         """, unsafe_allow_html=True)
         return
     
-    # מיון לפי תאריך יצירה (חדשים ראשון)
-    sorted_expenses = sorted(
-        active_expenses, 
-        key=lambda x: x.get('created_at', ''), 
-        reverse=True
+    # 15 האחרונות (חדשות ראשון)
+    recent = active_expenses.newest(15).frame
+    amounts = recent['amount']
+    categories = recent['category'].astype(str)
+    
+    # צבע לפי סכום
+    markers = np.select(
+        [amounts > 10000, amounts > 5000, amounts > 1000],
+        ['🔴', '🟠', '🟡'],
+        default='🟢'
     )
     
-    # הכנת DataFrame לתצוגה
-    display_data = []
-    for exp in sorted_expenses[:15]:  # 15 אחרונות
-        vendor = exp.get('vendor', 'לא מזוהה')
-        amount = float(exp.get('amount', 0))
-        category = exp.get('category', 'אחר')
-        date = exp.get('date', '')
-        emoji = WEDDING_CATEGORIES.get(category, '📋')
-        
-        # עיצוב תאריך
-        if date:
-            try:
-                date_obj = datetime.strptime(date, '%Y-%m-%d')
-                formatted_date = date_obj.strftime('%d/%m/%Y')
-            except:
-                formatted_date = date
-        else:
-            formatted_date = ''
-        
-        # צבע לפי סכום
-        if amount > 10000:
-            amount_display = f"🔴 {amount:,.0f} ₪"
-        elif amount > 5000:
-            amount_display = f"🟠 {amount:,.0f} ₪"
-        elif amount > 1000:
-            amount_display = f"🟡 {amount:,.0f} ₪"
-        else:
-            amount_display = f"🟢 {amount:,.0f} ₪"
-        
-        display_data.append({
-            'קטגוריה': f"{emoji} {category}",
-            'ספק': vendor,
-            'סכום': amount_display,
-            'תאריך': formatted_date
-        })
-    
-    if display_data:
-        df_display = pd.DataFrame(display_data)
-        
+    df_display = pd.DataFrame({
+        'קטגוריה': categories.map(lambda category: f"{WEDDING_CATEGORIES.get(category, '📋')} {category}"),
+        'ספק': recent['vendor'],
+        'סכום': [f"{marker} {amount:,.0f} ₪" for marker, amount in zip(markers, amounts)],
+        'תאריך': recent['date'].dt.strftime('%d/%m/%Y').fillna('')
+    })
+    
+    if len(df_display):
         st.dataframe(
             df_display,
             use_container_width=True,
@@ -568,29 +528,25 @@ def show_manual_expense_form(group_id: str):
 def export_data(group_id: str):
     """ייצוא נתונים"""
     gs = get_google_services()
-    expenses = gs.get_expenses_by_group(group_id)
+    expenses = gs.get_expense_table([group_id]).active_only().newest().frame
     
-    if not expenses:
+    if not len(expenses):
         st.warning("אין נתונים לייצוא")
         return
     
     # הכנת DataFrame
-    export_data = []
-    for exp in expenses:
-        if exp.get('status') == 'active':
-            export_data.append({
-                'תאריך': exp.get('date', ''),
-                'ספק': exp.get('vendor', ''),
-                'קטגוריה': exp.get('category', ''),
-                'סכום': float(exp.get('amount', 0)),
-                'תיאור': exp.get('description', ''),
-                'אמצעי תשלום': exp.get('payment_method', ''),
-                'תאריך יצירה': exp.get('created_at', ''),
-                'ביטחון AI': exp.get('confidence', 0)
-            })
-    
-    if export_data:
-        df_export = pd.DataFrame(export_data)
+    df_export = pd.DataFrame({
+        'תאריך': expenses['date'].dt.strftime('%Y-%m-%d').fillna(''),
+        'ספק': expenses['vendor'],
+        'קטגוריה': expenses['category'].astype(str),
+        'סכום': expenses['amount'],
+        'תיאור': expenses['description'],
+        'אמצעי תשלום': expenses['payment_method'].astype(str),
+        'תאריך יצירה': expenses['created_at'].dt.strftime('%Y-%m-%dT%H:%M:%S').fillna(''),
+        'ביטחון AI': expenses['confidence']
+    })
+    
+    if len(df_export):
         
         # הורדה כ-CSV
         csv = df_export.to_csv(index=False, encoding='utf-8-sig')
@@ -678,11 +634,7 @@ def show_settings_form(group_id: str):
                 else:
                     updates['budget'] = 'אין עדיין'
                 
-                success = True
-                for field, value in updates.items():
-                    if not gs.update_couple_field(group_id, field, value):
-                        success = False
-                        break
+                success = gs.update_couple_fields(group_id, updates)
                 
                 if success:
                     st.success("✅ הגדרות נשמרו בהצלחה!")
@@ -691,7 +643,7 @@ def show_settings_form(group_id: str):
                 else:
                     st.error("❌ שגיאה בשמירת הגדרות")
 
-def render_sidebar(expenses_data: List[Dict], couple_data: Dict, group_id: str):
+def render_sidebar(summary: Dict, couple_data: Dict, group_id: str):
     """סייד בר עם מידע נוסף"""
     
     with st.sidebar:
@@ -738,20 +690,13 @@ def render_sidebar(expenses_data: List[Dict], couple_data: Dict, group_id: str):
         # סטטיסטיקות מהירות
         st.markdown("### 📊 סטטיסטיקות")
         
-        active_expenses = [exp for exp in expenses_data if exp.get('status') == 'active']
-        
-        if active_expenses:
+        if summary["count"]:
             # הוצאה הגבוהה ביותר
-            max_expense = max(active_expenses, key=lambda x: float(x.get('amount', 0)))
             st.write(f"**הוצאה הגבוהה ביותר:**")
-            st.write(f"{max_expense.get('vendor', 'לא מזוהה')} - {float(max_expense.get('amount', 0)):,.0f} ₪")
+            st.write(f"{summary['max_vendor'] or 'לא מזוהה'} - {summary['max_amount']:,.0f} ₪")
             
             # קטגוריה הכי יקרה
-            categories_sum = {}
-            for exp in active_expenses:
-                cat = exp.get('category', 'אחר')
-                amount = float(exp.get('amount', 0))
-                categories_sum[cat] = categories_sum.get(cat, 0) + amount
+            categories_sum = summary["by_category"]
             
             if categories_sum:
                 top_category = max(categories_sum.items(), key=lambda x: x[1])
@@ -761,15 +706,12 @@ def render_sidebar(expenses_data: List[Dict], couple_data: Dict, group_id: str):
             
             # הוצאות החודש
             current_month = datetime.now().strftime('%Y-%m')
-            month_expenses = [
-                exp for exp in active_expenses 
-                if exp.get('date', '').startswith(current_month)
-            ]
+            month_count = summary["month_counts"].get(current_month, 0)
             
-            if month_expenses:
-                month_total = sum(float(exp.get('amount', 0)) for exp in month_expenses)
+            if month_count:
+                month_total = summary["by_month"].get(current_month, 0)
                 st.write(f"**הוצאות החודש:**")
-                st.write(f"{month_total:,.0f} ₪ ({len(month_expenses)} קבלות)")
+                st.write(f"{month_total:,.0f} ₪ ({month_count} קבלות)")
         
         st.markdown("---")
         
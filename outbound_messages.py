@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Deque, Dict, Optional
+
+import httpx
+
+from config import (
+    GREENAPI_SEND_RATE_PER_SECOND,
+    GREENAPI_SEND_MAX_RETRIES,
+    GOOGLE_BACKOFF_BASE_SECONDS,
+    GOOGLE_BACKOFF_MAX_SECONDS
+)
+from green_api_client import GreenAPIClient, get_green_api_client
+
+logger = logging.getLogger(__name__)
+
+# אורך מקסימלי של הודעה מאוחדת - מעבר לזה נפתחת הודעה חדשה לאותו צ'אט
+MAX_MERGED_CHARS = 4000
+
+# מפריד בין הודעות שאוחדו
+MERGE_SEPARATOR = "\n\n"
+
+# sendMessage אינה אידמפוטנטית - ניסיון חוזר רק כשבטוח שההודעה לא נשלחה:
+# 429, או שגיאה לפני שהבקשה יצאה (חיבור / המתנה לחיבור פנוי).
+# 5xx או timeout בקריאה - ייתכן שההודעה כבר נשלחה, ולכן אין ניסיון חוזר
+SAFE_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class OutboundScheduler:
+    """תור הודעות יוצאות ל-WhatsApp עם קצב שליחה לכל תהליך
+    
+    - thread שולח אחד מוציא הודעות לפי הסדר, לכל היותר
+      GREENAPI_SEND_RATE_PER_SECOND בשנייה. הקצב נאכף בתוך התהליך בלבד -
+      כל תהליך ששולח (השרת של ה-webhook והדשבורד) מריץ תור משלו, ולכן
+      הקצב המצטבר מול ה-instance הוא סכום הקצבים של התהליכים
+    - כמה הודעות לאותו צ'אט שעדיין ממתינות בתור מאוחדות להודעה אחת
+    - ניסיון חוזר עם backoff רק כשההודעה בוודאות לא נשלחה (ראו SAFE_RETRY_ERRORS).
+      429 עוצר את כל התור (Retry-After אם נשלח)
+    עובד גם מקוד אסינכרוני (send) וגם מסינכרוני (send_and_wait).
+    """
+    
+    def __init__(self, client: Optional[GreenAPIClient] = None,
+                 rate_per_second: float = GREENAPI_SEND_RATE_PER_SECOND,
+                 max_retries: int = GREENAPI_SEND_MAX_RETRIES,
+                 backoff_base: float = GOOGLE_BACKOFF_BASE_SECONDS,
+                 backoff_max: float = GOOGLE_BACKOFF_MAX_SECONDS):
+        self._client = client
+        self.rate_per_second = max(rate_per_second, 0.01)
+        self.min_interval = 1.0 / self.rate_per_second
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        
+        self._cond = threading.Condition()
+        self._queue: Deque[Dict] = deque()
+        self._open: Dict[str, Dict] = {}  # {chat_id: הודעה בתור שאפשר עוד לצרף אליה}
+        self._sending = False
+        self._next_send_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        
+        self._stats = {
+            "submitted": 0,
+            "sent": 0,
+            "merged": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "latency_seconds_total": 0.0,
+            "latency_seconds_max": 0.0,
+        }
+    
+    @property
+    def client(self) -> GreenAPIClient:
+        """לקוח Green API המשותף"""
+        if self._client is None:
+            self._client = get_green_api_client()
+        return self._client
+    
+    def _ensure_thread(self):
+        """הפעלת ה-thread השולח בשימוש הראשון"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="whatsapp-outbound", daemon=True)
+            self._thread.start()
+    
+    def submit(self, chat_id: str, message: str) -> Future:
+        """הכנסת הודעה לתור - Future עם True אם נשלחה"""
+        future = Future()
+        
+        with self._cond:
+            self._ensure_thread()
+            self._stats["submitted"] += 1
+            
+            entry = self._open.get(chat_id)
+            if entry and len(entry["message"]) + len(MERGE_SEPARATOR) + len(message) <= MAX_MERGED_CHARS:
+                entry["message"] += MERGE_SEPARATOR + message
+                entry["futures"].append(future)
+                self._stats["merged"] += 1
+            else:
+                entry = {
+                    "chat_id": chat_id,
+                    "message": message,
+                    "futures": [future],
+                    "submitted_at": time.monotonic()
+                }
+                self._queue.append(entry)
+                self._open[chat_id] = entry
+            
+            self._cond.notify_all()
+        
+        return future
+    
+    async def send(self, chat_id: str, message: str) -> bool:
+        """שליחה מתוך ה-event loop - ממתין עד שההודעה יצאה"""
+        return await asyncio.wrap_future(self.submit(chat_id, message))
+    
+    def send_and_wait(self, chat_id: str, message: str, timeout: float = 60) -> bool:
+        """שליחה מקוד סינכרוני (אימות, דשבורד האדמין)"""
+        try:
+            return self.submit(chat_id, message).result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.error(f"❌ WhatsApp message to {chat_id} still queued after {timeout}s")
+            return False
+    
+    def _run(self):
+        """לולאת ה-thread השולח"""
+        while True:
+            with self._cond:
+                while True:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    
+                    # המתנה לתור בקצב - בינתיים עוד הודעות יכולות להתאחד
+                    delay = self._next_send_at - time.monotonic()
+                    if delay > 0:
+                        self._cond.wait(timeout=delay)
+                        continue
+                    break
+                
+                entry = self._queue.popleft()
+                if self._open.get(entry["chat_id"]) is entry:
+                    del self._open[entry["chat_id"]]
+                self._sending = True
+                self._next_send_at = time.monotonic() + self.min_interval
+            
+            success = False
+            try:
+                success = self._deliver(entry)
+            except Exception as e:
+                logger.error(f"❌ Error sending message: {e}")
+            
+            latency = time.monotonic() - entry["submitted_at"]
+            with self._cond:
+                self._sending = False
+                if success:
+                    self._stats["sent"] += 1
+                    self._stats["latency_seconds_total"] += latency
+                    self._stats["latency_seconds_max"] = max(self._stats["latency_seconds_max"], latency)
+                else:
+                    self._stats["failures"] += 1
+                self._cond.notify_all()
+            
+            # מי שחיכה דרך send() עלול לבטל (כיבוי) - ה-thread ממשיך לשאר התור
+            for future in entry["futures"]:
+                if not future.done():
+                    future.set_result(success)
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """השהיה אקספוננציאלית עם jitter מלא"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, delay)
+    
+    def _retry_after(self, response: httpx.Response) -> Optional[float]:
+        """ערך Retry-After בשניות, אם נשלח"""
+        try:
+            return float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            return None
+    
+    def _deliver(self, entry: Dict) -> bool:
+        """שליחת הודעה אחת עם ניסיונות חוזרים"""
+        payload = {"chatId": entry["chat_id"], "message": entry["message"]}
+        attempt = 0
+        
+        while True:
+            response = None
+            retryable = False
+            try:
+                response = self.client.post("sendMessage", payload, timeout=10)
+                status = response.status_code
+                retryable = status == 429
+            except httpx.HTTPError as e:
+                status = None
+                retryable = isinstance(e, SAFE_RETRY_ERRORS)
+                logger.warning(f"WhatsApp send error: {e}")
+            
+            if status == 200:
+                logger.info(f"✅ Message sent to {entry['chat_id']}")
+                return True
+            
+            if not retryable or attempt >= self.max_retries:
+                logger.error(f"❌ Failed to send message to {entry['chat_id']}: {status}")
+                return False
+            
+            delay = self._backoff_delay(attempt)
+            if status == 429:
+                delay = self._retry_after(response) or max(delay, self.min_interval)
+                with self._cond:
+                    self._stats["rate_limited"] += 1
+                    self._next_send_at = max(self._next_send_at, time.monotonic() + delay)
+            
+            attempt += 1
+            with self._cond:
+                self._stats["retries"] += 1
+            logger.warning(f"Green API returned {status} - retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+            
+            # גם הניסיון החוזר הוא שליחה - ההודעה הבאה ממתינה אחריו לפי הקצב
+            with self._cond:
+                self._next_send_at = max(self._next_send_at, time.monotonic() + self.min_interval)
+    
+    def drain(self, timeout: float = 10) -> bool:
+        """המתנה עד שהתור מתרוקן (כיבוי) - False אם נשארו הודעות"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._sending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining)
+        return True
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """עומס בתור, זמני שליחה ומונים"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["backlog"] = len(self._queue)
+            stats["oldest_queued_seconds"] = (
+                round(time.monotonic() - self._queue[0]["submitted_at"], 2) if self._queue else 0.0
+            )
+        
+        sent = stats["sent"]
+        stats["latency_seconds_avg"] = round(stats["latency_seconds_total"] / sent, 3) if sent else 0.0
+        stats["latency_seconds_total"] = round(stats["latency_seconds_total"], 3)
+        stats["latency_seconds_max"] = round(stats["latency_seconds_max"], 3)
+        stats["rate_per_second"] = self.rate_per_second
+        return stats
+
+
+# ===== מופע גלובלי =====
+_outbound_scheduler = None
+_outbound_lock = threading.Lock()
+
+def get_outbound_scheduler() -> OutboundScheduler:
+    """קבלת מופע יחיד של תור ההודעות היוצאות"""
+    global _outbound_scheduler
+    with _outbound_lock:
+        if _outbound_scheduler is None:
+            _outbound_scheduler = OutboundScheduler()
+    return _outbound_scheduler
\ No newline at end of file
@@ -0,0 +1,74 @@
+import hashlib
+import logging
+from io import BytesIO
+from typing import Dict, Iterable, Optional
+
+from PIL import Image
+
+from config import RECEIPT_PHASH_MAX_DISTANCE
+
+logger = logging.getLogger(__name__)
+
+# dHash של 8x8 = 64 ביט
+HASH_SIZE = 8
+
+# קידומת ל-dHash - בלי זה get_all_records ממיר hex שכולו ספרות למספר
+PHASH_PREFIX = "dh:"
+
+def content_hash(image_data: bytes) -> str:
+    """SHA-256 של קובץ התמונה - זיהוי של אותו קובץ בדיוק"""
+    return hashlib.sha256(image_data).hexdigest()
+
+def perceptual_hash(image_data: bytes) -> str:
+    """dHash של התמונה - זהה (או קרוב מאוד) גם להעתק שנדחס מחדש או שינה גודל
+    
+    מחזיר מחרוזת ריקה אם התמונה לא נפתחת.
+    """
+    try:
+        with Image.open(BytesIO(image_data)) as image:
+            # ב-JPEG הפענוח נעשה ישר בגודל מוקטן - לא צריך את כל הפיקסלים
+            image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+            small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+            pixels = list(small.getdata())
+    except Exception as e:
+        logger.warning(f"Failed to compute perceptual hash: {e}")
+        return ""
+    
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | int(left > right)
+    
+    return f"{PHASH_PREFIX}{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+def hamming_distance(first: str, second: str) -> Optional[int]:
+    """מספר הביטים השונים בין שני dHash (None אם אחד מהם לא תקין)"""
+    try:
+        first_bits = int(str(first).replace(PHASH_PREFIX, '', 1), 16)
+        second_bits = int(str(second).replace(PHASH_PREFIX, '', 1), 16)
+    except ValueError:
+        return None
+    return bin(first_bits ^ second_bits).count('1')
+
+def find_duplicate(expenses: Iterable[Dict], image_sha256: str, image_phash: str,
+                   max_distance: int = RECEIPT_PHASH_MAX_DISTANCE) -> Optional[Dict]:
+    """ההוצאה עם אותה תמונה - התאמה מדויקת של SHA-256, אחרת ה-dHash הקרוב ביותר בטווח"""
+    best = None
+    best_distance = max_distance + 1
+    
+    for expense in expenses:
+        if image_sha256 and str(expense.get('image_sha256', '')) == image_sha256:
+            return expense
+        
+        other = str(expense.get('image_phash', '') or '')
+        if not image_phash or not other.startswith(PHASH_PREFIX):
+            continue
+        
+        distance = hamming_distance(image_phash, other)
+        if distance is not None and distance < best_distance:
+            best = expense
+            best_distance = distance
+    
+    return best
\ No newline at end of file
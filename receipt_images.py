@@ -0,0 +1,182 @@
+import logging
+import math
+import mimetypes
+import threading
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import ExifTags, Image, ImageOps, features
+
+from config import (
+    RECEIPT_VISION_SHORT_SIDE,
+    RECEIPT_VISION_LONG_SIDE,
+    RECEIPT_VISION_QUALITY,
+    RECEIPT_ARCHIVE_MAX_SIDE,
+    RECEIPT_ARCHIVE_FORMAT,
+    RECEIPT_ARCHIVE_QUALITY
+)
+
+logger = logging.getLogger(__name__)
+
+# תמחור תמונה ב-detail high: בסיס + טוקנים לכל אריח של 512x512
+VISION_BASE_TOKENS = 85
+VISION_TILE_TOKENS = 170
+VISION_TILE_SIZE = 512
+
+# פורמט הארכיון -> (פורמט Pillow, mimetype, סיומת)
+ARCHIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+_stats_lock = threading.Lock()
+_stats = {
+    "images": 0,
+    "failures": 0,
+    "original_bytes": 0,
+    "vision_bytes": 0,
+    "archive_bytes": 0,
+    "original_tokens": 0,
+    "vision_tokens": 0,
+}
+
+def _fit(size: Tuple[int, int], long_side: int, short_side: int) -> Tuple[int, int]:
+    """גודל מוקטן (לא מוגדל) כך שהצלע הארוכה והקצרה לא יעברו את הגבולות"""
+    width, height = size
+    scale = min(1.0,
+                long_side / max(width, height),
+                short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def vision_tokens(size: Tuple[int, int]) -> int:
+    """הערכת טוקני הראייה של תמונה - המודל מקטין ל-2048 ואז לצלע קצרה של 768"""
+    width, height = _fit(size, 2048, 768)
+    tiles = math.ceil(width / VISION_TILE_SIZE) * math.ceil(height / VISION_TILE_SIZE)
+    return VISION_BASE_TOKENS + VISION_TILE_TOKENS * tiles
+
+def _encode(image: Image.Image, image_format: str, quality: int) -> bytes:
+    """שמירת תמונה לזיכרון"""
+    output = BytesIO()
+    image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue()
+
+def _archive_format() -> Tuple[str, str, str]:
+    """פורמט הארכיון מההגדרות - jpeg אם Pillow נבנה בלי webp"""
+    if RECEIPT_ARCHIVE_FORMAT == "webp" and not features.check("webp"):
+        return ARCHIVE_FORMATS["jpeg"]
+    return ARCHIVE_FORMATS.get(RECEIPT_ARCHIVE_FORMAT, ARCHIVE_FORMATS["jpeg"])
+
+def _unprocessed(image_data: bytes, image_format: Optional[str] = None) -> Dict[str, Any]:
+    """התמונה כמו שהיא - כשלא ניתן לעבד אותה
+    
+    ה-mimetype לפי הפורמט ש-Pillow זיהה, ואם לא זוהה - application/octet-stream.
+    """
+    mimetype = Image.MIME.get(image_format) or "application/octet-stream"
+    extension = (mimetypes.guess_extension(mimetype) or ".bin").lstrip(".")
+    return {
+        "vision": image_data,
+        "vision_mimetype": mimetype,
+        "archive": image_data,
+        "archive_mimetype": mimetype,
+        "archive_extension": extension,
+        "original_bytes": len(image_data),
+        "processed": False,
+    }
+
+def _failed(reason: Exception, image_data: bytes, image_format: Optional[str] = None) -> Dict[str, Any]:
+    """רישום כשל עיבוד והחזרת התמונה כמו שהיא"""
+    logger.warning(f"Failed to process receipt image, using it as is: {reason}")
+    with _stats_lock:
+        _stats["failures"] += 1
+    return _unprocessed(image_data, image_format)
+
+def prepare_receipt_image(image_data: bytes) -> Dict[str, Any]:
+    """עיבוד תמונת קבלה לפני הניתוח וההעלאה
+    
+    מחזיר dict עם:
+    vision - JPEG בגווני אפור עם ניגודיות אוטומטית, בגודל שהמודל משתמש בו בפועל
+    archive - עותק צבעוני מוקטן לדרייב (webp/jpeg) + archive_mimetype / archive_extension
+    וגדלים לפני ואחרי. אם התמונה לא נפתחת מוחזרים הבתים המקוריים.
+    """
+    source_format = None
+    try:
+        with Image.open(BytesIO(image_data)) as opened:
+            source_format = opened.format
+            # תמונות מהטלפון שמורות לעיתים מסובבות עם תג EXIF - הסיבוב קודם לכל
+            # עיבוד, כך שגם עותק הגיבוי (אם העיבוד נכשל) נשמר ישר
+            rotated = opened.getexif().get(ExifTags.Base.Orientation, 1) != 1
+            image = ImageOps.exif_transpose(opened).convert('RGB')
+    except Exception as e:
+        return _failed(e, image_data, source_format)
+    
+    source_mimetype = Image.MIME.get(source_format)
+    original_size = image.size
+    
+    try:
+        vision = ImageOps.autocontrast(image.convert('L'), cutoff=1)
+        vision_size = _fit(original_size, RECEIPT_VISION_LONG_SIDE, RECEIPT_VISION_SHORT_SIDE)
+        if vision_size != original_size:
+            vision = vision.resize(vision_size, Image.LANCZOS)
+        vision_data = _encode(vision, "JPEG", RECEIPT_VISION_QUALITY)
+        
+        image_format, mimetype, extension = _archive_format()
+        archive = image
+        archive_size = _fit(original_size, RECEIPT_ARCHIVE_MAX_SIDE, RECEIPT_ARCHIVE_MAX_SIDE)
+        if archive_size != original_size:
+            archive = image.resize(archive_size, Image.LANCZOS)
+        archive_data = _encode(archive, image_format, RECEIPT_ARCHIVE_QUALITY)
+    except Exception as e:
+        if not rotated:
+            return _failed(e, image_data, source_format)
+        try:
+            return _failed(e, _encode(image, "JPEG", RECEIPT_ARCHIVE_QUALITY), "JPEG")
+        except Exception:
+            return _failed(e, image_data, source_format)
+    
+    # אם הקובץ המקורי כבר קטן יותר - אין טעם להחליף אותו (אלא אם הוא שמור מסובב)
+    if len(archive_data) >= len(image_data) and mimetype == source_mimetype and not rotated:
+        archive_data = image_data
+    
+    result = {
+        "vision": vision_data,
+        "vision_mimetype": "image/jpeg",
+        "archive": archive_data,
+        "archive_mimetype": mimetype,
+        "archive_extension": extension,
+        "original_bytes": len(image_data),
+        "vision_bytes": len(vision_data),
+        "archive_bytes": len(archive_data),
+        "original_tokens": vision_tokens(original_size),
+        "vision_tokens": vision_tokens(vision_size),
+        "processed": True,
+    }
+    
+    with _stats_lock:
+        _stats["images"] += 1
+        for key in ("original_bytes", "vision_bytes", "archive_bytes", "original_tokens", "vision_tokens"):
+            _stats[key] += result[key]
+    
+    logger.info(
+        f"🖼️ Receipt image {original_size[0]}x{original_size[1]} {len(image_data) // 1024}KB -> "
+        f"AI {vision_size[0]}x{vision_size[1]} {len(vision_data) // 1024}KB, "
+        f"archive {extension} {len(archive_data) // 1024}KB "
+        f"(-{_saved_percent(len(image_data), len(vision_data))}% / "
+        f"-{_saved_percent(len(image_data), len(archive_data))}%)"
+    )
+    return result
+
+def _saved_percent(before: int, after: int) -> float:
+    """אחוז החיסכון בגודל"""
+    if not before:
+        return 0.0
+    return round((1 - after / before) * 100, 1)
+
+def get_image_pipeline_stats() -> Dict[str, Any]:
+    """סיכום החיסכון מאז עליית המערכת"""
+    with _stats_lock:
+        stats = dict(_stats)
+    
+    stats["vision_saved_percent"] = _saved_percent(stats["original_bytes"], stats["vision_bytes"])
+    stats["archive_saved_percent"] = _saved_percent(stats["original_bytes"], stats["archive_bytes"])
+    stats["tokens_saved"] = stats["original_tokens"] - stats["vision_tokens"]
+    return stats
\ No newline at end of file
@@ -0,0 +1,235 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+from config import (
+    SHEETS_READ_QUOTA_PER_MINUTE,
+    SHEETS_WRITE_QUOTA_PER_MINUTE,
+    DRIVE_QUOTA_PER_MINUTE,
+    GOOGLE_MAX_RETRIES,
+    GOOGLE_BACKOFF_BASE_SECONDS,
+    GOOGLE_BACKOFF_MAX_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# ===== עדיפויות (מספר נמוך = עדיפות גבוהה) =====
+PRIORITY_HIGH = 0     # כתיבות מה-webhook
+PRIORITY_NORMAL = 1   # קריאות רגילות של הבוט והדשבורד
+PRIORITY_LOW = 2      # סטטיסטיקות ודוחות אדמין
+
+PRIORITY_NAMES = {
+    PRIORITY_HIGH: "high",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_LOW: "low"
+}
+
+# קודי HTTP שכדאי לנסות שוב - מכסה (429) ותקלות זמניות בצד של גוגל
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# קודים שבטוח לנסות שוב גם בפעולה לא אידמפוטנטית (append, יצירת קובץ) - הבקשה
+# נדחתה לפני שבוצעה. אחרי 5xx ייתכן שהיא כן בוצעה, וניסיון חוזר ייצור כפילות
+QUOTA_STATUS_CODES = {429}
+
+# עדיפות שנקבעה בהקשר הנוכחי (thread / משימת asyncio) - ראו request_priority
+_current_priority: ContextVar[Optional[int]] = ContextVar("google_request_priority", default=None)
+
+@contextmanager
+def request_priority(priority: int):
+    """קביעת עדיפות לכל הקריאות לגוגל בתוך הבלוק
+    
+    לדוגמה: דשבורד האדמין רץ עם PRIORITY_LOW כדי שה-webhook יקבל קדימות.
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """חילוץ קוד HTTP משגיאות gspread (APIError) ו-googleapiclient (HttpError)"""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        resp = getattr(error, 'resp', None)
+        status = getattr(resp, 'status', None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """דלי אסימונים לפי מכסה לדקה"""
+    
+    def __init__(self, per_minute: int):
+        self.capacity = max(1, per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def try_take(self) -> bool:
+        """לקיחת אסימון אם יש"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    
+    def seconds_until_token(self) -> float:
+        """כמה זמן עד שיתפנה אסימון"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+class RequestScheduler:
+    """מתזמן מרכזי לכל הקריאות ל-Sheets ו-Drive
+    
+    - דלי אסימונים לדקה לכל סוג קריאה (read / write / drive) לפי המכסות של גוגל
+    - תורי עדיפות: כשאין אסימונים, הממתין עם העדיפות הגבוהה ביותר מקבל ראשון
+    - ניסיון חוזר עם backoff אקספוננציאלי ו-jitter על 429 / 5xx
+    """
+    
+    def __init__(self, read_per_minute: int = SHEETS_READ_QUOTA_PER_MINUTE,
+                 write_per_minute: int = SHEETS_WRITE_QUOTA_PER_MINUTE,
+                 drive_per_minute: int = DRIVE_QUOTA_PER_MINUTE,
+                 max_retries: int = GOOGLE_MAX_RETRIES,
+                 backoff_base: float = GOOGLE_BACKOFF_BASE_SECONDS,
+                 backoff_max: float = GOOGLE_BACKOFF_MAX_SECONDS):
+        self.buckets = {
+            "read": TokenBucket(read_per_minute),
+            "write": TokenBucket(write_per_minute),
+            "drive": TokenBucket(drive_per_minute)
+        }
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        
+        self._cond = threading.Condition()
+        self._sequence = itertools.count()
+        self._waiters: Dict[str, list] = {kind: [] for kind in self.buckets}
+        
+        self._stats = {
+            "requests": 0,
+            "throttled": 0,
+            "retries": 0,
+            "failures": 0,
+            "wait_seconds": 0.0
+        }
+        self._by_kind = {kind: 0 for kind in self.buckets}
+    
+    def _acquire(self, kind: str, priority: int):
+        """המתנה לאסימון לפי סדר עדיפות"""
+        bucket = self.buckets[kind]
+        ticket = (priority, next(self._sequence))
+        started = time.monotonic()
+        waited = False
+        
+        with self._cond:
+            heapq.heappush(self._waiters[kind], ticket)
+            try:
+                while True:
+                    if self._waiters[kind][0] == ticket and bucket.try_take():
+                        heapq.heappop(self._waiters[kind])
+                        break
+                    
+                    waited = True
+                    if self._waiters[kind][0] == ticket:
+                        self._cond.wait(timeout=max(bucket.seconds_until_token(), 0.01))
+                    else:
+                        self._cond.wait(timeout=1.0)
+            except BaseException:
+                self._waiters[kind].remove(ticket)
+                heapq.heapify(self._waiters[kind])
+                raise
+            finally:
+                # הממתין הבא בתור צריך לבדוק מחדש אם הוא בראש התור
+                self._cond.notify_all()
+            
+            self._stats["requests"] += 1
+            self._by_kind[kind] += 1
+            if waited:
+                self._stats["throttled"] += 1
+                self._stats["wait_seconds"] += time.monotonic() - started
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """השהיה אקספוננציאלית עם jitter מלא"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, delay)
+    
+    def execute(self, func: Callable[[], Any], kind: str = "read",
+                priority: Optional[int] = None, idempotent: Optional[bool] = None) -> Any:
+        """הרצת קריאה לגוגל דרך המתזמן
+        
+        priority: אם לא נקבעה - העדיפות מההקשר (request_priority), אחרת
+        כתיבות ב-PRIORITY_HIGH וקריאות ב-PRIORITY_NORMAL.
+        idempotent: אם לא נקבע - רק קריאות. פעולה לא אידמפוטנטית נשלחת שוב רק
+        אחרי 429 (QUOTA_STATUS_CODES).
+        """
+        if priority is None:
+            priority = _current_priority.get()
+        if priority is None:
+            priority = PRIORITY_HIGH if kind == "write" else PRIORITY_NORMAL
+        if idempotent is None:
+            idempotent = kind == "read"
+        retryable = RETRYABLE_STATUS_CODES if idempotent else QUOTA_STATUS_CODES
+        
+        attempt = 0
+        while True:
+            self._acquire(kind, priority)
+            try:
+                return func()
+            except Exception as e:
+                status = get_status_code(e)
+                if status not in retryable or attempt >= self.max_retries:
+                    with self._cond:
+                        self._stats["failures"] += 1
+                    raise
+                
+                delay = self._backoff_delay(attempt)
+                attempt += 1
+                with self._cond:
+                    self._stats["retries"] += 1
+                logger.warning(f"Google API returned {status} - retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """מצב התורים ומוני ההאטה"""
+        with self._cond:
+            queue_depth = {kind: len(waiters) for kind, waiters in self._waiters.items()}
+            lanes = {name: 0 for name in PRIORITY_NAMES.values()}
+            for waiters in self._waiters.values():
+                for priority, _ in waiters:
+                    lanes[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            
+            stats = dict(self._stats)
+            stats["wait_seconds"] = round(stats["wait_seconds"], 2)
+            stats["by_kind"] = dict(self._by_kind)
+            stats["queue_depth"] = queue_depth
+            stats["queue_depth_by_priority"] = lanes
+            stats["tokens_available"] = {
+                kind: int(bucket.tokens) for kind, bucket in self.buckets.items()
+            }
+            return stats
+
+
+# ===== מופע גלובלי =====
+_request_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_request_scheduler() -> RequestScheduler:
+    """קבלת מופע יחיד של המתזמן - משותף לכל הקריאות לגוגל בתהליך"""
+    global _request_scheduler
+    with _scheduler_lock:
+        if _request_scheduler is None:
+            _request_scheduler = RequestScheduler()
+    return _request_scheduler
\ No newline at end of file
@@ -247,9 +247,27 @@ class SystemRunner:
         self.stop()
         sys.exit(0)
 
+def run_compaction() -> bool:
+    """ארכוב הוצאות שנמחקו וזוגות שסיימו מהגיליונות החמים"""
+    try:
+        from google_services import get_google_services
+        
+        logger.info("🗄️ Compacting storage...")
+        result = get_google_services().compact()
+        print(f"🗄️ הועברו לארכיון: {result['couples_archived']} זוגות, {result['expenses_archived']} הוצאות")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Compaction failed: {e}")
+        return False
+
 def main():
     """פונקציה ראשית"""
     
+    # ארכוב בלבד, בלי להריץ את השירותים - להרצה מתוזמנת בשעה שקטה
+    if '--compact' in sys.argv:
+        sys.exit(0 if run_compaction() else 1)
+    
     # הצגת כותרת
     print("""
     ╔══════════════════════════════════════════════════════════╗
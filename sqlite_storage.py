@@ -0,0 +1,598 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Optional, Any
+
+from config import (
+    COUPLES_HEADERS,
+    EXPENSES_HEADERS,
+    SQLITE_DB_PATH,
+    LOCAL_FILES_DIR
+)
+from storage_backend import StorageBackend, FOLDER_COLUMNS
+from expense_aggregates import empty_summary, build_summary, apply_expense_change
+
+logger = logging.getLogger(__name__)
+
+# עמודות מספריות - affinity של NUMERIC ממירה מחרוזות מספריות למספרים,
+# בדיוק כמו get_all_records ב-Sheets, ומשאירה ערכים ריקים כמחרוזת
+NUMERIC_COLUMNS = {'amount', 'budget', 'confidence'}
+
+# מספר group_ids מקסימלי בשאילתת IN אחת
+SQLITE_MAX_PARAMS = 500
+
+class SQLiteStorageManager(StorageBackend):
+    """אחסון מקומי - SQLite לנתונים ומערכת קבצים לקבצים
+    
+    מממש את אותו ממשק של GoogleServicesManager עם שאילתות מאונדקסות,
+    ומשמש גם כתחליף offline לבדיקות עומס.
+    """
+    
+    def __init__(self, db_path: str = SQLITE_DB_PATH, files_dir: str = LOCAL_FILES_DIR):
+        self.db_path = db_path
+        self.files_dir = Path(files_dir)
+        self._lock = threading.RLock()
+        
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        
+        self._ensure_schema()
+        
+        logger.info(f"✅ SQLite storage initialized: {db_path}")
+    
+    def _ensure_schema(self):
+        """יצירת הטבלאות והאינדקסים + הוספת עמודות חדשות לטבלאות קיימות"""
+        with self._lock, self.conn:
+            self._ensure_table('couples', COUPLES_HEADERS, 'group_id')
+            self._ensure_table('expenses', EXPENSES_HEADERS, 'expense_id')
+            self._ensure_table('couples_archive', COUPLES_HEADERS, 'group_id')
+            self._ensure_table('expenses_archive', EXPENSES_HEADERS, 'expense_id')
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_expenses_group ON expenses (group_id, status)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_couples_status ON couples (status)"
+            )
+            
+            # סיכומי הוצאות לכל זוג - מתעדכנים באותה טרנזקציה של כל כתיבה להוצאות
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS expense_summaries ("
+                "group_id TEXT PRIMARY KEY, total_amount REAL, expense_count INTEGER, "
+                "last_created_at TEXT, data TEXT, updated_at TEXT)"
+            )
+            
+            has_summaries = self.conn.execute("SELECT 1 FROM expense_summaries LIMIT 1").fetchone()
+            has_expenses = self.conn.execute("SELECT 1 FROM expenses LIMIT 1").fetchone()
+            if has_expenses and not has_summaries:
+                self._rebuild_summaries()
+    
+    def _ensure_table(self, table: str, headers: List[str], primary_key: str):
+        """יצירת טבלה לפי רשימת כותרות"""
+        columns = ", ".join(
+            f"{header} {'NUMERIC' if header in NUMERIC_COLUMNS else 'TEXT'}"
+            + (" PRIMARY KEY" if header == primary_key else "")
+            for header in headers
+        )
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        
+        existing = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+        for header in headers:
+            if header not in existing:
+                column_type = 'NUMERIC' if header in NUMERIC_COLUMNS else 'TEXT'
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {header} {column_type} DEFAULT ''")
+    
+    def _to_record(self, row: sqlite3.Row, headers: List[str]) -> Dict:
+        """המרת שורת SQLite לרשומה באותו פורמט של Sheets"""
+        return {header: ('' if row[header] is None else row[header]) for header in headers}
+    
+    def _insert(self, table: str, headers: List[str], data: Dict):
+        """הוספת שורה - כל הערכים נשמרים כמחרוזות כמו בכתיבה ל-Sheets"""
+        values = []
+        for header in headers:
+            value = data.get(header, '')
+            values.append(str(value) if value is not None else '')
+        
+        placeholders = ", ".join("?" for _ in headers)
+        self.conn.execute(
+            f"INSERT INTO {table} ({', '.join(headers)}) VALUES ({placeholders})",
+            values
+        )
+    
+    def _update(self, table: str, headers: List[str], key_field: str,
+                key: str, fields: Dict[str, Any]) -> bool:
+        """עדכון שדות של שורה קיימת"""
+        fields = {field: value for field, value in fields.items() if field in headers}
+        if not fields:
+            return False
+        
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        cursor = self.conn.execute(
+            f"UPDATE {table} SET {assignments} WHERE {key_field} = ?",
+            [str(value) for value in fields.values()] + [key]
+        )
+        return cursor.rowcount > 0
+    
+    # ===== סיכומי הוצאות =====
+    
+    def _get_expense(self, expense_id: str) -> Optional[Dict]:
+        """הוצאה לפי מזהה"""
+        row = self.conn.execute(
+            "SELECT * FROM expenses WHERE expense_id = ?", (expense_id,)
+        ).fetchone()
+        return self._to_record(row, EXPENSES_HEADERS) if row else None
+    
+    def _active_group_expenses(self, group_id: str) -> List[Dict]:
+        """ההוצאות הפעילות של זוג (לחישוב סיכום מלא)"""
+        rows = self.conn.execute(
+            "SELECT * FROM expenses WHERE group_id = ? AND status = 'active'", (group_id,)
+        ).fetchall()
+        return [self._to_record(row, EXPENSES_HEADERS) for row in rows]
+    
+    def _load_summary(self, group_id: str) -> Optional[Dict]:
+        """סיכום שמור של זוג"""
+        row = self.conn.execute(
+            "SELECT data FROM expense_summaries WHERE group_id = ?", (group_id,)
+        ).fetchone()
+        return json.loads(row["data"]) if row else None
+    
+    def _store_summary(self, summary: Dict):
+        """שמירת סיכום של זוג"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO expense_summaries "
+            "(group_id, total_amount, expense_count, last_created_at, data, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                summary["group_id"],
+                summary["total_amount"],
+                summary["count"],
+                summary["last_created_at"],
+                json.dumps(summary, ensure_ascii=False),
+                self._get_timestamp()
+            )
+        )
+    
+    def _apply_summary_change(self, old: Optional[Dict], new: Optional[Dict]):
+        """עדכון הסיכומים אחרי שינוי בהוצאה (נקרא בתוך הטרנזקציה של הכתיבה)"""
+        summaries = {}
+        for record in (old, new):
+            group_id = str(record.get('group_id', '')) if record else ''
+            if not group_id or group_id in summaries:
+                continue
+            
+            summary = self._load_summary(group_id)
+            if summary is None:
+                # אין עדיין סיכום לזוג - חישוב מלא מהמצב הנוכחי, שכבר כולל את השינוי
+                self._store_summary(build_summary(group_id, self._active_group_expenses(group_id)))
+            else:
+                summaries[group_id] = summary
+        
+        apply_expense_change(summaries, old, new, self._active_group_expenses)
+        
+        for summary in summaries.values():
+            self._store_summary(summary)
+    
+    def _rebuild_summaries(self):
+        """חישוב מחדש של כל הסיכומים מטבלת ההוצאות"""
+        grouped: Dict[str, List[Dict]] = {}
+        for row in self.conn.execute("SELECT * FROM expenses WHERE status = 'active'"):
+            record = self._to_record(row, EXPENSES_HEADERS)
+            if record['group_id']:
+                grouped.setdefault(str(record['group_id']), []).append(record)
+        
+        self.conn.execute("DELETE FROM expense_summaries")
+        for group_id, expenses in grouped.items():
+            self._store_summary(build_summary(group_id, expenses))
+        
+        logger.info(f"Rebuilt expense summaries for {len(grouped)} couples")
+    
+    def get_expense_summaries(self, group_ids: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """סיכומי הוצאות לכל זוג - {group_id: summary} - קריאה מהטבלה בלי סריקת הוצאות"""
+        try:
+            with self._lock:
+                if group_ids is None:
+                    rows = self.conn.execute("SELECT data FROM expense_summaries").fetchall()
+                else:
+                    rows = []
+                    for start in range(0, len(group_ids), SQLITE_MAX_PARAMS):
+                        chunk = list(group_ids[start:start + SQLITE_MAX_PARAMS])
+                        placeholders = ", ".join("?" for _ in chunk)
+                        rows.extend(self.conn.execute(
+                            f"SELECT data FROM expense_summaries WHERE group_id IN ({placeholders})",
+                            chunk
+                        ).fetchall())
+            
+            summaries = {group_id: empty_summary(group_id) for group_id in (group_ids or [])}
+            for row in rows:
+                summary = json.loads(row["data"])
+                summaries[summary["group_id"]] = summary
+            return summaries
+        
+        except Exception as e:
+            logger.error(f"Failed to get expense summaries: {e}")
+            return {}
+    
+    # ===== ניהול זוגות =====
+    
+    def create_couple(self, phone1: str, phone2: str, group_id: str,
+                     couple_name: str = "", wedding_date: str = "",
+                     budget: float = 0) -> Dict:
+        """יצירת זוג חדש במערכת"""
+        try:
+            if self.get_couple_by_group_id(group_id):
+                return {"success": False, "error": "Group already exists"}
+            
+            folders = self._create_couple_folder(group_id)
+            
+            couple_data = {
+                "group_id": group_id,
+                "phone1": phone1,
+                "phone2": phone2,
+                "couple_name": couple_name or f"זוג {group_id[:8]}",
+                "wedding_date": wedding_date,
+                "budget": str(budget) if budget > 0 else "",
+                "created_at": self._get_timestamp(),
+                "status": "active",
+                "contacts_progress": "",
+                "last_activity": self._get_timestamp()
+            }
+            for folder, column in FOLDER_COLUMNS.items():
+                couple_data[column] = folders.get(folder, "")
+            
+            with self._lock, self.conn:
+                self._insert('couples', COUPLES_HEADERS, couple_data)
+            
+            logger.info(f"Created couple: {group_id}")
+            
+            return {
+                "success": True,
+                "group_id": group_id,
+                "couple_name": couple_data["couple_name"]
+            }
+        
+        except Exception as e:
+            logger.error(f"Failed to create couple: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def get_couple_by_group_id(self, group_id: str) -> Optional[Dict]:
+        """קבלת נתוני זוג לפי group_id"""
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    "SELECT * FROM couples WHERE group_id = ?", (group_id,)
+                ).fetchone()
+            return self._to_record(row, COUPLES_HEADERS) if row else None
+        
+        except Exception as e:
+            logger.error(f"Failed to find couple: {e}")
+            return None
+    
+    def get_all_active_couples(self) -> List[Dict]:
+        """קבלת כל הזוגות הפעילים"""
+        try:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT * FROM couples WHERE status = 'active' ORDER BY rowid"
+                ).fetchall()
+            return [self._to_record(row, COUPLES_HEADERS) for row in rows]
+        
+        except Exception as e:
+            logger.error(f"Failed to get active couples: {e}")
+            return []
+    
+    def update_couple_fields(self, group_id: str, fields: Dict[str, Any]) -> bool:
+        """עדכון כמה שדות של זוג בבת אחת (כולל last_activity)"""
+        try:
+            if not fields or any(field not in COUPLES_HEADERS for field in fields):
+                return False
+            
+            updates = dict(fields)
+            updates['last_activity'] = self._get_timestamp()
+            
+            with self._lock, self.conn:
+                updated = self._update('couples', COUPLES_HEADERS, 'group_id', group_id, updates)
+            
+            if updated:
+                logger.info(f"Updated couple {group_id}: {fields}")
+            return updated
+        
+        except Exception as e:
+            logger.error(f"Failed to update couple field: {e}")
+            return False
+    
+    # ===== ניהול הוצאות =====
+    
+    def save_expense(self, expense_data: Dict) -> bool:
+        """שמירת הוצאה חדשה"""
+        try:
+            if not expense_data.get('expense_id'):
+                expense_data['expense_id'] = self._generate_id('EXP_')
+            
+            current_time = self._get_timestamp()
+            expense_data.setdefault('created_at', current_time)
+            expense_data.setdefault('updated_at', current_time)
+            expense_data.setdefault('status', 'active')
+            expense_data.setdefault('needs_review', False)
+            expense_data.setdefault('confidence', 85)
+            
+            with self._lock, self.conn:
+                self._insert('expenses', EXPENSES_HEADERS, expense_data)
+                self._apply_summary_change(None, self._get_expense(expense_data['expense_id']))
+                
+                group_id = expense_data.get('group_id')
+                if group_id:
+                    self._update('couples', COUPLES_HEADERS, 'group_id', group_id,
+                                 {'last_activity': current_time})
+            
+            logger.info(f"Saved expense: {expense_data.get('expense_id')}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Failed to save expense: {e}")
+            return False
+    
+    def get_expenses_by_group(self, group_id: str,
+                             include_deleted: bool = False) -> List[Dict]:
+        """קבלת כל ההוצאות של קבוצה"""
+        try:
+            query = "SELECT * FROM expenses WHERE group_id = ?"
+            if not include_deleted:
+                query += " AND status != 'deleted'"
+            query += " ORDER BY created_at DESC"
+            
+            with self._lock:
+                rows = self.conn.execute(query, (group_id,)).fetchall()
+            return [self._to_record(row, EXPENSES_HEADERS) for row in rows]
+        
+        except Exception as e:
+            logger.error(f"Failed to get expenses for group {group_id}: {e}")
+            return []
+    
+    def get_expenses_grouped(self, group_ids: Optional[List[str]] = None,
+                             include_deleted: bool = False) -> Dict[str, List[Dict]]:
+        """הוצאות של כמה קבוצות בשאילתה אחת לכל מנה - {group_id: [expenses]}"""
+        try:
+            with self._lock:
+                if group_ids is None:
+                    query = "SELECT * FROM expenses"
+                    if not include_deleted:
+                        query += " WHERE status != 'deleted'"
+                    rows = self.conn.execute(query + " ORDER BY created_at DESC").fetchall()
+                else:
+                    rows = []
+                    # SQLite מגביל את מספר הפרמטרים בשאילתה - שאילתה לכל מנה
+                    for start in range(0, len(group_ids), SQLITE_MAX_PARAMS):
+                        chunk = list(group_ids[start:start + SQLITE_MAX_PARAMS])
+                        placeholders = ", ".join("?" for _ in chunk)
+                        query = f"SELECT * FROM expenses WHERE group_id IN ({placeholders})"
+                        if not include_deleted:
+                            query += " AND status != 'deleted'"
+                        rows.extend(self.conn.execute(query + " ORDER BY created_at DESC", chunk).fetchall())
+            
+            grouped: Dict[str, List[Dict]] = {group_id: [] for group_id in (group_ids or [])}
+            for row in rows:
+                record = self._to_record(row, EXPENSES_HEADERS)
+                grouped.setdefault(record['group_id'], []).append(record)
+            return grouped
+        
+        except Exception as e:
+            logger.error(f"Failed to get grouped expenses: {e}")
+            return {}
+    
+    def update_expense_fields(self, expense_id: str, fields: Dict[str, Any]) -> bool:
+        """עדכון כמה שדות של הוצאה בבת אחת (כולל updated_at)"""
+        try:
+            updates = dict(fields)
+            updates['updated_at'] = self._get_timestamp()
+            
+            with self._lock, self.conn:
+                old_record = self._get_expense(expense_id)
+                updated = self._update('expenses', EXPENSES_HEADERS, 'expense_id', expense_id, updates)
+                if updated:
+                    self._apply_summary_change(old_record, self._get_expense(expense_id))
+            
+            if updated:
+                logger.info(f"Updated expense: {expense_id}")
+            return updated
+        
+        except Exception as e:
+            logger.error(f"Failed to update expense: {e}")
+            return False
+    
+    # ===== ניהול קבצים =====
+    
+    def _couple_dir(self, group_id: str) -> Path:
+        """תיקיית הזוג במערכת הקבצים"""
+        safe_name = re.sub(r'[^\w@.-]', '_', group_id)
+        return self.files_dir / f"couple_{safe_name}"
+    
+    def _create_couple_folder(self, group_id: str) -> Dict[str, str]:
+        """יצירת תיקיית זוג ותתי-תיקיות"""
+        try:
+            couple_dir = self._couple_dir(group_id)
+            folders = {'couple': str(couple_dir)}
+            
+            for subfolder in ('receipts', 'contacts', 'merged_files'):
+                path = couple_dir / subfolder
+                path.mkdir(parents=True, exist_ok=True)
+                folders[subfolder] = str(path)
+            
+            return folders
+        
+        except Exception as e:
+            logger.error(f"Failed to create couple folder: {e}")
+            return {}
+    
+    def _write_file(self, group_id: str, subfolder: str, filename: str, data: bytes) -> str:
+        """כתיבת קובץ לתת-תיקייה של זוג - מחזיר קישור file://"""
+        folder = self._couple_dir(group_id) / subfolder
+        folder.mkdir(parents=True, exist_ok=True)
+        
+        path = folder / os.path.basename(filename)
+        path.write_bytes(data)
+        return path.resolve().as_uri()
+    
+    def upload_receipt_image(self, group_id: str, image_data: bytes,
+                           filename: str = None, mimetype: str = 'image/jpeg') -> str:
+        """שמירת תמונת קבלה"""
+        try:
+            if not filename:
+                filename = f"receipt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+            
+            file_url = self._write_file(group_id, 'receipts', filename, image_data)
+            
+            logger.info(f"Saved receipt image: {filename}")
+            return file_url
+        
+        except Exception as e:
+            logger.error(f"Failed to save receipt image: {e}")
+            return ""
+    
+    def save_contacts_files(self, group_id: str, contacts_data: bytes,
+                           guests_data: bytes, progress: Dict) -> bool:
+        """שמירת קבצי אנשי קשר ומוזמנים + התקדמות"""
+        try:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            
+            self._write_file(group_id, 'contacts', f'contacts_{timestamp}.xlsx', contacts_data)
+            self._write_file(group_id, 'contacts', f'guests_{timestamp}.xlsx', guests_data)
+            
+            self.update_couple_field(group_id, 'contacts_progress', json.dumps(progress))
+            
+            logger.info(f"Saved contacts files for group: {group_id}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Failed to save contacts files: {e}")
+            return False
+    
+    def save_merged_file(self, group_id: str, merged_data: bytes,
+                        filename: str = None) -> str:
+        """שמירת קובץ מוזמנים מחובר סופי"""
+        try:
+            if not filename:
+                filename = f"merged_guests_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+            
+            file_url = self._write_file(group_id, 'merged_files', filename, merged_data)
+            
+            logger.info(f"Saved merged file: {filename}")
+            return file_url
+        
+        except Exception as e:
+            logger.error(f"Failed to save merged file: {e}")
+            return ""
+    
+    # ===== ארכוב =====
+    
+    def compact(self) -> Dict[str, int]:
+        """העברת הוצאות שנמחקו וזוגות שסיימו לטבלאות הארכיון בטרנזקציה אחת"""
+        result = {"couples_archived": 0, "expenses_archived": 0}
+        
+        try:
+            with self._lock, self.conn:
+                couples = [
+                    self._to_record(row, COUPLES_HEADERS)
+                    for row in self.conn.execute("SELECT * FROM couples")
+                ]
+                archived_groups = [
+                    str(couple['group_id']) for couple in couples
+                    if couple['group_id'] and self._is_archivable_couple(couple)
+                ]
+                
+                result["expenses_archived"] += self._move_to_archive(
+                    'expenses', EXPENSES_HEADERS, "status = 'deleted'", []
+                )
+                
+                for start in range(0, len(archived_groups), SQLITE_MAX_PARAMS):
+                    chunk = archived_groups[start:start + SQLITE_MAX_PARAMS]
+                    condition = f"group_id IN ({', '.join('?' for _ in chunk)})"
+                    result["expenses_archived"] += self._move_to_archive(
+                        'expenses', EXPENSES_HEADERS, condition, chunk
+                    )
+                    result["couples_archived"] += self._move_to_archive(
+                        'couples', COUPLES_HEADERS, condition, chunk
+                    )
+                    self.conn.execute(f"DELETE FROM expense_summaries WHERE {condition}", chunk)
+            
+            logger.info(f"🗄️ Compaction done: {result}")
+            return result
+        
+        except Exception as e:
+            logger.error(f"Failed to compact database: {e}")
+            return {"couples_archived": 0, "expenses_archived": 0}
+    
+    def _move_to_archive(self, table: str, headers: List[str], condition: str, params: List) -> int:
+        """העברת שורות שעונות על התנאי לטבלת הארכיון - מחזיר כמה הועברו"""
+        columns = ", ".join(headers)
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {table}_archive ({columns}) "
+            f"SELECT {columns} FROM {table} WHERE {condition}",
+            params
+        )
+        return self.conn.execute(f"DELETE FROM {table} WHERE {condition}", params).rowcount
+    
+    # ===== פונקציות עזר ובדיקות =====
+    
+    def health_check(self) -> Dict[str, bool]:
+        """בדיקת תקינות האחסון המקומי"""
+        checks = {
+            "database_connection": False,
+            "files_directory": False,
+            "couples_table_exists": False,
+            "expenses_table_exists": False
+        }
+        
+        try:
+            with self._lock:
+                tables = {
+                    row["name"] for row in
+                    self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                }
+            checks["database_connection"] = True
+            checks["couples_table_exists"] = 'couples' in tables
+            checks["expenses_table_exists"] = 'expenses' in tables
+            checks["files_directory"] = self.files_dir.is_dir() and os.access(self.files_dir, os.W_OK)
+        
+        except Exception as e:
+            logger.error(f"Health check failed: {e}")
+        
+        return checks
+    
+    def get_statistics(self) -> Dict:
+        """קבלת סטטיסטיקות כלליות של המערכת"""
+        try:
+            with self._lock:
+                couples = self.conn.execute(
+                    "SELECT COUNT(*) AS total, "
+                    "SUM(CASE WHEN status = 'active' THEN 1 ELSE 0 END) AS active "
+                    "FROM couples"
+                ).fetchone()
+                expenses = self.conn.execute(
+                    "SELECT COALESCE(SUM(expense_count), 0) AS total, "
+                    "COALESCE(SUM(total_amount), 0) AS amount, "
+                    "MAX(NULLIF(last_created_at, '')) AS last_activity "
+                    "FROM expense_summaries"
+                ).fetchone()
+            
+            return {
+                "total_couples": couples["total"],
+                "active_couples": couples["active"] or 0,
+                "total_expenses": expenses["total"],
+                "total_amount": round(float(expenses["amount"]), 2),
+                "last_activity": expenses["last_activity"]
+            }
+        
+        except Exception as e:
+            logger.error(f"Failed to get statistics: {e}")
+            return {}
\ No newline at end of file
@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Optional, Any
+import hashlib
+
+from config import COMPACTION_WEDDING_GRACE_DAYS
+from expense_aggregates import empty_summary
+from expense_table import ExpenseTable
+from receipt_hashing import find_duplicate
+
+logger = logging.getLogger(__name__)
+
+# תתי-תיקיות לכל זוג ועמודת גיליון הזוגות שבה נשמר המזהה/הנתיב שלהן
+FOLDER_COLUMNS = {
+    'couple': 'drive_folder_id',
+    'receipts': 'receipts_folder_id',
+    'contacts': 'contacts_folder_id',
+    'merged_files': 'merged_folder_id'
+}
+
+class StorageBackend(ABC):
+    """ממשק אחסון משותף לבוט ולדשבורדים
+    
+    כל המערכת עובדת מול הממשק הזה דרך get_google_services(), כך שאפשר
+    להחליף בין Google Sheets/Drive לבין אחסון מקומי (SQLite) לפי הגדרה.
+    רשומות מוחזרות כ-dict עם המפתחות של COUPLES_HEADERS / EXPENSES_HEADERS.
+    """
+    
+    def _get_timestamp(self) -> str:
+        """מחזיר timestamp נוכחי"""
+        return datetime.now(timezone.utc).isoformat()
+    
+    def _generate_id(self, prefix: str = "") -> str:
+        """יצירת ID ייחודי"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        random_part = hashlib.md5(os.urandom(16)).hexdigest()[:8]
+        return f"{prefix}{timestamp}_{random_part}"
+    
+    # ===== ניהול זוגות =====
+    
+    @abstractmethod
+    def create_couple(self, phone1: str, phone2: str, group_id: str,
+                     couple_name: str = "", wedding_date: str = "",
+                     budget: float = 0) -> Dict:
+        """יצירת זוג חדש במערכת"""
+    
+    @abstractmethod
+    def get_couple_by_group_id(self, group_id: str) -> Optional[Dict]:
+        """קבלת נתוני זוג לפי group_id"""
+    
+    @abstractmethod
+    def get_all_active_couples(self) -> List[Dict]:
+        """קבלת כל הזוגות הפעילים"""
+    
+    @abstractmethod
+    def update_couple_fields(self, group_id: str, fields: Dict[str, Any]) -> bool:
+        """עדכון כמה שדות של זוג בבת אחת (כולל last_activity)"""
+    
+    def update_couple_field(self, group_id: str, field: str, value: Any) -> bool:
+        """עדכון שדה בודד של זוג"""
+        return self.update_couple_fields(group_id, {field: value})
+    
+    # ===== ניהול הוצאות =====
+    
+    @abstractmethod
+    def save_expense(self, expense_data: Dict) -> bool:
+        """שמירת הוצאה חדשה"""
+    
+    @abstractmethod
+    def get_expenses_by_group(self, group_id: str,
+                             include_deleted: bool = False) -> List[Dict]:
+        """קבלת כל ההוצאות של קבוצה (החדשה ביותר ראשונה)"""
+    
+    @abstractmethod
+    def get_expenses_grouped(self, group_ids: Optional[List[str]] = None,
+                             include_deleted: bool = False) -> Dict[str, List[Dict]]:
+        """הוצאות של כמה קבוצות בקריאה אחת - {group_id: [expenses]} (None = כל הקבוצות)"""
+    
+    def get_expense_table(self, group_ids: Optional[List[str]] = None) -> ExpenseTable:
+        """ההוצאות (כולל מחוקות) כטבלה עמודתית עם טיפוסים"""
+        grouped = self.get_expenses_grouped(group_ids, include_deleted=True)
+        return ExpenseTable.from_records(
+            expense for expenses in grouped.values() for expense in expenses
+        )
+    
+    @abstractmethod
+    def get_expense_summaries(self, group_ids: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """סיכומי הוצאות שמתעדכנים בכל כתיבה - {group_id: summary} (מבנה ב-expense_aggregates)"""
+    
+    def get_expense_summary(self, group_id: str) -> Dict:
+        """סיכום ההוצאות של זוג אחד"""
+        return self.get_expense_summaries([group_id]).get(group_id) or empty_summary(group_id)
+    
+    @abstractmethod
+    def update_expense_fields(self, expense_id: str, fields: Dict[str, Any]) -> bool:
+        """עדכון כמה שדות של הוצאה בבת אחת (כולל updated_at)"""
+    
+    def update_expense(self, expense_id: str, updates: Dict) -> bool:
+        """עדכון הוצאה קיימת"""
+        return self.update_expense_fields(expense_id, updates)
+    
+    def delete_expense(self, expense_id: str) -> bool:
+        """מחיקה רכה של הוצאה"""
+        return self.update_expense_fields(expense_id, {'status': 'deleted'})
+    
+    def find_expense_by_image(self, group_id: str, image_sha256: str,
+                              image_phash: str) -> Optional[Dict]:
+        """הוצאה פעילה של הזוג עם אותה תמונת קבלה (hash מדויק או dHash קרוב)"""
+        return find_duplicate(self.get_expenses_by_group(group_id), image_sha256, image_phash)
+    
+    # ===== קבצים =====
+    
+    @abstractmethod
+    def upload_receipt_image(self, group_id: str, image_data: bytes,
+                           filename: str = None, mimetype: str = 'image/jpeg') -> str:
+        """שמירת תמונת קבלה - מחזיר קישור לקובץ"""
+    
+    @abstractmethod
+    def save_contacts_files(self, group_id: str, contacts_data: bytes,
+                           guests_data: bytes, progress: Dict) -> bool:
+        """שמירת קבצי אנשי קשר ומוזמנים + התקדמות"""
+    
+    @abstractmethod
+    def save_merged_file(self, group_id: str, merged_data: bytes,
+                        filename: str = None) -> str:
+        """שמירת קובץ מוזמנים מחובר סופי - מחזיר קישור לקובץ"""
+    
+    def get_contacts_progress(self, group_id: str) -> Dict:
+        """קבלת התקדמות חיבור אנשי קשר"""
+        try:
+            couple = self.get_couple_by_group_id(group_id)
+            if not couple:
+                return {}
+            
+            progress_json = couple.get('contacts_progress', '')
+            if not progress_json:
+                return {}
+            
+            return json.loads(progress_json)
+        
+        except Exception as e:
+            logger.error(f"Failed to get contacts progress: {e}")
+            return {}
+    
+    # ===== בדיקות וסטטיסטיקות =====
+    
+    @abstractmethod
+    def health_check(self) -> Dict[str, bool]:
+        """בדיקת תקינות האחסון"""
+    
+    @abstractmethod
+    def get_statistics(self) -> Dict:
+        """קבלת סטטיסטיקות כלליות של המערכת"""
+    
+    # ===== ארכוב =====
+    
+    @abstractmethod
+    def compact(self) -> Dict[str, int]:
+        """העברת הוצאות שנמחקו וזוגות שסיימו לארכיון ובניית האינדקסים מחדש
+        
+        מחזיר {"couples_archived": n, "expenses_archived": n}
+        """
+    
+    def _is_archivable_couple(self, couple: Dict) -> bool:
+        """האם הזוג הושבת או שהחתונה שלו עברה (בתוספת ימי חסד)"""
+        if couple.get('status') == 'inactive':
+            return True
+        
+        try:
+            wedding_date = datetime.strptime(str(couple.get('wedding_date', ''))[:10], '%Y-%m-%d')
+        except ValueError:
+            return False
+        
+        return wedding_date + timedelta(days=COMPACTION_WEDDING_GRACE_DAYS) < datetime.now()
+    
+    def prewarm(self):
+        """אתחול מוקדם של חיבורים (אם יש) - נקרא ברקע בעליית התהליך"""
+        pass
+    
+    def prewarm_thread(self):
+        """אתחול מוקדם של לקוחות שנפרדים לכל thread (אם יש) - נקרא בכל thread של ה-pool"""
+        pass
+    
+    def flush(self) -> int:
+        """כתיבת פעולות שממתינות בתור (אם יש) - מחזיר כמה נכתבו"""
+        return 0
+    
+    def invalidate_cache(self, sheet_name: Optional[str] = None):
+        """ביטול cache פנימי (אם יש)"""
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """סטטיסטיקות cache"""
+        return {}
+    
+    def get_write_queue_stats(self) -> Dict[str, Any]:
+        """סטטיסטיקות תור כתיבה"""
+        return {}
+    
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        """סטטיסטיקות מתזמן הקריאות לשירות מרוחק"""
+        return {}
\ No newline at end of file
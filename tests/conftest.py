@@ -0,0 +1,199 @@
+import os
+import re
+import sys
+
+# מכסות גבוהות ובלי המתנה לפני דחיסה - הבדיקות לא פונות לגוגל
+os.environ.setdefault("SHEETS_READ_QUOTA_PER_MINUTE", "6000")
+os.environ.setdefault("SHEETS_WRITE_QUOTA_PER_MINUTE", "6000")
+os.environ.setdefault("COMPACTION_DRAIN_SECONDS", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gspread
+import pytest
+from gspread.utils import a1_to_rowcol, numericise_all
+
+from config import COUPLES_HEADERS, EXPENSES_HEADERS
+
+class FakeWorksheet:
+    """גיליון gspread בזיכרון - השורות נשמרות כרשימות של מחרוזות"""
+    
+    def __init__(self, title, spreadsheet, headers=None):
+        self.title = title
+        self.spreadsheet = spreadsheet
+        self.rows = [list(headers)] if headers else []
+        self.col_count = len(headers) if headers else 26
+        self.id = len(spreadsheet.sheets) + 1
+        self.calls = []
+    
+    def _record(self, name):
+        self.calls.append(name)
+        self.spreadsheet.calls.append((self.title, name))
+    
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append('')
+        cells[col - 1] = str(value)
+    
+    def _range(self, a1_range):
+        a1_range = a1_range.split('!')[-1]
+        start, _, end = a1_range.partition(':')
+        end = end or start
+        first_row, first_col = a1_to_rowcol(start if re.search(r'\d', start) else start + '1')
+        if re.search(r'\d', end):
+            last_row, last_col = a1_to_rowcol(end)
+        else:
+            _, last_col = a1_to_rowcol(end + '1')
+            last_row = max(len(self.rows), first_row)
+        return first_row, first_col, last_row, last_col
+    
+    def _get(self, a1_range):
+        first_row, first_col, last_row, last_col = self._range(a1_range)
+        values = [self.rows[row - 1][first_col - 1:last_col]
+                  for row in range(first_row, min(last_row, len(self.rows)) + 1)]
+        while values and not any(values[-1]):
+            values.pop()
+        return values
+    
+    def _appended(self, first_row):
+        return {'updates': {'updatedRange': f"'{self.title}'!A{first_row}:Z{len(self.rows)}"}}
+    
+    def get_all_records(self, **kwargs):
+        self._record('get_all_records')
+        if not self.rows:
+            return []
+        headers = self.rows[0]
+        return [dict(zip(headers, numericise_all(row + [''] * (len(headers) - len(row)))))
+                for row in self.rows[1:]]
+    
+    def get_all_values(self, **kwargs):
+        self._record('get_all_values')
+        return [list(row) for row in self.rows]
+    
+    def row_values(self, row, **kwargs):
+        self._record('row_values')
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+    
+    def col_values(self, col, **kwargs):
+        self._record('col_values')
+        return [row[col - 1] if len(row) >= col else '' for row in self.rows]
+    
+    def get(self, a1_range=None, **kwargs):
+        self._record('get')
+        return self._get(a1_range)
+    
+    def batch_get(self, ranges, **kwargs):
+        self._record('batch_get')
+        return [self._get(a1_range) for a1_range in ranges]
+    
+    def append_row(self, values, **kwargs):
+        self._record('append_row')
+        self.rows.append([str(value) for value in values])
+        return self._appended(len(self.rows))
+    
+    def append_rows(self, rows, **kwargs):
+        self._record('append_rows')
+        first_row = len(self.rows) + 1
+        self.rows.extend([str(value) for value in row] for row in rows)
+        return self._appended(first_row)
+    
+    def update(self, a1_range, values=None, **kwargs):
+        self._record('update')
+        first_row, first_col, _, _ = self._range(a1_range)
+        for row_offset, row in enumerate(values):
+            for col_offset, value in enumerate(row):
+                self._set(first_row + row_offset, first_col + col_offset, value)
+    
+    def batch_update(self, data, **kwargs):
+        self._record('batch_update')
+        for item in data:
+            first_row, first_col, _, _ = self._range(item['range'])
+            for row_offset, row in enumerate(item['values']):
+                for col_offset, value in enumerate(row):
+                    self._set(first_row + row_offset, first_col + col_offset, value)
+    
+    def update_cell(self, row, col, value):
+        self._record('update_cell')
+        self._set(row, col, value)
+    
+    def resize(self, rows=None, cols=None):
+        self._record('resize')
+        if cols:
+            self.col_count = cols
+    
+    def add_cols(self, count):
+        self._record('add_cols')
+        self.col_count += count
+    
+    def clear(self):
+        self._record('clear')
+        self.rows = []
+
+class FakeSpreadsheet:
+    """קובץ Sheets בזיכרון - כולל מחיקת שורות ב-batch_update של deleteDimension"""
+    
+    def __init__(self):
+        self.sheets = {}
+        self.calls = []
+        self.add_worksheet('couples', 1000, len(COUPLES_HEADERS)).rows = [list(COUPLES_HEADERS)]
+        self.add_worksheet('expenses', 1000, len(EXPENSES_HEADERS)).rows = [list(EXPENSES_HEADERS)]
+        self.calls.clear()
+    
+    def worksheet(self, title):
+        self.calls.append((title, 'worksheet'))
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+    
+    def worksheets(self):
+        self.calls.append(('*', 'worksheets'))
+        return list(self.sheets.values())
+    
+    def add_worksheet(self, title, rows, cols):
+        self.calls.append((title, 'add_worksheet'))
+        worksheet = FakeWorksheet(title, self)
+        worksheet.col_count = cols
+        self.sheets[title] = worksheet
+        return worksheet
+    
+    def del_worksheet(self, worksheet):
+        self.sheets.pop(worksheet.title, None)
+    
+    def batch_update(self, body):
+        self.calls.append(('*', 'batch_update'))
+        for request in body['requests']:
+            dimension = request['deleteDimension']['range']
+            worksheet = next(sheet for sheet in self.sheets.values() if sheet.id == dimension['sheetId'])
+            del worksheet.rows[dimension['startIndex']:dimension['endIndex']]
+        return {}
+    
+    def values(self, title):
+        """השורות של גיליון בלי שורת הכותרות"""
+        return self.sheets[title].rows[1:]
+
+@pytest.fixture
+def spreadsheet():
+    return FakeSpreadsheet()
+
+@pytest.fixture
+def make_manager(spreadsheet):
+    """יצירת GoogleServicesManager מעל הגיליון המזויף - כמה מופעים מדמים כמה תהליכים"""
+    from google_services import GoogleServicesManager
+    
+    def factory(**settings):
+        manager = GoogleServicesManager()
+        manager._spreadsheet = spreadsheet
+        manager._sheets_service = object()
+        manager._credentials = object()
+        for name, value in settings.items():
+            setattr(manager, name, value)
+        return manager
+    
+    return factory
+
+@pytest.fixture
+def manager(make_manager):
+    return make_manager()
\ No newline at end of file
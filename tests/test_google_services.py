@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+
+import google_services
+from config import EXPENSES_HEADERS
+
+def _expense(group_id, amount, vendor='ספק'):
+    return {'group_id': group_id, 'amount': amount, 'vendor': vendor, 'category': 'צלם', 'date': '2026-01-01'}
+
+def _column(spreadsheet, title, field):
+    column = EXPENSES_HEADERS.index(field)
+    return [row[column] for row in spreadsheet.values(title)]
+
+@pytest.fixture
+def queued_manager(make_manager, tmp_path, monkeypatch):
+    """מנהל עם תור write-behind - ה-flush רק כשהבדיקה קוראת לו"""
+    monkeypatch.setattr(google_services, 'EXPENSES_WRITE_BEHIND', True)
+    monkeypatch.setattr(google_services, 'EXPENSES_QUEUE_PATH', str(tmp_path / 'queue.jsonl'))
+    monkeypatch.setattr(google_services, 'EXPENSES_FLUSH_INTERVAL_SECONDS', 3600)
+    return make_manager()
+
+# ===== cache ואינדקסים =====
+
+def test_snapshot_is_cached_until_invalidated(manager, spreadsheet):
+    manager.create_couple('1', '2', 'g1', 'A')
+    manager.save_expense(_expense('g1', 100))
+    assert [e['amount'] for e in manager.get_expenses_by_group('g1')] == [100]
+    
+    # שינוי חיצוני לא נראה כל עוד תמונת המצב בתוקף
+    spreadsheet.sheets['expenses'].rows[1][EXPENSES_HEADERS.index('amount')] = '250'
+    reads = spreadsheet.sheets['expenses'].calls.count('get_all_records')
+    assert [e['amount'] for e in manager.get_expenses_by_group('g1')] == [100]
+    assert spreadsheet.sheets['expenses'].calls.count('get_all_records') == reads
+    
+    manager.invalidate_cache('expenses')
+    assert [e['amount'] for e in manager.get_expenses_by_group('g1')] == [250]
+
+def test_writes_update_snapshot_and_index_without_reload(manager, spreadsheet):
+    manager.create_couple('1', '2', 'g1', 'A')
+    manager.create_couple('1', '2', 'g2', 'B')
+    for amount in (10, 20, 30):
+        manager.save_expense(_expense('g1', amount))
+    manager.get_expenses_by_group('g1')
+    spreadsheet.calls.clear()
+    
+    by_amount = {e['amount']: e for e in manager.get_expenses_by_group('g1')}
+    assert manager.update_expense(by_amount[10]['expense_id'], {'amount': 15})
+    assert manager.delete_expense(by_amount[20]['expense_id'])
+    
+    assert sorted(e['amount'] for e in manager.get_expenses_by_group('g1')) == [15, 30]
+    assert manager.get_expense_summary('g1')['total_amount'] == 45
+    assert ('expenses', 'get_all_records') not in spreadsheet.calls
+    # העדכון נכתב לשורה הנכונה בגיליון
+    assert _column(spreadsheet, 'expenses', 'amount') == ['15', '20', '30']
+
+def test_flush_reloads_snapshot_when_rows_land_elsewhere(queued_manager, spreadsheet):
+    manager = queued_manager
+    manager.create_couple('1', '2', 'g1', 'A')
+    manager.get_expenses_by_group('g1')
+    
+    manager.save_expense(_expense('g1', 10))
+    # תהליך אחר כתב שורה לפני ה-flush - השורה שנחזתה בתמונת המצב תפוסה
+    spreadsheet.sheets['expenses'].append_row(['EXP_OTHER', 'g1', '99'] + [''] * (len(EXPENSES_HEADERS) - 3))
+    assert manager.flush() == 1
+    
+    expenses = manager.get_expenses_by_group('g1')
+    assert sorted(e['amount'] for e in expenses) == [10, 99]
+    mine = next(e for e in expenses if e['amount'] == 10)
+    assert manager.update_expense(mine['expense_id'], {'amount': 11})
+    assert _column(spreadsheet, 'expenses', 'amount') == ['99', '11']
+
+# ===== דחיסה וכתיבה לפי מספר שורה =====
+
+def test_compaction_moves_rows_and_writes_find_the_new_row(make_manager, spreadsheet):
+    archiver = make_manager(cache_ttl=0)
+    worker = make_manager(cache_ttl=60)
+    archiver.create_couple('1', '2', 'past', 'P', wedding_date='2020-01-01')
+    archiver.create_couple('1', '2', 'live', 'L', wedding_date='2099-01-01')
+    
+    # תמונת המצב של התהליך השני עדיין בתוקף אחרי הדחיסה - live בה בשורה 3
+    assert worker.get_couple_by_group_id('live')
+    
+    result = archiver.compact()
+    assert result['couples_archived'] == 1
+    group_id = google_services.COUPLES_HEADERS.index('group_id')
+    assert [row[group_id] for row in spreadsheet.values('couples')] == ['live']
+    
+    # מצב הדחיסה נקרא מחדש לפני תמונת המצב - ה-generation התקדם
+    # ומספר השורה נמצא מחדש לפני הכתיבה
+    worker._compaction_state["read_at"] = None
+    assert worker.update_couple_field('live', 'budget', 5000)
+    budget = google_services.COUPLES_HEADERS.index('budget')
+    assert [row[budget] for row in spreadsheet.values('couples')] == ['5000']
+    assert spreadsheet.values('compaction_state') == [['1', '']]
+
+def test_writes_by_row_are_refused_while_compacting(make_manager, spreadsheet):
+    archiver = make_manager(cache_ttl=0.3)
+    worker = make_manager(cache_ttl=0.05)
+    archiver.create_couple('1', '2', 'past', 'P', wedding_date='2020-01-01')
+    archiver.create_couple('1', '2', 'live', 'L', wedding_date='2099-01-01')
+    worker.get_couple_by_group_id('live')
+    
+    thread = threading.Thread(target=archiver.compact)
+    thread.start()
+    # הסימון נכתב והדחיסה ממתינה (cache_ttl) לפני שהיא מזיזה שורות
+    deadline = time.monotonic() + 2
+    while 'compaction_state' not in spreadsheet.sheets and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.06)
+    assert not worker.update_couple_field('live', 'budget', 1)
+    thread.join()
+    
+    time.sleep(0.06)
+    assert worker.update_couple_field('live', 'budget', 2)
+    budget = google_services.COUPLES_HEADERS.index('budget')
+    assert [row[budget] for row in spreadsheet.values('couples')] == ['2']
+
+def test_second_compaction_is_skipped_while_first_runs(make_manager, spreadsheet):
+    first = make_manager(cache_ttl=0.3)
+    second = make_manager(cache_ttl=0.05)
+    first.create_couple('1', '2', 'past', 'P', wedding_date='2020-01-01')
+    
+    thread = threading.Thread(target=first.compact)
+    thread.start()
+    deadline = time.monotonic() + 2
+    while 'compaction_state' not in spreadsheet.sheets and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert second.compact() == {"couples_archived": 0, "expenses_archived": 0}
+    thread.join()
+    assert spreadsheet.values('compaction_state') == [['1', '']]
+
+# ===== תור write-behind =====
+
+def test_flush_writes_in_enqueue_order(queued_manager, spreadsheet):
+    manager = queued_manager
+    manager.create_couple('1', '2', 'g1', 'A')
+    manager.create_couple('1', '2', 'g2', 'B')
+    manager.get_expenses_by_group('g1')
+    # ההוצאות לא נשלפות עד ה-flush - אחרת ה-flush ירוץ מתוך הקריאה
+    for amount in range(1, 6):
+        manager.save_expense(_expense('g1' if amount % 2 else 'g2', amount))
+    
+    assert manager.get_write_queue_stats()['pending'] == 5
+    assert spreadsheet.values('expenses') == []
+    
+    manager.flush_max_batch = 2
+    assert manager.flush() == 5
+    assert _column(spreadsheet, 'expenses', 'amount') == ['1', '2', '3', '4', '5']
+    # אצוות של flush_max_batch שורות
+    assert spreadsheet.sheets['expenses'].calls.count('append_rows') == 3
+    assert manager.get_write_queue_stats()['pending'] == 0
+    with open(manager.queue_path, encoding='utf-8') as journal:
+        assert journal.read() == ''
+
+def test_failed_flush_keeps_queue_order(queued_manager, spreadsheet):
+    manager = queued_manager
+    manager.create_couple('1', '2', 'g1', 'A')
+    manager.get_expenses_by_group('g1')
+    for amount in (1, 2, 3):
+        manager.save_expense(_expense('g1', amount))
+    
+    worksheet = spreadsheet.sheets['expenses']
+    def unavailable(rows, **kwargs):
+        raise RuntimeError('Sheets unavailable')
+    worksheet.append_rows = unavailable
+    assert manager.flush() == 0
+    assert manager.get_write_queue_stats()['pending'] == 3
+    
+    del worksheet.append_rows
+    assert manager.flush() == 3
+    assert _column(spreadsheet, 'expenses', 'amount') == ['1', '2', '3']
\ No newline at end of file
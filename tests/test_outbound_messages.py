@@ -0,0 +1,101 @@
+import threading
+import time
+
+import httpx
+import pytest
+
+from outbound_messages import MERGE_SEPARATOR, OutboundScheduler
+
+class FakeGreenAPI:
+    """לקוח Green API מזויף - כל שליחה מחזירה את התשובה הבאה מהרשימה (או 200)"""
+    
+    def __init__(self, responses=None, gate=None):
+        self.responses = list(responses or [])
+        self.gate = gate
+        self.sent = []
+        self.attempts = 0
+    
+    def post(self, method, payload, timeout=10):
+        self.attempts += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        response = self.responses.pop(0) if self.responses else 200
+        if isinstance(response, Exception):
+            raise response
+        if isinstance(response, int):
+            response = httpx.Response(response)
+        if response.status_code == 200:
+            self.sent.append((payload['chatId'], payload['message']))
+        return response
+
+def _scheduler(client, **settings):
+    settings.setdefault('rate_per_second', 1000)
+    settings.setdefault('backoff_base', 0.01)
+    return OutboundScheduler(client=client, **settings)
+
+def test_queued_messages_to_same_chat_are_merged():
+    gate = threading.Event()
+    client = FakeGreenAPI(gate=gate)
+    scheduler = _scheduler(client)
+    
+    # ההודעה הראשונה תקועה בשליחה - הבאות ממתינות בתור ומתאחדות לפי צ'אט
+    futures = [scheduler.submit('c1', 'first')]
+    deadline = time.monotonic() + 2
+    while client.attempts == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    futures += [scheduler.submit(chat_id, text) for chat_id, text in
+                [('c1', 'a'), ('c2', 'b'), ('c1', 'c')]]
+    gate.set()
+    
+    assert all(future.result(timeout=5) for future in futures)
+    assert client.sent == [
+        ('c1', 'first'),
+        ('c1', 'a' + MERGE_SEPARATOR + 'c'),
+        ('c2', 'b'),
+    ]
+    assert scheduler.get_stats()['merged'] == 1
+
+def test_rate_limit_retries_after_retry_after():
+    client = FakeGreenAPI([httpx.Response(429, headers={'Retry-After': '0.1'})])
+    scheduler = _scheduler(client)
+    
+    started = time.monotonic()
+    assert scheduler.send_and_wait('c1', 'hello', timeout=5)
+    assert time.monotonic() - started >= 0.1
+    assert client.sent == [('c1', 'hello')]
+    stats = scheduler.get_stats()
+    assert (stats['retries'], stats['rate_limited']) == (1, 1)
+
+def test_connect_errors_are_retried():
+    client = FakeGreenAPI([httpx.ConnectError('refused'), httpx.ConnectTimeout('timeout')])
+    scheduler = _scheduler(client)
+    
+    assert scheduler.send_and_wait('c1', 'hello', timeout=5)
+    assert client.attempts == 3
+
+@pytest.mark.parametrize('failure', [503, httpx.ReadTimeout('no answer'), httpx.RemoteProtocolError('closed')])
+def test_send_that_may_have_arrived_is_not_retried(failure):
+    # sendMessage אינה אידמפוטנטית - ניסיון חוזר עלול לשלוח את ההודעה פעמיים
+    client = FakeGreenAPI([failure])
+    scheduler = _scheduler(client)
+    
+    assert not scheduler.send_and_wait('c1', 'hello', timeout=5)
+    assert client.attempts == 1
+    assert scheduler.get_stats()['failures'] == 1
+
+def test_gives_up_after_max_retries():
+    client = FakeGreenAPI([429] * 5)
+    scheduler = _scheduler(client, max_retries=2)
+    
+    assert not scheduler.send_and_wait('c1', 'hello', timeout=5)
+    assert client.attempts == 3
+
+def test_sends_are_spaced_by_rate():
+    client = FakeGreenAPI()
+    scheduler = _scheduler(client, rate_per_second=20)
+    
+    futures = [scheduler.submit(f'c{i}', 'hello') for i in range(4)]
+    started = time.monotonic()
+    assert all(future.result(timeout=5) for future in futures)
+    # ההודעה הראשונה יוצאת מיד, ואחריה שלושה מרווחים של 50ms
+    assert time.monotonic() - started >= 0.14
\ No newline at end of file
@@ -0,0 +1,56 @@
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from receipt_hashing import PHASH_PREFIX, content_hash, find_duplicate, hamming_distance, perceptual_hash
+
+def _phash(bits):
+    return f"{PHASH_PREFIX}{bits:016x}"
+
+def _receipt(size=(300, 600), image_format='JPEG', quality=90):
+    image = Image.new('RGB', (300, 600), 'white')
+    draw = ImageDraw.Draw(image)
+    for line in range(12):
+        draw.rectangle([20, 30 + line * 45, 60 + line * 18, 50 + line * 45], fill='black')
+    image = image.resize(size)
+    output = BytesIO()
+    image.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+def test_exact_sha_wins_over_closer_phash():
+    expenses = [
+        {'expense_id': 'near', 'image_sha256': 'other', 'image_phash': _phash(0)},
+        {'expense_id': 'same', 'image_sha256': 'abc', 'image_phash': _phash(0xFFFF)},
+    ]
+    assert find_duplicate(expenses, 'abc', _phash(0))['expense_id'] == 'same'
+
+def test_phash_match_is_limited_by_max_distance():
+    expenses = [{'expense_id': 'e1', 'image_sha256': '', 'image_phash': _phash(0)}]
+    assert find_duplicate(expenses, 'x', _phash(0b11111), max_distance=5)['expense_id'] == 'e1'
+    assert find_duplicate(expenses, 'x', _phash(0b111111), max_distance=5) is None
+
+def test_closest_phash_is_returned():
+    expenses = [
+        {'expense_id': 'far', 'image_phash': _phash(0b111)},
+        {'expense_id': 'close', 'image_phash': _phash(0b1)},
+        {'expense_id': 'middle', 'image_phash': _phash(0b11)},
+    ]
+    assert find_duplicate(expenses, '', _phash(0), max_distance=5)['expense_id'] == 'close'
+
+def test_missing_or_invalid_hashes_never_match():
+    expenses = [
+        {'expense_id': 'empty', 'image_sha256': '', 'image_phash': ''},
+        # dHash שכולו ספרות ונשמר בלי הקידומת הומר למספר ב-get_all_records
+        {'expense_id': 'numeric', 'image_phash': 1234},
+        {'expense_id': 'broken', 'image_phash': f'{PHASH_PREFIX}zz'},
+    ]
+    assert find_duplicate(expenses, '', _phash(0), max_distance=64) is None
+    assert find_duplicate(expenses, '', '', max_distance=64) is None
+    assert hamming_distance(_phash(0), f'{PHASH_PREFIX}zz') is None
+
+def test_recompressed_copy_is_near_duplicate():
+    original = _receipt()
+    copy = _receipt(size=(150, 300), quality=40)
+    assert content_hash(original) != content_hash(copy)
+    assert hamming_distance(perceptual_hash(original), perceptual_hash(copy)) <= 5
+    assert perceptual_hash(b'not an image') == ''
\ No newline at end of file
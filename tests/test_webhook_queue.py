@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+import webhook_queue
+from webhook_queue import WebhookQueue
+
+def _message(chat_id, text):
+    return {'senderData': {'chatId': chat_id}, 'text': text}
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WebhookQueue(str(tmp_path / 'queue.db'), max_in_flight=4, max_attempts=3)
+    yield queue
+    queue.conn.close()
+
+def _claim_text(queue):
+    job = queue._claim()
+    return (job[0], job[1]['text']) if job else None
+
+def test_claim_keeps_order_within_chat(queue):
+    for chat_id, text in [('c1', 'a1'), ('c2', 'b1'), ('c1', 'a2'), ('c2', 'b2')]:
+        queue._insert(_message(chat_id, text))
+    
+    first_id, first = _claim_text(queue)
+    second_id, second = _claim_text(queue)
+    assert (first, second) == ('a1', 'b1')
+    # ההודעות הבאות של שני הצ'אטים ממתינות להודעה שלפניהן
+    assert queue._claim() is None
+    
+    queue._complete(second_id)
+    assert _claim_text(queue)[1] == 'b2'
+    
+    # הודעה שחוזרת לתור לניסיון חוזר עדיין חוסמת את ההודעות שאחריה
+    assert queue._fail(first_id, 1, 'flaky')
+    assert queue._claim() is None
+    
+    queue.conn.execute("UPDATE webhook_jobs SET available_at = 0 WHERE job_id = ?", (first_id,))
+    assert _claim_text(queue) == (first_id, 'a1')
+    queue._fail(first_id, 3, 'gave up')
+    # הודעה שנכשלה סופית לא עוצרת את הצ'אט
+    assert _claim_text(queue)[1] == 'a2'
+
+def test_recover_returns_processing_jobs_to_queue(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    crashed = WebhookQueue(path)
+    crashed._insert(_message('c1', 'a1'))
+    assert crashed._claim()
+    
+    restarted = WebhookQueue(path)
+    assert restarted._recover() == 1
+    assert _claim_text(restarted)[1] == 'a1'
+
+def _run(queue, handler, on_failed=None, until=None, timeout=5):
+    """הרצת התור עד שכל ההודעות הסתיימו"""
+    async def main():
+        await queue.start(handler, on_failed)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            counts = await asyncio.to_thread(queue._counts)
+            if counts['pending'] == 0 and counts['processing'] == 0:
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+        return await queue.get_stats()
+    return asyncio.run(main())
+
+def test_retry_only_for_exceptions_and_retryable_errors(queue, monkeypatch):
+    monkeypatch.setattr(webhook_queue, 'RETRY_BASE_SECONDS', 0.01)
+    monkeypatch.setattr(webhook_queue, 'POLL_INTERVAL_SECONDS', 0.01)
+    attempts = {}
+    reported = []
+    
+    async def handler(payload):
+        text = payload['text']
+        attempts[text] = attempts.get(text, 0) + 1
+        if text == 'raises' and attempts[text] == 1:
+            raise RuntimeError('download failed')
+        if text == 'replied':
+            return {'status': 'error', 'error': 'already answered'}
+        if text == 'down':
+            return {'status': 'error', 'error': 'Sheets down', 'retryable': True}
+        return {'status': 'ok'}
+    
+    async def on_failed(payload):
+        reported.append(payload['text'])
+    
+    for text in ('raises', 'replied', 'down', 'ok'):
+        queue._insert(_message(f'chat-{text}', text))
+    
+    stats = _run(queue, handler, on_failed)
+    
+    assert attempts == {'raises': 2, 'replied': 1, 'down': 3, 'ok': 1}
+    # רק הודעה שלא נענתה מדווחת לזוג
+    assert reported == ['down']
+    assert stats['processed'] == 2
+    assert stats['failed'] == 2
+    assert stats['failed_jobs'] == 2
+
+def test_next_message_waits_for_retry_of_previous(queue, monkeypatch):
+    monkeypatch.setattr(webhook_queue, 'RETRY_BASE_SECONDS', 0.05)
+    monkeypatch.setattr(webhook_queue, 'POLL_INTERVAL_SECONDS', 0.01)
+    handled = []
+    failed_once = set()
+    
+    async def handler(payload):
+        text = payload['text']
+        if text == 'first' and text not in failed_once:
+            failed_once.add(text)
+            raise RuntimeError('transient')
+        handled.append(text)
+        return {'status': 'ok'}
+    
+    queue._insert(_message('c1', 'first'))
+    queue._insert(_message('c1', 'second'))
+    queue._insert(_message('c2', 'other'))
+    
+    _run(queue, handler)
+    
+    assert handled.index('first') < handled.index('second')
+    # צ'אט אחר לא מחכה לניסיון החוזר
+    assert handled.index('other') < handled.index('first')
\ No newline at end of file
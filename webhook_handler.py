@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import JSONResponse
@@ -5,6 +6,11 @@ import uvicorn
 from typing import Dict
 
 from whatsapp_bot_handler import WhatsAppBotHandler
+from google_services import prewarm_google_services
+from receipt_images import get_image_pipeline_stats
+from webhook_queue import get_webhook_queue
+from green_api_client import get_green_api_client
+from outbound_messages import get_outbound_scheduler
 from config import validate_config
 
 # הגדרת logging
@@ -25,6 +31,9 @@ app = FastAPI(
 # מופע הבוט
 bot_handler = WhatsAppBotHandler()
 
+# תור ההודעות - ה-webhook מחזיר מיד וה-workers מעבדים ברקע
+webhook_queue = get_webhook_queue()
+
 @app.on_event("startup")
 async def startup_event():
     """אתחול המערכת"""
@@ -42,6 +51,34 @@ async def startup_event():
         logger.warning("⚠️ Some services are not properly configured")
     else:
         logger.info("✅ All systems operational!")
+    
+    # חיבור לגוגל ברקע - הבקשה הראשונה לא תחכה לאתחול
+    prewarm_google_services()
+    bot_handler.gs.prewarm()
+    
+    # תור ה-webhooks (כולל הודעות שנשארו מהריצה הקודמת) -> נתיבים לפי צ'אט
+    await webhook_queue.start(bot_handler.dispatch, bot_handler.report_failure)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """כיבוי מסודר - כתיבת הוצאות שממתינות בתור"""
+    logger.info("🛑 Stopping Wedding System WhatsApp Bot")
+    
+    # הודעות שבעיבוד מסתיימות, השאר נשארות בתור לריצה הבאה
+    await webhook_queue.stop()
+    await bot_handler.dispatcher.stop()
+    
+    # הודעות שעוד בתור השליחה
+    if not await asyncio.to_thread(get_outbound_scheduler().drain):
+        logger.warning("⚠️ Outbound WhatsApp messages left unsent")
+    await get_green_api_client().aclose()
+    
+    try:
+        flushed = await bot_handler.gs.flush()
+        if flushed:
+            logger.info(f"💾 Flushed {flushed} queued expenses")
+    except Exception as e:
+        logger.error(f"Failed to flush expenses on shutdown: {e}")
 
 @app.get("/")
 async def root():
@@ -57,7 +94,7 @@ async def health_check():
     """בדיקת תקינות המערכת"""
     try:
         # בדיקת שירותי הבוט
-        health_status = bot_handler.health_check()
+        health_status = await bot_handler.gs.run(bot_handler.health_check)
         
         return {
             "status": "healthy" if all(health_status.values()) else "degraded",
@@ -81,24 +118,21 @@ async def webhook_handler(request: Request):
             logger.warning("🚫 Unauthorized webhook request")
             raise HTTPException(status_code=401, detail="Unauthorized")
         
-        # עיבוד ההודעה
-        result = await bot_handler.process_webhook(payload)
-        
-        # לוג התוצאה
-        if result.get("status") == "error":
-            logger.error(f"❌ Webhook processing failed: {result.get('error')}")
-        elif result.get("status") not in ["ignored", "regular_message"]:
-            logger.info(f"✅ Webhook processed: {result.get('status')}")
+        # שמירה בתור ותשובה מיידית - העיבוד עצמו ב-workers
+        job_id = await webhook_queue.enqueue(payload)
         
         return JSONResponse(
             status_code=200,
-            content={"success": True, "result": result}
+            content={"success": True, "queued": job_id}
         )
         
     except ValueError as e:
         logger.error(f"❌ Invalid JSON payload: {e}")
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
     
+    except HTTPException:
+        raise
+    
     except Exception as e:
         logger.error(f"❌ Webhook handler error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -146,19 +180,26 @@ async def get_stats():
     """סטטיסטיקות מערכת"""
     
     try:
-        from google_services import get_google_services
         from auth_system import get_auth_manager
         
-        gs = get_google_services()
+        gs = bot_handler.gs.backend
         auth = get_auth_manager()
         
         # סטטיסטיקות מהמערכת
-        system_stats = gs.get_statistics()
+        system_stats = await bot_handler.gs.get_statistics()
         auth_stats = auth.get_auth_statistics()
         
         return {
             "system": system_stats,
             "auth": auth_stats,
+            "cache": gs.get_cache_stats(),
+            "write_queue": gs.get_write_queue_stats(),
+            "google_scheduler": gs.get_scheduler_stats(),
+            "receipt_images": get_image_pipeline_stats(),
+            "webhook_queue": await webhook_queue.get_stats(),
+            "chat_dispatcher": bot_handler.dispatcher.get_stats(),
+            "green_api": get_green_api_client().get_stats(),
+            "outbound_messages": get_outbound_scheduler().get_stats(),
             "bot": {
                 "active": True,
                 "version": "2.0.0"
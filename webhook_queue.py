@@ -0,0 +1,359 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from config import WEBHOOK_QUEUE_PATH, WEBHOOK_MAX_IN_FLIGHT, WEBHOOK_JOB_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# כמה זמן ממתינים לפני בדיקה חוזרת של התור (הודעות שממתינות לניסיון חוזר)
+POLL_INTERVAL_SECONDS = 1.0
+
+# השהיה לפני ניסיון חוזר - גדלה פי 2 בכל ניסיון
+RETRY_BASE_SECONDS = 2.0
+
+class WebhookQueue:
+    """תור מקומי ועמיד של הודעות webhook
+    
+    ה-webhook רק שומר את ה-payload ב-SQLite ומחזיר 200 - Green API לא מחכה
+    להורדת התמונה, ל-AI, לדרייב ול-Sheets. לולאה אחת שולפת הודעות לפי סדר
+    ההגעה ומעבירה אותן ל-handler באותו סדר (עד max_in_flight בו-זמנית) -
+    ה-handler של הבוט מפזר אותן לנתיבים לפי צ'אט.
+    הודעה של צ'אט נשלפת רק אחרי שכל ההודעות הקודמות שלו הסתיימו, כך
+    שהודעה שממתינה לניסיון חוזר לא נעקפת על ידי ההודעות שאחריה.
+    הודעות שהיו בעיבוד כשהשרת נפל חוזרות לתור בעלייה הבאה. הודעה שהעיבוד
+    שלה זרק חריגה או החזיר status=error עם retryable (עוד לא נעשה כלום) מנוסה
+    שוב עד WEBHOOK_JOB_MAX_ATTEMPTS פעמים, ואז on_failed נקרא איתה. status=error
+    בלי retryable הוא סופי - ה-handler כבר ענה לזוג ואולי כבר שמר משהו.
+    הודעה שנכשלה נשארת בטבלה בסטטוס failed ולא עוצרת את הצ'אט.
+    """
+    
+    def __init__(self, db_path: str = WEBHOOK_QUEUE_PATH, max_in_flight: int = WEBHOOK_MAX_IN_FLIGHT,
+                 max_attempts: int = WEBHOOK_JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                chat_id TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                last_error TEXT
+            )
+        """)
+        
+        # תור שנוצר לפני שנשמר ה-chat_id - להודעות הישנות אין סדר לפי צ'אט
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(webhook_jobs)")}
+        if "chat_id" not in existing:
+            self.conn.execute("ALTER TABLE webhook_jobs ADD COLUMN chat_id TEXT")
+        
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_webhook_jobs_status ON webhook_jobs (status, available_at, job_id)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_webhook_jobs_chat ON webhook_jobs (chat_id, job_id)"
+        )
+        self.conn.commit()
+        
+        self._handler: Optional[Callable[[Dict], Awaitable[Dict]]] = None
+        self._on_failed: Optional[Callable[[Dict], Awaitable[Any]]] = None
+        self._feeder: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "retries": 0,
+            "failed": 0,
+            "recovered": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "processing_seconds_total": 0.0,
+            "processing_seconds_max": 0.0,
+        }
+    
+    # ===== פעולות על הטבלה (חוסמות - רצות ב-thread) =====
+    
+    def _insert(self, payload: Dict) -> int:
+        """שמירת הודעה חדשה בתור"""
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO webhook_jobs (payload, chat_id, enqueued_at, available_at) VALUES (?, ?, ?, ?)",
+                (json.dumps(payload, ensure_ascii=False), self._chat_id(payload), now, now)
+            )
+            self.conn.commit()
+            self._stats["enqueued"] += 1
+            return cursor.lastrowid
+    
+    def _chat_id(self, payload: Dict) -> Optional[str]:
+        """הצ'אט של ההודעה - הסדר נשמר בתוכו"""
+        sender_data = payload.get("senderData") if isinstance(payload, dict) else None
+        return (sender_data or {}).get("chatId") or None
+    
+    def _claim(self) -> Optional[Tuple[int, Dict, float, int]]:
+        """לקיחת ההודעה הוותיקה ביותר שזמינה לעיבוד
+        
+        הודעה שלפניה באותו צ'אט יש הודעה בעיבוד או בהמתנה לניסיון חוזר - מדולגת.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT job_id, payload, enqueued_at, attempts FROM webhook_jobs AS job "
+                "WHERE status = 'pending' AND available_at <= ? AND NOT EXISTS ("
+                "SELECT 1 FROM webhook_jobs AS earlier WHERE earlier.chat_id = job.chat_id "
+                "AND earlier.job_id < job.job_id AND earlier.status != 'failed'"
+                ") ORDER BY job_id LIMIT 1",
+                (time.time(),)
+            ).fetchone()
+            if not row:
+                return None
+            
+            job_id, payload, enqueued_at, attempts = row
+            self.conn.execute(
+                "UPDATE webhook_jobs SET status = 'processing', attempts = attempts + 1 WHERE job_id = ?",
+                (job_id,)
+            )
+            self.conn.commit()
+        
+        return job_id, json.loads(payload), enqueued_at, attempts + 1
+    
+    def _complete(self, job_id: int):
+        """הודעה שעובדה - נמחקת מהתור"""
+        with self._lock:
+            self.conn.execute("DELETE FROM webhook_jobs WHERE job_id = ?", (job_id,))
+            self.conn.commit()
+    
+    def _fail(self, job_id: int, attempts: int, error: str, retryable: bool = True) -> bool:
+        """החזרת הודעה לתור לניסיון חוזר, או סימון failed - מחזיר True אם תנוסה שוב"""
+        retry = retryable and attempts < self.max_attempts
+        with self._lock:
+            if retry:
+                self.conn.execute(
+                    "UPDATE webhook_jobs SET status = 'pending', available_at = ?, last_error = ? WHERE job_id = ?",
+                    (time.time() + RETRY_BASE_SECONDS * 2 ** (attempts - 1), error, job_id)
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE webhook_jobs SET status = 'failed', last_error = ? WHERE job_id = ?",
+                    (error, job_id)
+                )
+            self.conn.commit()
+        return retry
+    
+    def _recover(self) -> int:
+        """הודעות שהיו בעיבוד כשהתהליך נעצר חוזרות לתור"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE webhook_jobs SET status = 'pending' WHERE status = 'processing'"
+            )
+            self.conn.commit()
+            return cursor.rowcount
+    
+    def _counts(self) -> Dict[str, Any]:
+        """מספר ההודעות בכל סטטוס + גיל ההודעה הממתינה הוותיקה"""
+        with self._lock:
+            counts = dict(self.conn.execute(
+                "SELECT status, COUNT(*) FROM webhook_jobs GROUP BY status"
+            ).fetchall())
+            oldest = self.conn.execute(
+                "SELECT MIN(enqueued_at) FROM webhook_jobs WHERE status = 'pending'"
+            ).fetchone()[0]
+        
+        return {
+            "pending": counts.get('pending', 0),
+            "processing": counts.get('processing', 0),
+            "failed_jobs": counts.get('failed', 0),
+            "oldest_pending_seconds": round(time.time() - oldest, 2) if oldest else 0.0,
+        }
+    
+    # ===== API אסינכרוני =====
+    
+    async def enqueue(self, payload: Dict) -> int:
+        """שמירת webhook בתור והערת הלולאה - מחזיר את מזהה ההודעה"""
+        job_id = await asyncio.to_thread(self._insert, payload)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+    
+    async def start(self, handler: Callable[[Dict], Awaitable[Dict]],
+                    on_failed: Optional[Callable[[Dict], Awaitable[Any]]] = None):
+        """הפעלת העיבוד על ה-event loop הנוכחי
+        
+        handler נקרא לפי סדר ההודעות בתור ומחזיר awaitable עם התוצאה.
+        on_failed נקרא עם ה-payload כשהודעה שניתן היה לנסות שוב נכשלה סופית.
+        """
+        if self._feeder is not None:
+            return
+        
+        self._handler = handler
+        self._on_failed = on_failed
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        
+        recovered = await asyncio.to_thread(self._recover)
+        if recovered:
+            self._stats["recovered"] += recovered
+            logger.info(f"📥 Recovered {recovered} webhook jobs from previous run")
+        
+        self._feeder = asyncio.create_task(self._feed(), name="webhook-feeder")
+        logger.info(f"✅ Webhook queue started (up to {self.max_in_flight} jobs in flight)")
+    
+    async def stop(self, timeout: float = 30):
+        """עצירה - הודעות שבעיבוד מסתיימות, והשאר נשארות בתור"""
+        if self._feeder is None:
+            return
+        
+        self._stopping = True
+        self._feeder.cancel()
+        await asyncio.gather(self._feeder, return_exceptions=True)
+        self._feeder = None
+        
+        if self._in_flight:
+            _, pending = await asyncio.wait(self._in_flight, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        
+        logger.info("🛑 Webhook queue stopped")
+    
+    async def _feed(self):
+        """שליפת הודעות לפי הסדר והעברתן ל-handler"""
+        while not self._stopping:
+            await self._slots.acquire()
+            
+            # איפוס לפני הבדיקה - הודעה שנכנסת אחרי הבדיקה תעיר את ההמתנה
+            self._wakeup.clear()
+            
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error(f"Webhook queue read failed: {e}")
+                job = None
+            
+            if job is None:
+                self._slots.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            job_id, payload, enqueued_at, attempts = job
+            dispatched = time.time()
+            
+            # הקריאה ל-handler כאן ולא בתוך המשימה - כך הסדר נשמר
+            try:
+                pending = self._handler(payload)
+            except Exception as e:
+                await self._failed(job_id, payload, attempts, e)
+                self._slots.release()
+                continue
+            
+            task = asyncio.create_task(self._process(job_id, payload, pending, enqueued_at, dispatched, attempts))
+            self._in_flight.add(task)
+            task.add_done_callback(self._finished)
+    
+    def _finished(self, task: asyncio.Task):
+        """שחרור מקום לעבודה נוספת והערת הלולאה - ההודעה הבאה של הצ'אט כבר זמינה"""
+        self._in_flight.discard(task)
+        self._slots.release()
+        self._wakeup.set()
+    
+    async def _failed(self, job_id: int, payload: Dict, attempts: int, error: Any,
+                      retryable: bool = True):
+        """רישום כישלון - ניסיון חוזר או failed"""
+        retry = await asyncio.to_thread(self._fail, job_id, attempts, str(error), retryable)
+        if retry:
+            self._stats["retries"] += 1
+            logger.warning(f"⚠️ Webhook job {job_id} failed (attempt {attempts}), will retry: {error}")
+            return
+        
+        self._stats["failed"] += 1
+        logger.error(f"❌ Webhook job {job_id} failed after {attempts} attempts: {error}")
+        
+        if retryable and self._on_failed is not None:
+            try:
+                await self._on_failed(payload)
+            except Exception as e:
+                logger.error(f"Webhook failure callback failed: {e}")
+    
+    async def _process(self, job_id: int, payload: Dict, pending: Awaitable[Dict], enqueued_at: float,
+                       dispatched: float, attempts: int):
+        """המתנה לתוצאת ההודעה ועדכון הסטטיסטיקות"""
+        wait = dispatched - enqueued_at
+        
+        try:
+            result = await pending
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._failed(job_id, payload, attempts, e)
+            return
+        
+        # process_webhook תופס חריגות ומחזיר status=error - נוסה שוב רק אם סומן retryable
+        status = (result or {}).get("status")
+        if status == "error":
+            await self._failed(job_id, payload, attempts, result.get("error"), bool(result.get("retryable")))
+            return
+        
+        await asyncio.to_thread(self._complete, job_id)
+        duration = time.time() - dispatched
+        
+        self._stats["processed"] += 1
+        self._stats["wait_seconds_total"] += wait
+        self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait)
+        self._stats["processing_seconds_total"] += duration
+        self._stats["processing_seconds_max"] = max(self._stats["processing_seconds_max"], duration)
+        
+        if status not in ["ignored", "regular_message"]:
+            logger.info(f"✅ Webhook processed: {status} ({duration:.1f}s, waited {wait:.1f}s)")
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """עומק התור, זמני המתנה וזמני עיבוד"""
+        stats = dict(self._stats)
+        processed = stats["processed"]
+        
+        stats["wait_seconds_avg"] = round(stats["wait_seconds_total"] / processed, 3) if processed else 0.0
+        stats["processing_seconds_avg"] = round(stats["processing_seconds_total"] / processed, 3) if processed else 0.0
+        for key in ("wait_seconds_total", "wait_seconds_max", "processing_seconds_total", "processing_seconds_max"):
+            stats[key] = round(stats[key], 3)
+        
+        stats["max_in_flight"] = self.max_in_flight
+        stats["in_flight"] = len(self._in_flight)
+        stats["running"] = self._feeder is not None
+        stats.update(await asyncio.to_thread(self._counts))
+        return stats
+
+
+# ===== מופע גלובלי =====
+_webhook_queue = None
+_queue_lock = threading.Lock()
+
+def get_webhook_queue() -> WebhookQueue:
+    """קבלת מופע יחיד של תור ה-webhooks"""
+    global _webhook_queue
+    with _queue_lock:
+        if _webhook_queue is None:
+            _webhook_queue = WebhookQueue()
+    return _webhook_queue
\ No newline at end of file
@@ -1,7 +1,7 @@
 import re
 import json
+import asyncio
 import logging
-import httpx
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List, Any
 from fastapi import Request
@@ -16,23 +16,46 @@ from config import (
     get_dashboard_url,
     get_contacts_merge_url
 )
-from google_services import get_google_services
+from async_google_services import get_async_google_services
 from ai_analyzer import get_ai_analyzer
 from auth_system import get_auth_manager
+from receipt_hashing import content_hash, perceptual_hash
+from receipt_images import prepare_receipt_image
+from chat_dispatcher import ChatDispatcher
+from green_api_client import get_green_api_client
+from outbound_messages import get_outbound_scheduler
 
 logger = logging.getLogger(__name__)
 
+# תשובות שמאשרות לשמור קבלה כפולה כהוצאה נוספת - רק כשהן כל ההודעה
+# (אחרת "כן" היה מתאים גם ל"עדכן..." או ל"לכן...")
+DUPLICATE_CONFIRM_WORDS = ['שמור שוב', 'שמרי שוב', 'כן', 'save again']
+
+# שדות שמועתקים מההוצאה המקורית כששומרים שוב את אותו קובץ בדיוק (SHA-256 זהה) -
+# בלי ניתוח והעלאה חוזרים. תמונה שרק דומה (dHash קרוב) עוברת ניתוח והעלאה משלה
+DUPLICATE_COPY_FIELDS = [
+    'amount', 'vendor', 'category', 'date', 'payment_method', 'description',
+    'receipt_image_url', 'confidence', 'needs_review', 'image_sha256', 'image_phash'
+]
+
 class WhatsAppBotHandler:
     """מטפל בוט WhatsApp מאוחד"""
     
     def __init__(self):
-        self.gs = get_google_services()
+        # כל הקריאות ל-Sheets/Drive רצות ב-thread pool כדי לא לחסום את ה-event loop
+        self.gs = get_async_google_services()
         self.ai = get_ai_analyzer()
         self.auth = get_auth_manager()
+        self.green_api = get_green_api_client()
+        self.outbound = get_outbound_scheduler()
         
         # cache לזיכרון קצר מועד
         self.recent_expenses = {}  # {group_id: last_expense}
         self.last_messages = {}    # {group_id: last_message_time}
+        self.pending_duplicates = {}  # {group_id: {expense, image_data, hashes}} - קבלה כפולה שממתינה לאישור
+        
+        # הודעות של אותו זוג מעובדות לפי הסדר, זוגות שונים במקביל
+        self.dispatcher = ChatDispatcher(self.process_webhook)
         
         logger.info("✅ WhatsApp Bot Handler initialized")
     
@@ -52,6 +75,11 @@ class WhatsAppBotHandler:
             auth_header == f"Bearer {WEBHOOK_SHARED_SECRET}"
         )
     
+    def dispatch(self, payload: Dict) -> asyncio.Future:
+        """העברת webhook לנתיב של הצ'אט שלו - מחזיר Future עם תוצאת process_webhook"""
+        chat_id = payload.get("senderData", {}).get("chatId", "")
+        return self.dispatcher.submit(chat_id, payload)
+    
     async def process_webhook(self, payload: Dict) -> Dict:
         """עיבוד webhook נכנס מWhatsApp"""
         
@@ -70,7 +98,7 @@ class WhatsAppBotHandler:
                 return {"status": "ignored", "reason": "no_chat_id"}
             
             # בדיקה שהקבוצה קיימת במערכת - זה הביטחון שלנו!
-            couple = self.gs.get_couple_by_group_id(chat_id)
+            couple = await self.gs.get_couple_by_group_id(chat_id)
             if not couple:
                 logger.info(f"📝 Group not found in system: {chat_id}")
                 # לא שולח הודעה - פשוט מתעלם (זה מה שביקשת!)
@@ -88,8 +116,19 @@ class WhatsAppBotHandler:
                 return {"status": "ignored", "message_type": message_type}
             
         except Exception as e:
+            # הטיפול בהודעה עצמו תופס את החריגות שלו - כאן עוד לא נעשה כלום, אפשר לנסות שוב
             logger.error(f"❌ Webhook processing failed: {e}")
-            return {"status": "error", "error": str(e)}
+            return {"status": "error", "error": str(e), "retryable": True}
+    
+    async def report_failure(self, payload: Dict):
+        """הודעת שגיאה לזוג אחרי שכל הניסיונות של הודעה נכשלו
+        
+        ניסיון שהחזיר retryable לא שלח כלום לזוג, כדי שלא תישלח הודעת שגיאה על
+        כל ניסיון. קבוצה שלא רשומה במערכת לא מקבלת הודעה.
+        """
+        chat_id = payload.get("senderData", {}).get("chatId", "")
+        if chat_id and await self.gs.get_couple_by_group_id(chat_id):
+            await self._send_message(chat_id, BOT_MESSAGES["error"])
     
     async def _handle_text_message(self, chat_id: str, message_data: Dict, couple: Dict) -> Dict:
         """טיפול בהודעות טקסט"""
@@ -103,6 +142,11 @@ class WhatsAppBotHandler:
             
             logger.info(f"📝 Processing text: {text[:50]}...")
             
+            # קבלה כפולה שממתינה לאישור - כל הודעה אחרת מבטלת אותה
+            pending = self.pending_duplicates.pop(chat_id, None)
+            if pending and text.lower().rstrip('!.').strip() in DUPLICATE_CONFIRM_WORDS:
+                return await self._save_duplicate_receipt(chat_id, pending)
+            
             # פקודות מערכת
             if await self._handle_system_commands(chat_id, text, couple):
                 return {"status": "system_command_handled"}
@@ -117,7 +161,7 @@ class WhatsAppBotHandler:
             
             if expense_data:
                 # נמצאה הוצאה חדשה
-                success = self.gs.save_expense(expense_data)
+                success = await self.gs.save_expense(expense_data)
                 
                 if success:
                     # שליחת אישור
@@ -154,6 +198,9 @@ class WhatsAppBotHandler:
         """טיפול בתמונות קבלות"""
         
         try:
+            # תמונה חדשה מבטלת קבלה כפולה שעוד ממתינה לאישור
+            self.pending_duplicates.pop(chat_id, None)
+            
             # הורדת התמונה
             image_data = await self._download_image(message_data)
             
@@ -163,62 +210,130 @@ class WhatsAppBotHandler:
             
             logger.info(f"📸 Processing image ({len(image_data)} bytes)")
             
-            # ניתוח עם AI
-            receipt_data = self.ai.analyze_receipt_image(image_data, chat_id)
-            
-            # העלאה לדרייב
-            receipt_url = self.gs.upload_receipt_image(
-                chat_id, 
-                image_data, 
-                f"receipt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-            )
-            
-            if receipt_url:
-                receipt_data['receipt_image_url'] = receipt_url
+            # קבלה שכבר נשלחה לקבוצה - בלי ניתוח AI והעלאה לדרייב נוספים
+            image_sha256 = content_hash(image_data)
+            image_phash = await asyncio.to_thread(perceptual_hash, image_data)
+            duplicate = await self.gs.find_expense_by_image(chat_id, image_sha256, image_phash)
+        
+        except Exception as e:
+            # עוד לא נותח, הועלה או נשמר כלום - התור ינסה שוב בלי הודעת שגיאה לזוג
+            logger.warning(f"⚠️ Image receipt lookup failed, will retry: {e}")
+            return {"status": "error", "error": str(e), "retryable": True}
+        
+        try:
+            if duplicate:
+                # התמונה נשמרת - אם זו הוצאה אחרת היא תנותח ותועלה כרגיל
+                self.pending_duplicates[chat_id] = {
+                    "expense": duplicate,
+                    "image_data": image_data,
+                    "image_sha256": image_sha256,
+                    "image_phash": image_phash
+                }
+                await self._send_message(chat_id, BOT_MESSAGES["duplicate_receipt"].format(
+                    vendor=duplicate.get('vendor', 'ספק'),
+                    amount=float(duplicate.get('amount') or 0)
+                ))
+                logger.info(f"🔁 Duplicate receipt of {duplicate.get('expense_id')}")
+                return {"status": "duplicate_receipt", "expense": duplicate}
+            
+            return await self._process_receipt_image(chat_id, image_data, image_sha256, image_phash)
             
-            # בדיקה אם התמונה לא ברורה
-            if receipt_data.get('needs_review') or receipt_data.get('amount', 0) == 0:
-                # תמונה לא ברורה - בקש פרטים
-                await self._send_message(chat_id, """😅 התמונה קצת לא ברורה...
+        except Exception as e:
+            logger.error(f"❌ Image processing failed: {e}")
+            await self._send_message(chat_id, BOT_MESSAGES["error"])
+            return {"status": "error", "error": str(e)}
+    
+    async def _process_receipt_image(self, chat_id: str, image_data: bytes,
+                                     image_sha256: str, image_phash: str) -> Dict:
+        """ניתוח קבלה, העלאה לדרייב ושמירת ההוצאה"""
+        # עותק מוקטן בגווני אפור ל-AI ועותק דחוס לארכיון - עיבוד CPU מחוץ ל-event loop
+        prepared = await asyncio.to_thread(prepare_receipt_image, image_data)
+        
+        # ניתוח עם AI והעלאה לדרייב במקביל - תלויים רק בתמונה, וההוצאה נשמרת כששניהם מסתיימים
+        analysis = asyncio.to_thread(self.ai.analyze_receipt_image, prepared["vision"], chat_id)
+        upload = self.gs.upload_receipt_image(
+            chat_id, 
+            prepared["archive"], 
+            f"receipt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{prepared['archive_extension']}",
+            prepared["archive_mimetype"]
+        )
+        receipt_data, receipt_url = await asyncio.gather(analysis, upload)
+        
+        receipt_data['image_sha256'] = image_sha256
+        receipt_data['image_phash'] = image_phash
+        
+        if receipt_url:
+            receipt_data['receipt_image_url'] = receipt_url
+        
+        # בדיקה אם התמונה לא ברורה
+        if receipt_data.get('needs_review') or receipt_data.get('amount', 0) == 0:
+            # תמונה לא ברורה - בקש פרטים
+            await self._send_message(chat_id, """😅 התמונה קצת לא ברורה...
 
 רק תכתבו לי:
 💰 כמה שילמתם?
 🏪 לאיזה ספק?
 
 ואני אדאג לשמור!""")
-                
-                # שמור בכל זאת עם needs_review
-                receipt_data['needs_review'] = True
-                self.gs.save_expense(receipt_data)
-                
-                return {"status": "image_unclear", "expense": receipt_data}
-            
-            # שמירה בדאטא בייס
-            success = self.gs.save_expense(receipt_data)
-            
-            if success:
-                # הודעת אישור מעוצבת
-                message = BOT_MESSAGES["receipt_saved"].format(
-                    vendor=receipt_data.get('vendor', 'ספק'),
-                    amount=receipt_data.get('amount', 0),
-                    category=receipt_data.get('category', 'אחר')
-                )
-                
-                await self._send_message(chat_id, message)
-                
-                # שמירה בזיכרון
-                self.recent_expenses[chat_id] = receipt_data
-                
-                logger.info(f"✅ Receipt processed successfully: {receipt_data.get('vendor')}")
-                return {"status": "receipt_processed", "expense": receipt_data}
-            else:
-                await self._send_message(chat_id, BOT_MESSAGES["error"])
-                return {"status": "save_failed"}
             
-        except Exception as e:
-            logger.error(f"❌ Image processing failed: {e}")
+            # שמור בכל זאת עם needs_review
+            receipt_data['needs_review'] = True
+            await self.gs.save_expense(receipt_data)
+            
+            return {"status": "image_unclear", "expense": receipt_data}
+        
+        # שמירה בדאטא בייס
+        success = await self.gs.save_expense(receipt_data)
+        
+        if success:
+            # הודעת אישור מעוצבת
+            message = BOT_MESSAGES["receipt_saved"].format(
+                vendor=receipt_data.get('vendor', 'ספק'),
+                amount=receipt_data.get('amount', 0),
+                category=receipt_data.get('category', 'אחר')
+            )
+            
+            await self._send_message(chat_id, message)
+            
+            # שמירה בזיכרון
+            self.recent_expenses[chat_id] = receipt_data
+            
+            logger.info(f"✅ Receipt processed successfully: {receipt_data.get('vendor')}")
+            return {"status": "receipt_processed", "expense": receipt_data}
+        else:
             await self._send_message(chat_id, BOT_MESSAGES["error"])
-            return {"status": "error", "error": str(e)}
+            return {"status": "save_failed"}
+    
+    async def _save_duplicate_receipt(self, chat_id: str, pending: Dict) -> Dict:
+        """שמירת קבלה כפולה כהוצאה נוספת אחרי אישור
+        
+        אותו קובץ בדיוק - הניתוח והקישור לדרייב מההוצאה המקורית. תמונה שרק דומה
+        עשויה להיות קבלה אחרת באותה תבנית, ולכן היא מנותחת ומועלית כרגיל.
+        """
+        duplicate = pending["expense"]
+        if str(duplicate.get('image_sha256', '')) != pending["image_sha256"]:
+            return await self._process_receipt_image(
+                chat_id, pending["image_data"], pending["image_sha256"], pending["image_phash"]
+            )
+        
+        expense_data = {field: duplicate.get(field, '') for field in DUPLICATE_COPY_FIELDS}
+        expense_data['group_id'] = chat_id
+        
+        success = await self.gs.save_expense(expense_data)
+        
+        if not success:
+            await self._send_message(chat_id, BOT_MESSAGES["error"])
+            return {"status": "save_failed"}
+        
+        message = BOT_MESSAGES["receipt_saved"].format(
+            vendor=expense_data.get('vendor') or 'ספק',
+            amount=float(expense_data.get('amount') or 0),
+            category=expense_data.get('category') or 'אחר'
+        )
+        await self._send_message(chat_id, message)
+        
+        self.recent_expenses[chat_id] = expense_data
+        return {"status": "receipt_processed", "expense": expense_data}
     
     async def _handle_system_commands(self, chat_id: str, text: str, couple: Dict) -> bool:
         """טיפול בפקודות מערכת"""
@@ -275,7 +390,7 @@ class WhatsAppBotHandler:
             
             if update_type == 'delete':
                 # מחיקת הוצאה
-                success = self.gs.delete_expense(recent_expense.get('expense_id'))
+                success = await self.gs.delete_expense(recent_expense.get('expense_id'))
                 if success:
                     await self._send_message(chat_id, "✅ ההוצאה נמחקה")
                     self.recent_expenses[chat_id] = None
@@ -285,7 +400,7 @@ class WhatsAppBotHandler:
             else:
                 # עדכון הוצאה
                 updates = {update_type: new_value}
-                success = self.gs.update_expense(recent_expense.get('expense_id'), updates)
+                success = await self.gs.update_expense(recent_expense.get('expense_id'), updates)
                 
                 if success:
                     # עדכון הזיכרון המקומי
@@ -309,24 +424,17 @@ class WhatsAppBotHandler:
         """שליחת סיכום הוצאות"""
         
         try:
-            expenses = self.gs.get_expenses_by_group(chat_id)
-            active_expenses = [exp for exp in expenses if exp.get('status') == 'active']
+            summary = await self.gs.get_expense_summary(chat_id)
             
-            if not active_expenses:
+            if not summary["count"]:
                 await self._send_message(chat_id, "📝 עדיין אין הוצאות רשומות")
                 return
             
-            total_amount = sum(float(exp.get('amount', 0)) for exp in active_expenses)
-            total_count = len(active_expenses)
-            
-            # הוצאה הגדולה ביותר
-            max_expense = max(active_expenses, key=lambda x: float(x.get('amount', 0)))
+            total_amount = summary["total_amount"]
+            total_count = summary["count"]
             
             # קטגוריות
-            categories = {}
-            for exp in active_expenses:
-                cat = exp.get('category', 'אחר')
-                categories[cat] = categories.get(cat, 0) + float(exp.get('amount', 0))
+            categories = summary["by_category"]
             
             top_category = max(categories.items(), key=lambda x: x[1]) if categories else ('אחר', 0)
             
@@ -337,7 +445,7 @@ class WhatsAppBotHandler:
 📊 **ממוצע לקבלה**: {total_amount/total_count:,.0f} ₪
 
 🔝 **הוצאה הגדולה ביותר**:
-{max_expense.get('vendor', 'לא ידוע')} - {float(max_expense.get('amount', 0)):,.0f} ₪
+{summary['max_vendor'] or 'לא ידוע'} - {summary['max_amount']:,.0f} ₪
 
 🏷️ **קטגוריה יקרה ביותר**:
 {top_category[0]} - {top_category[1]:,.0f} ₪
@@ -362,16 +470,15 @@ class WhatsAppBotHandler:
                 logger.error("No download URL found in image message")
                 return None
             
-            # הורדת התמונה
-            async with httpx.AsyncClient() as client:
-                response = await client.get(download_url, timeout=30)
-                
-                if response.status_code == 200:
-                    return response.content
-                else:
-                    logger.error(f"Failed to download image: {response.status_code}")
-                    return None
-                    
+            # הורדת התמונה - דרך ה-pool המשותף
+            response = await self.green_api.download(download_url, timeout=30)
+            
+            if response.status_code == 200:
+                return response.content
+            else:
+                logger.error(f"Failed to download image: {response.status_code}")
+                return None
+            
         except Exception as e:
             logger.error(f"❌ Image download failed: {e}")
             return None
@@ -384,23 +491,9 @@ class WhatsAppBotHandler:
                 logger.error("WhatsApp credentials not configured")
                 return False
             
-            url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/sendMessage/{GREENAPI_TOKEN}"
+            # דרך תור ההודעות היוצאות - קצב שליחה, איחוד הודעות וניסיונות חוזרים
+            return await self.outbound.send(chat_id, message)
             
-            payload = {
-                "chatId": chat_id,
-                "message": message
-            }
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=payload, timeout=10)
-                
-                if response.status_code == 200:
-                    logger.info(f"✅ Message sent to {chat_id}")
-                    return True
-                else:
-                    logger.error(f"❌ Failed to send message: {response.status_code}")
-                    return False
-                    
         except Exception as e:
             logger.error(f"❌ Error sending message: {e}")
             return False
@@ -418,7 +511,7 @@ class WhatsAppBotHandler:
         try:
             # בדיקת Google Services
             if self.gs:
-                gs_health = self.gs.health_check()
+                gs_health = self.gs.backend.health_check()
                 checks["google_services"] = all(gs_health.values())
             
             # בדיקת AI